@@ -2,12 +2,30 @@
 
 from fastapi import APIRouter, UploadFile, File, Form, Request, HTTPException
 from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from services.pdf_service import (
     process_and_index_pdf,
     ask_pdf,
     ask_all_pdfs,
+    stream_ask_pdf,
+    stream_ask_all_pdfs,
+    ask_all_pdfs_batch,
     reindex_all_pdfs,
 )
+from config import embedding_model, document_cache, answer_cache
+from services.answer_cache import cache_allowed
+from services.answer_stream import SSE_HEADERS, message_events, sse
+from services.vectorstore_manager import index_stats
+from services.s3_service import s3_metrics
+from utils.pdf_parser import pdf_text_cache
+from services.jobs import (
+    JobConflict,
+    start_mutation_job,
+    mutation_lock,
+    get_job,
+    list_jobs,
+    cancel_job,
+)
 from status import (
     get_indexing_status,
     update_indexing_status,  # For completeness, but you shouldn't need this here!
@@ -21,7 +39,11 @@ async def upload_pdf(
     category: str = Form(...)
 ):
     # All indexing logic/updates are handled within process_and_index_pdf
-    ok, msg = await run_in_threadpool(process_and_index_pdf, pdf.file, pdf.filename, category)
+    try:
+        with mutation_lock():
+            ok, msg = await run_in_threadpool(process_and_index_pdf, pdf.file, pdf.filename, category)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if ok:
         return {"message": msg, "filename": pdf.filename}
     return {"error": msg}
@@ -34,7 +56,7 @@ async def ask_pdf_route(request: Request):
     category = data.get("category")
     if not question or not filename or not category:
         return {"answer": "Missing required fields."}
-    answer = await ask_pdf(question, filename, category)
+    answer = await ask_pdf(question, filename, category, use_cache=cache_allowed(request.headers))
     return {"answer": answer}
 
 @router.post("/api/ask-all-pdfs/")
@@ -44,22 +66,117 @@ async def ask_all_pdfs_route(request: Request):
     category = data.get("category")
     if not question:
         return {"answer": "No question provided."}
-    answer = await ask_all_pdfs(question, category)
+    # Optional metadata filters, e.g. {"asset_id": "P-1001", "failure_type": "bearing", "date": "2024-Q1"}
+    # Send "Cache-Control: no-cache" to bypass the answer cache.
+    try:
+        answer = await ask_all_pdfs(
+            question, category, filters=data.get("filters"), use_cache=cache_allowed(request.headers)
+        )
+    except ValueError as e:  # bad filter
+        raise HTTPException(status_code=400, detail=str(e))
     return {"answer": answer}
 
+# Streaming variants: Server-Sent Events with the sources first, then answer
+# tokens (protocol in services/answer_stream.py).
+@router.post("/api/ask-pdf/stream/")
+async def ask_pdf_stream_route(request: Request):
+    data = await request.json()
+    question = data.get("question")
+    filename = data.get("filename")
+    category = data.get("category")
+    if not question or not filename or not category:
+        events = message_events("Missing required fields.")
+    else:
+        events = await stream_ask_pdf(question, filename, category, use_cache=cache_allowed(request.headers))
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/api/ask-all-pdfs/stream/")
+async def ask_all_pdfs_stream_route(request: Request):
+    data = await request.json()
+    question = data.get("question")
+    category = data.get("category")
+    if not question:
+        events = message_events("No question provided.")
+    else:
+        try:
+            events = await stream_ask_all_pdfs(
+                question, category, filters=data.get("filters"), use_cache=cache_allowed(request.headers)
+            )
+        except ValueError as e:  # bad filter
+            raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/api/ask-all-pdfs/batch/")
+async def ask_all_pdfs_batch_route(request: Request):
+    """
+    Many questions with the same optional category and filters:
+    {"questions": [...], "category": ..., "filters": {...}, "ordered": false}.
+    Answers are sent as Server-Sent Events as they complete (in question order
+    if "ordered"): "answer" {index, question, answer} or "error" {index,
+    question, error} per question, then "done".
+    """
+    data = await request.json()
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+        raise HTTPException(status_code=400, detail="questions must be a non-empty list of strings.")
+    try:
+        results = await ask_all_pdfs_batch(
+            questions, data.get("category"), filters=data.get("filters"),
+            use_cache=cache_allowed(request.headers), ordered=bool(data.get("ordered")),
+        )
+    except ValueError as e:  # bad filter
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        async for i, answer, error in results:
+            if error is None:
+                yield sse("answer", {"index": i, "question": questions[i], "answer": answer})
+            else:
+                yield sse("error", {"index": i, "question": questions[i], "error": error})
+        yield sse("done", {"questions": len(questions)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/api/indexing-status/")
 def indexing_status_route():
     # Use the getter so future implementations are thread-safe
     return get_indexing_status()
 
-@router.post("/api/reindex-pdfs/")
-async def reindex_pdfs_route():
+@router.get("/api/cache-stats/")
+def cache_stats_route():
+    return {
+        "embeddings": embedding_model.stats(),
+        "index": index_stats(),
+        "documents": document_cache.stats(),
+        "pdf_text": pdf_text_cache().stats(),
+        "answers": answer_cache.stats(),
+        "s3": s3_metrics.stats(),
+    }
+
+@router.post("/api/reindex-pdfs/", status_code=202)
+def reindex_pdfs_route(full: bool = False):
+    # Runs as a background job; poll /api/jobs/{job_id} or /api/indexing-status/.
+    # Incremental by default; pass ?full=true to rebuild from scratch.
     try:
-        # All status update logic handled inside reindex_all_pdfs
-        await run_in_threadpool(reindex_all_pdfs)
-        return {"message": "Re-indexing started"}
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"[ERROR] Re-indexing failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        job = start_mutation_job("reindex", reindex_all_pdfs, incremental=not full)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Re-indexing started", "job_id": job.id}
+
+@router.get("/api/jobs/")
+def list_jobs_route():
+    return {"jobs": list_jobs()}
+
+@router.get("/api/jobs/{job_id}")
+def job_status_route(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.post("/api/jobs/{job_id}/cancel")
+def cancel_job_route(job_id: str):
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
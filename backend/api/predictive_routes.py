@@ -1,8 +1,10 @@
+import io
+import asyncio
+from functools import partial
 from fastapi import APIRouter, UploadFile, File, Form
 from services.s3_service import upload_pdf_to_s3
-from services.langgraph_predictive import run_predictive_workflow
-from utils.pdf_parser import parse_pdf_to_text
-import os
+from services.langgraph_predictive import arun_predictive_workflow
+from utils.pdf_parser import parse_pdf_bytes_to_text
 
 router = APIRouter()
 
@@ -10,19 +12,17 @@ router = APIRouter()
 async def predictive_analyze(pdf: UploadFile = File(...), question: str = Form(None)):
     PREDICTIVE_ANALYTICS_FOLDER = "Asset_PredictiveAnalytics"
 
-    # Save PDF to temp
-    temp_path = f"./tmp/{pdf.filename}"
-    with open(temp_path, "wb") as f:
-        f.write(await pdf.read())
-
-    # Upload to S3 (hardcoded folder)
-    with open(temp_path, "rb") as f:
-        upload_pdf_to_s3(f, pdf.filename, folder=PREDICTIVE_ANALYTICS_FOLDER)
+    # Read the upload once; it is archived to S3 (hardcoded folder) while it
+    # is parsed from memory.
+    data = await pdf.read()
+    upload = asyncio.get_running_loop().run_in_executor(
+        None, partial(upload_pdf_to_s3, io.BytesIO(data), pdf.filename, folder=PREDICTIVE_ANALYTICS_FOLDER)
+    )
 
     # Parse PDF and run LangGraph workflow
-    sensor_log_text = parse_pdf_to_text(temp_path)
-    result = run_predictive_workflow(sensor_log_text, question)
-
-    # Clean up
-    os.remove(temp_path)
+    try:
+        sensor_log_text = await asyncio.to_thread(parse_pdf_bytes_to_text, data, pdf.filename)
+        result = await arun_predictive_workflow(sensor_log_text, question)
+    finally:
+        await upload
     return result
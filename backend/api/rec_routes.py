@@ -1,7 +1,10 @@
 # backend/api/rec_routes.py
 
-from fastapi import APIRouter, Request
-from services.rec_service import contextual_recommendation, semantic_search
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from services.rec_service import contextual_recommendation, stream_contextual_recommendation, semantic_search
+from services.answer_cache import cache_allowed
+from services.answer_stream import SSE_HEADERS, error_events
 
 router = APIRouter()
 
@@ -11,14 +14,38 @@ async def contextual_recommendation_route(request: Request):
     question = data.get("question")
     if not question:
         return {"error": "Missing question."}
-    result = await contextual_recommendation(question)
+    try:
+        result = await contextual_recommendation(
+            question, filters=data.get("filters"), use_cache=cache_allowed(request.headers)
+        )
+    except ValueError as e:  # bad filter
+        raise HTTPException(status_code=400, detail=str(e))
     return result
 
+# Server-Sent Events: recommendations first, then answer tokens (see services/answer_stream.py).
+@router.post("/api/contextual-recommendation/stream/")
+async def contextual_recommendation_stream_route(request: Request):
+    data = await request.json()
+    question = data.get("question")
+    if not question:
+        events = error_events("Missing question.")
+    else:
+        try:
+            events = await stream_contextual_recommendation(
+                question, filters=data.get("filters"), use_cache=cache_allowed(request.headers)
+            )
+        except ValueError as e:  # bad filter
+            raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/api/semantic-search/")
 async def semantic_search_route(request: Request):
     data = await request.json()
     query = data.get("query")
     if not query:
         return {"error": "Missing query."}
-    results = await semantic_search(query)
+    try:
+        results = await semantic_search(query, filters=data.get("filters"))
+    except ValueError as e:  # bad filter
+        raise HTTPException(status_code=400, detail=str(e))
     return {"results": results}
@@ -0,0 +1,108 @@
+# /backend/benchmarks/faiss_index_bench.py
+#
+# Recall/latency benchmark for the index types built by services/index_builder.py,
+# on a synthetic clustered corpus. Ground truth is an exact flat search.
+# Run from backend/:
+#     python -m benchmarks.faiss_index_bench [--n 1000000] [--d 256] [--types ivf_flat,ivf_pq,hnsw]
+#
+# Latency is single-query search on one thread (one request), so it is
+# comparable with what an API call pays for retrieval.
+
+import time
+import argparse
+import numpy as np
+import faiss
+from services.index_builder import INDEX_TYPES, build_faiss_index, index_code_bytes, set_search_params
+
+
+def make_corpus(n, d, clusters, seed):
+    """Gaussian clusters, generated in blocks so peak memory stays ~1x the corpus."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, d)).astype(np.float32)
+    x = np.empty((n, d), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        stop = min(n, start + 100_000)
+        assignment = rng.integers(0, clusters, size=stop - start)
+        x[start:stop] = centers[assignment] + 0.3 * rng.normal(size=(stop - start, d)).astype(np.float32)
+    return x, centers, rng
+
+def make_queries(centers, count, rng):
+    assignment = rng.integers(0, len(centers), size=count)
+    return (centers[assignment] + 0.3 * rng.normal(size=(count, centers.shape[1]))).astype(np.float32)
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(f[f != -1]) & set(t)) / k for f, t in zip(found, truth)]))
+
+def time_queries(index, queries, k):
+    """Search one query at a time; return (results, p50 ms, p99 ms)."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        found[i] = index.search(queries[i:i + 1], k)[1][0]
+        latencies[i] = (time.perf_counter() - started) * 1000
+    return found, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+def report(label, index, found, truth, p50, p99):
+    mb = len(faiss.serialize_index(index)) / 2**20
+    print(f"{label:28} recall@{truth.shape[1]}={recall_at_k(found, truth):.3f}  "
+          f"p50={p50:7.2f} ms  p99={p99:7.2f} ms  disk={mb:8.1f} MB  "
+          f"ram~{index.ntotal * index_code_bytes(index) / 2**20:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--d", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--nprobe", default="4,8,16,32,64")
+    parser.add_argument("--ef-search", default="16,32,64,128,256")
+    parser.add_argument("--pq-m", type=int, default=0, help="PQ sub-quantizers (default: d/4)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    types = [t for t in args.types.split(",") if t]
+    unknown = set(types) - set(INDEX_TYPES)
+    if unknown:
+        parser.error(f"unknown index types: {', '.join(sorted(unknown))}")
+
+    print(f"Corpus: {args.n} x {args.d} float32 in {args.clusters} clusters; "
+          f"{args.queries} queries, k={args.k}")
+    x, centers, rng = make_corpus(args.n, args.d, args.clusters, args.seed)
+    queries = make_queries(centers, args.queries, rng)
+
+    build_threads = faiss.omp_get_max_threads()
+    flat = faiss.IndexFlatL2(args.d)
+    flat.add(x)
+    del x
+    _, truth = flat.search(queries, args.k)
+
+    faiss.omp_set_num_threads(1)
+    found, p50, p99 = time_queries(flat, queries, args.k)
+    report("flat", flat, found, truth, p50, p99)
+
+    for index_type in types:
+        if index_type == "flat":
+            continue
+        faiss.omp_set_num_threads(build_threads)
+        started = time.time()
+        index = build_faiss_index(flat, index_type, pq_m=args.pq_m)
+        print(f"-- {index_type}: built in {time.time() - started:.1f}s")
+        faiss.omp_set_num_threads(1)
+        if index_type == "hnsw":
+            sweep = [("efSearch", int(v), dict(ef_search=int(v))) for v in args.ef_search.split(",")]
+        else:
+            sweep = [("nprobe", int(v), dict(nprobe=int(v))) for v in args.nprobe.split(",")]
+        for name, value, params in sweep:
+            set_search_params(index, **params)
+            found, p50, p99 = time_queries(index, queries, args.k)
+            report(f"{index_type} {name}={value}", index, found, truth, p50, p99)
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# /backend/benchmarks/index_load_bench.py
+#
+# Per-worker load time and memory for INDEX_LOAD_MODE=memory vs mmap.
+# Publishes one synthetic partition to a temporary vectorstore, then starts
+# --workers processes per mode (as uvicorn --workers would), each of which
+# loads the partition and answers a few queries. Run from backend/:
+#     python -m benchmarks.index_load_bench [--n 200000] [--d 1536] [--workers 4]
+#
+# RssAnon is memory private to a worker; RssFile is file pages it has mapped,
+# which the OS page cache shares between all workers.
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import faiss
+
+PARTITION = "bench"
+
+
+def _rss_mb():
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon", "RssFile")):
+                key, value = line.split(":")
+                usage[key] = int(value.split()[0]) / 1024
+    return usage
+
+def _worker(workdir, queries, k, results, done):
+    from services.vectorstore_manager import load_faiss_index, acquire_partition
+    from services.metadata_index import filtered_search_by_vector
+    os.chdir(workdir)
+    started = time.perf_counter()
+    load_faiss_index()
+    with acquire_partition(PARTITION) as snapshot:
+        loaded = time.perf_counter() - started
+        for query in queries:
+            filtered_search_by_vector(snapshot.vectorstore, query[None], k)
+    results.put({"load_s": loaded, **_rss_mb()})
+    # Stay alive until every worker has reported, as server workers would.
+    done.wait()
+
+def publish_corpus(workdir, n, d, seed):
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_core.documents import Document
+    from config import embedding_model
+    from services.vectorstore_manager import publish_partition
+    rng = np.random.default_rng(seed)
+    index = faiss.IndexFlatL2(d)
+    for start in range(0, n, 50_000):
+        index.add(rng.normal(size=(min(n, start + 50_000) - start, d)).astype(np.float32))
+    text = "Equipment: P-1001 Failure Type: Bearing Wear Date: 2024-03-05 " * 12
+    docs = {
+        f"id{i}": Document(page_content=text, metadata={"s3_key": f"{PARTITION}/doc{i // 100}.pdf", "page": i % 100})
+        for i in range(n)
+    }
+    vectorstore = FAISS(embedding_model, index, InMemoryDocstore(docs), dict(enumerate(docs)))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        publish_partition(PARTITION, vectorstore)
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200_000)
+    parser.add_argument("--d", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="index_load_bench_")
+    try:
+        started = time.time()
+        publish_corpus(workdir, args.n, args.d, args.seed)
+        print(f"Published {args.n} x {args.d} chunks in {time.time() - started:.1f}s")
+        queries = np.random.default_rng(args.seed + 1).normal(size=(args.queries, args.d)).astype(np.float32)
+        context = multiprocessing.get_context("spawn")
+        for mode in ("memory", "mmap"):
+            # Workers read INDEX_LOAD_MODE from the environment they are spawned with.
+            os.environ["INDEX_LOAD_MODE"] = mode
+            results, done = context.Queue(), context.Event()
+            workers = [
+                context.Process(target=_worker, args=(workdir, queries, args.k, results, done))
+                for _ in range(args.workers)
+            ]
+            for worker in workers:
+                worker.start()
+            reports = [results.get() for _ in workers]
+            done.set()
+            for worker in workers:
+                worker.join()
+            print(f"{mode:7} x{args.workers}: load {np.mean([r['load_s'] for r in reports]):6.2f}s/worker  "
+                  f"RssAnon {np.mean([r['RssAnon'] for r in reports]):8.1f} MB/worker  "
+                  f"RssFile {np.mean([r['RssFile'] for r in reports]):8.1f} MB/worker (shared)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# /backend/benchmarks/metadata_extractor_bench.py
+#
+# Micro-benchmark: MetadataExtractor vs. the previous four re.search calls
+# per chunk, plus a combined single-regex scan (one alternation over all
+# labels) for reference. Run from backend/:
+#     python -m benchmarks.metadata_extractor_bench [--chunks 20000]
+
+import re
+import time
+import random
+import argparse
+from utils.metadata_extractor import MetadataExtractor
+
+WORDS = [
+    "pump", "motor", "valve", "inspect", "replace", "lubricate", "torque",
+    "check", "seal", "bearing", "vibration", "pressure", "operator", "shift",
+]
+
+
+def legacy_extract(text):
+    """The per-chunk extraction previously copied into pdf_service."""
+    metadata = {}
+    match = re.search(r"(Equipment|Asset)[\s:]+([\w\-]+)", text)
+    if match:
+        metadata["asset_id"] = match.group(2)
+    match = re.search(r"Failure Type[\s:]+([A-Za-z\s]+)", text)
+    if match:
+        metadata["failure_type"] = match.group(1).strip()
+    match = re.search(r"Date[\s:]+(\d{4}-\d{2}-\d{2})", text)
+    if match:
+        metadata["date"] = match.group(1)
+    match = re.search(r"Handled By[\s:]+([A-Za-z\s.]+)", text)
+    if match:
+        metadata["handled_by"] = match.group(1).strip()
+    return metadata
+
+
+COMBINED = re.compile(
+    r"(?=(?:Equipment|Asset)[\s:]+(?P<asset_id>[\w\-]+))"
+    r"|(?=Failure Type[\s:]+(?P<failure_type>[A-Za-z\s]+))"
+    r"|(?=Date[\s:]+(?P<date>\d{4}-\d{2}-\d{2}))"
+    r"|(?=Handled By[\s:]+(?P<handled_by>[A-Za-z\s.]+))"
+)
+
+
+def combined_extract(text):
+    """One regex scan with all fields as zero-width alternatives."""
+    metadata = {}
+    for match in COMBINED.finditer(text):
+        name = match.lastgroup
+        if name not in metadata:
+            metadata[name] = match.group(name).strip()
+            if len(metadata) == 4:
+                break
+    return metadata
+
+
+def make_chunk(rng, size=1000):
+    """~1000 chars of filler, with SAP fields present in some chunks only."""
+    words = []
+    while sum(len(w) + 1 for w in words) < size:
+        words.append(rng.choice(WORDS))
+    lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+    if rng.random() < 0.5:
+        lines.insert(rng.randrange(len(lines)), f"Equipment: P-{rng.randint(1000, 9999)}")
+    if rng.random() < 0.3:
+        lines.insert(rng.randrange(len(lines)), f"Failure Type: {rng.choice(['Bearing Wear', 'Seal Leak'])}")
+    if rng.random() < 0.4:
+        lines.insert(rng.randrange(len(lines)), f"Date: 2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}")
+    if rng.random() < 0.2:
+        lines.insert(rng.randrange(len(lines)), "Handled By: J. Smith")
+    return "\n".join(lines)
+
+
+def bench(fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [make_chunk(rng) for _ in range(args.chunks)]
+    extractor = MetadataExtractor()
+
+    mismatches = sum(1 for t in texts if extractor.extract(t) != legacy_extract(t))
+    print(f"Checked {len(texts)} chunks: {mismatches} mismatches vs legacy extraction")
+
+    mb = sum(len(t) for t in texts) / 1e6
+    legacy = bench(lambda ts: [legacy_extract(t) for t in ts], texts, args.repeat)
+    results = [
+        ("legacy 4x re.search", legacy),
+        ("combined single scan", bench(lambda ts: [combined_extract(t) for t in ts], texts, args.repeat)),
+        ("MetadataExtractor", bench(extractor.extract_many, texts, args.repeat)),
+    ]
+    for label, seconds in results:
+        print(f"{label:22}: {len(texts) / seconds:9.0f} chunks/s  {mb / seconds:6.1f} MB/s  "
+              f"{legacy / seconds:5.2f}x vs legacy")
+
+
+if __name__ == "__main__":
+    main()
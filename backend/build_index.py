@@ -2,66 +2,114 @@
 
 
 import os
-import pickle
+import time
 from glob import glob
-from langchain_community.vectorstores.faiss import FAISS
 from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_openai import OpenAIEmbeddings  # or your embedding class
 from dotenv import load_dotenv
+from services.embedding_cache import CachedEmbeddings
+from services.index_builder import ShardedIndexWriter, write_index_version
+from services.chunk_store import ChunkStore
+from services.metadata_index import MetadataIndex
+from services.index_log import locked
+from utils.metadata_extractor import metadata_extractor
+from utils.pdf_parser import load_pdf_pages
 
 # --------------- CONFIGURE THESE ---------------
 PDF_FOLDER = "./pdfs"  # path to your local folder containing PDFs
-INDEX_DIR = "faiss_index"  # output directory for FAISS index and docs.pkl
+VECTORSTORE_DIR = "vectorstore"  # the server's index directory; a new version is published into it
+PARTITION = "_uncategorized"  # partition of chunks without an S3 category folder
 load_dotenv()
 openai_api_key = os.environ.get("OPENAI_API_KEY")
 if not openai_api_key:
     raise RuntimeError("OPENAI_API_KEY environment variable not set!")
-EMBEDDING_MODEL = OpenAIEmbeddings(openai_api_key=openai_api_key)
+EMBEDDING_MODEL = CachedEmbeddings(
+    OpenAIEmbeddings(openai_api_key=openai_api_key),
+    path=os.environ.get("EMBEDDING_CACHE_PATH", os.path.join("vectorstore", "embedding_cache.sqlite")),
+    max_entries=int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+)
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 256  # chunks embedded and added per batch
+SHARD_SIZE = 50_000     # vectors per on-disk shard
 # -----------------------------------------------
 
 def get_all_pdfs(pdf_folder):
     return glob(os.path.join(pdf_folder, "*.pdf"))
 
-def main():
-    all_docs = []
-    for pdf_path in get_all_pdfs(PDF_FOLDER):
+def iter_pdf_chunks(pdf_paths, splitter):
+    """Yield chunks one PDF at a time, so the corpus is never held in memory."""
+    for pdf_path in pdf_paths:
         fname = os.path.basename(pdf_path)
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
+        docs = load_pdf_pages(pdf_path)
         for doc in docs:
             doc.metadata["source"] = fname
-        all_docs.extend(docs)
-        print(f"Loaded {fname} with {len(docs)} docs")
+        chunks = metadata_extractor.enrich(splitter.split_documents(docs))
+        print(f"Loaded {fname} with {len(docs)} docs, {len(chunks)} chunks")
+        yield from chunks
+
+def publish_version(partition_dir, index, rows, generation):
+    """
+    Write `index` as a new version of the partition at `partition_dir`, in
+    the layout services/vectorstore_manager.py serves, and point CURRENT at
+    it. Running servers pick it up on their next query.
+    """
+    store = ChunkStore(os.path.join(partition_dir, "chunks", f"{generation}.sqlite"), readonly=True)
+    try:
+        metadata_index = MetadataIndex(rows, ((row, doc.metadata) for row, doc in store.iter_documents(rows)))
+    finally:
+        store.close()
+    version = f"v{time.time_ns()}"
+    write_index_version(os.path.join(partition_dir, "versions", version), index, rows, metadata_index, generation)
+    pointer = os.path.join(partition_dir, "CURRENT")
+    with locked(os.path.join(partition_dir, "LOCK")):
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+    return version
 
-    if not all_docs:
+def main():
+    pdf_paths = get_all_pdfs(PDF_FOLDER)
+    if not pdf_paths:
         print("No PDFs found!")
         return
 
-    print(f"Splitting {len(all_docs)} docs...")
     splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    chunks = splitter.split_documents(all_docs)
-    print(f"Got {len(chunks)} chunks.")
+    partition_dir = os.path.join(VECTORSTORE_DIR, "partitions", PARTITION)
+    # Chunk text goes straight to a new chunk store generation of the partition.
+    generation = f"v{time.time_ns()}"
+    writer = ShardedIndexWriter(
+        os.path.join(VECTORSTORE_DIR, "shards", PARTITION),
+        os.path.join(partition_dir, "chunks", f"{generation}.sqlite"),
+        shard_size=SHARD_SIZE,
+    )
 
-    print("Embedding chunks (this may take a while)...")
-    docs = chunks
-    # Batch embedding
-    texts = [doc.page_content for doc in docs]
-    embeddings = EMBEDDING_MODEL.embed_documents(texts)
-    print("Embeddings done.")
+    print("Embedding chunks in batches (this may take a while)...")
+    try:
+        batch = []
+        for chunk in iter_pdf_chunks(pdf_paths, splitter):
+            batch.append(chunk)
+            if len(batch) >= EMBED_BATCH_SIZE:
+                writer.add(batch, None, EMBEDDING_MODEL.embed_documents([doc.page_content for doc in batch]))
+                batch = []
+        if batch:
+            writer.add(batch, None, EMBEDDING_MODEL.embed_documents([doc.page_content for doc in batch]))
+    except BaseException:
+        writer.discard()
+        raise
+    print(f"Embeddings done: {writer.total} chunks.")
 
-    print("Building FAISS index...")
-    text_embeddings = list(zip(texts, embeddings))
-    vectorstore = FAISS.from_embeddings(text_embeddings, EMBEDDING_MODEL)
-    vectorstore.save_local(INDEX_DIR)
-    print(f"FAISS index saved to {INDEX_DIR}")
-
-    docs_path = os.path.join(INDEX_DIR, "docs.pkl")
-    with open(docs_path, "wb") as f:
-        pickle.dump(docs, f)
-    print(f"Document metadata saved to {docs_path}")
+    print("Merging FAISS shards...")
+    merged = writer.merge()
+    if merged is None:
+        writer.discard()
+        print("No chunks to index!")
+        return
+    index, rows = merged
+    version = publish_version(partition_dir, index, rows, generation)
+    print(f"FAISS index published as {partition_dir} version {version}")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,15 @@
 # /backend/config.py
 
 import os
+import httpx
+import openai
 from dotenv import load_dotenv, find_dotenv
 from langchain_openai import OpenAIEmbeddings
 from langchain.prompts import PromptTemplate
 from services.s3_service import sanitize_s3_folder_name
+from services.embedding_cache import CachedEmbeddings
+from services.document_cache import DocumentIndexCache
+from services.answer_cache import AnswerCache
 
 dotenv_path = find_dotenv()
 loaded = load_dotenv(dotenv_path, override=True)
@@ -20,10 +25,105 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 
-VECTORSTORE_PATH = os.path.join("vectorstore", "faiss_index")
+VECTORSTORE_DIR = "vectorstore"
+VECTORSTORE_PATH = os.path.join(VECTORSTORE_DIR, "faiss_index")
 INDEXED_FILES_PATH = os.path.join("vectorstore", "indexed_files.pkl")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("vectorstore", "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# Query embeddings are cached in memory, per process.
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+# Per-document indexes for single-PDF questions about documents not in the
+# main index (see services/document_cache.py): memory budget, then disk.
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", os.path.join("vectorstore", "document_cache"))
+DOCUMENT_CACHE_MAX_MB = int(os.getenv("DOCUMENT_CACHE_MAX_MB", "256"))
+DOCUMENT_CACHE_DISK_MB = int(os.getenv("DOCUMENT_CACHE_DISK_MB", "2048"))
+# Answers of the Q&A endpoints (see services/answer_cache.py), per process.
+# Only exact (normalized) repeats are reused by default. Setting
+# ANSWER_CACHE_SIMILARITY (e.g. 0.98) also reuses the answer to a cached
+# question whose embedding is at least that similar and that mentions the
+# same numbers and negations.
+# ANSWER_CACHE_MAX_ENTRIES=0 disables the cache.
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0")) or None
+# Batch questions (POST /api/ask-all-pdfs/batch/): LLM calls in flight at once per batch.
+ASK_BATCH_CONCURRENCY = int(os.getenv("ASK_BATCH_CONCURRENCY", "8"))
+# Async query path: threads searching the index (see services/index_search.py)
+# and model calls in flight at once per worker (see services/llm_service.py).
+QUERY_SEARCH_WORKERS = int(os.getenv("QUERY_SEARCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+QUERY_LLM_CONCURRENCY = int(os.getenv("QUERY_LLM_CONCURRENCY", "64"))
+# All OpenAI clients of the process (embeddings and chat models) share one
+# keep-alive connection pool, so requests reuse warm TLS connections.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "120"))
+# Build the model clients, open connections to OpenAI and compile the
+# predictive graph at startup instead of on the first requests.
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
 
-embedding_model = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+# Re-index pipeline tuning (see services/index_pipeline.py)
+INDEX_DOWNLOAD_WORKERS = int(os.getenv("INDEX_DOWNLOAD_WORKERS", "8"))
+INDEX_PARSE_WORKERS = int(os.getenv("INDEX_PARSE_WORKERS", str(os.cpu_count() or 1)))
+INDEX_EMBED_BATCH_SIZE = int(os.getenv("INDEX_EMBED_BATCH_SIZE", "256"))
+INDEX_MAX_FILES_IN_FLIGHT = int(os.getenv("INDEX_MAX_FILES_IN_FLIGHT", "32"))
+INDEX_SHARD_SIZE = int(os.getenv("INDEX_SHARD_SIZE", "50000"))
+INDEX_SHARD_DIR = os.path.join("vectorstore", "shards")
+# Partition index type: flat | ivf_flat | ivf_pq | hnsw (see services/index_builder.py).
+# Partitions smaller than INDEX_ANN_MIN_VECTORS stay flat. Build-time parameters
+# (0 = derive from corpus size / dimension) apply when a partition is (re)built;
+# INDEX_NPROBE and INDEX_EF_SEARCH apply on every load.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_ANN_MIN_VECTORS = int(os.getenv("INDEX_ANN_MIN_VECTORS", "20000"))
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "0"))
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+# How published partitions are opened: "memory" reads each index and its documents
+# into the process; "mmap" maps the vectors read-only and reads documents from disk
+# on demand, so uvicorn workers share one copy through the OS page cache.
+INDEX_LOAD_MODE = os.getenv("INDEX_LOAD_MODE", "memory")
+# Updates are appended to a write-ahead log next to the partition's published
+# version instead of rewriting it. A background compactor folds the log into a
+# new version once it reaches INDEX_WAL_MAX_MB or its oldest entry is
+# INDEX_WAL_MAX_AGE_SECONDS old, checking every INDEX_COMPACT_INTERVAL_SECONDS.
+# INDEX_WAL_MAX_MB=0 compacts after every update.
+INDEX_WAL_MAX_MB = int(os.getenv("INDEX_WAL_MAX_MB", "64"))
+INDEX_WAL_MAX_AGE_SECONDS = int(os.getenv("INDEX_WAL_MAX_AGE_SECONDS", "600"))
+INDEX_COMPACT_INTERVAL_SECONDS = int(os.getenv("INDEX_COMPACT_INTERVAL_SECONDS", "30"))
+# Loaded index partitions are evicted (least recently used first) above this; 0 = no limit.
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "4096"))
+
+_openai_limits = httpx.Limits(
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+)
+openai_http_client = openai.DefaultHttpxClient(limits=_openai_limits)
+openai_async_http_client = openai.DefaultAsyncHttpxClient(limits=_openai_limits)
+
+# Every indexing path embeds through this object, so all of them share the on-disk cache.
+embedding_model = CachedEmbeddings(
+    OpenAIEmbeddings(
+        openai_api_key=OPENAI_API_KEY,
+        http_client=openai_http_client,
+        http_async_client=openai_async_http_client,
+    ),
+    path=EMBEDDING_CACHE_PATH,
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    max_query_entries=QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+)
+document_cache = DocumentIndexCache(
+    DOCUMENT_CACHE_DIR,
+    embedding_model,
+    max_bytes=DOCUMENT_CACHE_MAX_MB * 2**20,
+    max_disk_bytes=DOCUMENT_CACHE_DISK_MB * 2**20,
+)
+answer_cache = AnswerCache(
+    embedding_model,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    similarity=ANSWER_CACHE_SIMILARITY,
+)
 
 qa_template = """
 You are a helpful assistant. Use ONLY the context below to answer the user's question.
@@ -3,11 +3,14 @@
 import os
 from fastapi import FastAPI
 from api.pdf_routes import router as pdf_router
-from config import setup_cors
+from config import setup_cors, prompt as rec_prompt, LLM_WARMUP
 from services.s3_service import download_all_pdfs_from_s3
 from services.vectorstore_manager import load_faiss_index
 from api.rec_routes import router as rec_router  # <-- your new router
 from api.predictive_routes import router as predictive_router
+from services.pdf_service import prompt as qa_prompt
+from services.llm_service import warm_up
+from services.langgraph_predictive import compiled_graph
 
 
 PDF_UPLOAD_DIR = "uploads"
@@ -27,17 +30,9 @@ async def startup_event():
     os.makedirs(PDF_UPLOAD_DIR, exist_ok=True)
     print(f"[STARTUP] Upload directory: {os.path.abspath(PDF_UPLOAD_DIR)}")
 
-    pdfs = [
-        f for f in os.listdir(PDF_UPLOAD_DIR)
-        if f.lower().endswith(".pdf")
-        and os.path.isfile(os.path.join(PDF_UPLOAD_DIR, f))
-        and not f.startswith('.')
-    ]
-    if not pdfs:
-        print("[STARTUP] No PDFs found locally. Downloading from S3...")
-        await download_all_pdfs_from_s3(PDF_UPLOAD_DIR)
-    else:
-        print(f"[STARTUP] Found {len(pdfs)} PDFs locally. Skipping S3 download.")
+    # Download new and changed PDFs; unchanged ones are skipped by ETag, so this is cheap on warm nodes.
+    print("[STARTUP] Syncing PDFs from S3...")
+    await download_all_pdfs_from_s3(PDF_UPLOAD_DIR)
 
     # Step 2: Load FAISS index if present
     loaded = load_faiss_index()
@@ -46,4 +41,8 @@ async def startup_event():
     else:
         print("[STARTUP] No FAISS index found. Please re-index or upload PDFs.")
 
-
+    # Step 3: Build the model clients, chains and predictive graph, and open
+    # connections to OpenAI, so the first requests don't pay for it.
+    if LLM_WARMUP:
+        compiled_graph()
+        await warm_up([qa_prompt, rec_prompt])
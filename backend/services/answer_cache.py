@@ -0,0 +1,217 @@
+# /backend/services/answer_cache.py
+
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", str(question)).strip().lower().rstrip("?!. ")
+
+NEGATIONS = frozenset(("not", "no", "never", "without", "none", "nothing", "neither", "nor", "cannot"))
+
+def question_guard(question):
+    """
+    The words of a normalized question that similar questions must share:
+    those with digits (equipment, order and notification numbers, dates)
+    and negations. Embeddings barely separate questions that differ only in these.
+    """
+    words = re.findall(r"\w+", question.replace("n't", " not"))
+    return frozenset(word for word in words if word in NEGATIONS or any(c.isdigit() for c in word))
+
+def answer_scope(endpoint, **params):
+    """
+    Cache scope of an answer: the endpoint plus everything else it depends
+    on (category, filters, document, index version). Only questions with the
+    same scope can share an answer.
+    """
+    return json.dumps([endpoint, params], sort_keys=True, default=str)
+
+def cache_allowed(headers):
+    """False if the request opted out with `Cache-Control: no-cache` (or no-store)."""
+    directives = headers.get("cache-control", "").lower()
+    return "no-cache" not in directives and "no-store" not in directives
+
+
+class AnswerCache:
+    """
+    In-memory cache of LLM answers, in two levels.
+
+    A question is looked up by its normalized text. If `similarity` is set,
+    a miss then compares its query embedding with those of the cached
+    questions in the same scope, and reuses the answer of the most similar
+    one that has at least that cosine similarity and mentions the same
+    numbers and negations (see question_guard). Scopes include the index
+    version, so answers computed before an upload or re-index are never returned after it; they age out
+    under the `max_entries` LRU bound and the `ttl_seconds` expiry.
+
+    Identical questions asked while the first is still being answered wait
+    for that answer instead of making their own LLM call. The answer is
+    computed in a task of its own, so the first caller going away (e.g. a
+    client disconnect) doesn't cancel it for the others.
+    """
+
+    def __init__(self, embeddings, max_entries=1000, ttl_seconds=3600, similarity=None):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        # (scope, normalized question) -> (answer, unit query vector or None, expiry, question_guard), LRU first.
+        self._entries = OrderedDict()
+        # (scope, normalized question) -> Future of the answer being computed.
+        self._in_flight = {}
+        # Tasks computing those answers, referenced until they finish.
+        self._tasks = set()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _most_similar(self, key, vector, now):
+        scope, guard = key[0], question_guard(key[1])
+        best_key, best_score = None, self.similarity
+        for cached_key, (_, cached_vector, expires, cached_guard) in self._entries.items():
+            if cached_key[0] != scope or cached_vector is None or expires < now or cached_guard != guard:
+                continue
+            score = float(cached_vector @ vector)
+            if score >= best_score:
+                best_key, best_score = cached_key, score
+        return best_key
+
+    async def _query_vector(self, question):
+        vector = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _put(self, key, answer, vector):
+        guard = question_guard(key[1]) if vector is not None else None
+        self._entries[key] = (answer, vector, time.time() + self.ttl_seconds, guard)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _similar(self, key, question):
+        """(answer to the most similar cached question or None, unit query vector or None)."""
+        if not self.enabled or not self.similarity:
+            return None, None
+        vector = await self._query_vector(question)
+        with self._lock:
+            similar = self._most_similar(key, vector, time.time())
+            if similar is None:
+                return None, vector
+            self.similar_hits += 1
+            self._entries.move_to_end(similar)
+            return self._entries[similar][0], vector
+
+    async def get_or_compute(self, scope, question, compute, use_cache=True):
+        """
+        The cached answer to `question` in `scope`, or the result of awaiting
+        `compute()`, which is then cached. With use_cache=False the cache is
+        neither read nor written.
+        """
+        if not use_cache:
+            return await compute()
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._get(key, time.time()) if self.enabled else None
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                # A running Future can't be cancelled by a waiter that gives up.
+                future.set_running_or_notify_cancel()
+            else:
+                self.coalesced += 1
+        if owner:
+            task = asyncio.ensure_future(self._compute(key, question, compute, future))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        # The owner waits like everyone else: cancelling a wait leaves the
+        # running Future, and so the task, alone.
+        return await asyncio.wrap_future(future)
+
+    async def _compute(self, key, question, compute, future):
+        """Answer `question` for get_or_compute() and settle `future` with the answer or error."""
+        try:
+            answer, vector = await self._similar(key, question)
+            if answer is None:
+                with self._lock:
+                    self.misses += 1
+                answer = await compute()
+                if self.enabled:
+                    with self._lock:
+                        self._put(key, answer, vector)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            return
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(answer)
+
+    async def lookup(self, scope, question, use_cache=True):
+        """
+        For callers that produce the answer themselves (e.g. while streaming
+        it): (cached answer or None, query vector to pass on to store()).
+        """
+        if not use_cache or not self.enabled:
+            return None, None
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._get(key, time.time())
+            if entry is not None:
+                self.hits += 1
+                return entry[0], None
+        answer, vector = await self._similar(key, question)
+        if answer is None:
+            with self._lock:
+                self.misses += 1
+        return answer, vector
+
+    def store(self, scope, question, answer, vector=None):
+        """Cache `answer` to `question` in `scope`, after a lookup() miss."""
+        if self.enabled:
+            with self._lock:
+                self._put((scope, normalize_question(question)), answer, vector)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.coalesced + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "in_flight": len(self._in_flight),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.similar_hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,66 @@
+# /backend/services/answer_stream.py
+
+import json
+from services.llm_service import stream_llm
+
+# Server-Sent Events protocol of the streaming Q&A endpoints, in order:
+#   event: sources  - the retrieved chunks ({content, filename, metadata}), sent
+#                     as soon as retrieval is done
+#   event: token    - {"text": ...}, the answer as the model generates it
+#   event: answer   - {"answer": ...}, the final answer as the non-streaming
+#                     endpoint returns it; it replaces the streamed text when a
+#                     "not found" answer is swapped for a fallback snippet
+#   event: error    - {"error": ...}, if the model call fails mid-stream
+# Requests answered without the model (no index, no such PDF) only get "answer",
+# or "error" where the non-streaming endpoint returns {"error": ...}.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse(event, data):
+    """One Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def previews(docs):
+    """Chunk previews, as the recommendation and search endpoints return them."""
+    return [
+        {
+            "content": doc.page_content[:400] + ("..." if len(doc.page_content) > 400 else ""),
+            "filename": doc.metadata.get("source", "Unknown"),
+            "metadata": doc.metadata,
+        }
+        for doc in docs
+    ]
+
+async def message_events(answer):
+    """Events of a request answered without the model."""
+    yield sse("answer", {"answer": answer})
+
+async def error_events(error):
+    yield sse("error", {"error": error})
+
+async def answer_events(question, docs, prompt, finish, cached=None, sources=None, store=None):
+    """
+    Events answering `question` from `docs`: their previews (or `sources`),
+    then the answer streamed from gpt-4o, prompted like RetrievalQA's "stuff"
+    chain. `finish(raw_answer, docs)` gives the final answer; `store(answer)`
+    is called with it once complete. A `cached` answer is sent as one token
+    without calling the model.
+    """
+    yield sse("sources", previews(docs) if sources is None else sources)
+    if cached is not None:
+        yield sse("token", {"text": cached})
+        yield sse("answer", {"answer": cached})
+        return
+    parts = []
+    try:
+        async for text in stream_llm(question, docs, prompt):
+            parts.append(text)
+            yield sse("token", {"text": text})
+    except Exception as e:
+        print(f"[STREAM] Answer generation failed: {e}")
+        yield sse("error", {"error": "Answer generation failed."})
+        return
+    answer = finish("".join(parts).strip(), docs)
+    if store is not None:
+        store(answer)
+    yield sse("answer", {"answer": answer})
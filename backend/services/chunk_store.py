@@ -0,0 +1,171 @@
+# /backend/services/chunk_store.py
+
+import os
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+
+# Rows per IN (...) query when reading many chunks at once.
+_BATCH = 500
+
+
+def chunk_source(metadata):
+    """The S3 key (or, for legacy chunks, the filename) a chunk was indexed from."""
+    return metadata.get("s3_key") or metadata.get("source")
+
+def remove_chunk_store(path):
+    """Delete the chunk store at `path`, with its SQLite WAL files."""
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class ChunkStore:
+    """
+    Append-only SQLite store of chunk text and metadata.
+
+    Each chunk is one row: (row, vector ID, source, text, metadata as JSON).
+    Rows are numbered in append order and never rewritten, so a published
+    index version can refer to its chunks by row number while later uploads
+    append to the same file; rows no version refers to any more are only
+    removed by rewriting the store. Writing a batch costs O(batch), reading
+    a search hit is one primary-key lookup, and rebuilds stream rows in
+    order without loading the store.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY, id TEXT NOT NULL, source TEXT, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source)")
+
+    def append(self, docs, ids=None):
+        """Append Documents (with their vector IDs) and return their row numbers."""
+        if not docs:
+            return np.empty(0, dtype=np.int64)
+        ids = ids or [doc.id or "" for doc in docs]
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so no other writer can
+            # claim the same row numbers between MAX() and the insert.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (last,) = self._conn.execute("SELECT COALESCE(MAX(row), 0) FROM chunks").fetchone()
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, id, source, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (last + 1 + i, doc_id, chunk_source(doc.metadata or {}), doc.page_content, json.dumps(doc.metadata or {}))
+                        for i, (doc, doc_id) in enumerate(zip(docs, ids))
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return np.arange(last + 1, last + 1 + len(docs), dtype=np.int64)
+
+    def get(self, row):
+        """The Document stored at `row`, or None."""
+        with self._lock:
+            found = self._conn.execute("SELECT id, text, metadata FROM chunks WHERE row = ?", (int(row),)).fetchone()
+        if found is None:
+            return None
+        doc_id, text, metadata = found
+        return Document(page_content=text, metadata=json.loads(metadata), id=doc_id)
+
+    def iter_documents(self, rows):
+        """Yield (row, Document) for `rows`, in the given order, a batch at a time."""
+        for start in range(0, len(rows), _BATCH):
+            batch = [int(row) for row in rows[start:start + _BATCH]]
+            with self._lock:
+                found = self._conn.execute(
+                    f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            by_row = {row: (doc_id, text, metadata) for row, doc_id, text, metadata in found}
+            for row in batch:
+                doc_id, text, metadata = by_row[row]
+                yield row, Document(page_content=text, metadata=json.loads(metadata), id=doc_id)
+
+    def rows_for_sources(self, sources):
+        """Rows of every chunk indexed from any of `sources` (see chunk_source)."""
+        sources = list(dict.fromkeys(sources))
+        rows = []
+        for start in range(0, len(sources), _BATCH):
+            batch = sources[start:start + _BATCH]
+            with self._lock:
+                rows += [row for (row,) in self._conn.execute(
+                    f"SELECT row FROM chunks WHERE source IN ({','.join('?' * len(batch))})", batch,
+                )]
+        return np.unique(np.asarray(rows, dtype=np.int64))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ChunkDocstore(Docstore):
+    """
+    Docstore over a ChunkStore for a FAISS store whose index_to_docstore_id
+    maps positions to chunk rows. New chunks go through append(); delete()
+    only forgets rows, since stored rows are immutable.
+    """
+
+    def __init__(self, store, base_index=None):
+        self.store = store
+        # MetadataIndex of the version this store was cloned from, and the
+        # metadata of rows appended since, so publishing can update the
+        # metadata index instead of re-reading every chunk.
+        self.base_index = base_index
+        self.added = {}
+
+    def search(self, search):
+        doc = self.store.get(search)
+        return doc if doc is not None else f"Row {search} not found."
+
+    def append(self, docs, ids=None):
+        rows = self.store.append(docs, ids)
+        self.added.update(zip(rows.tolist(), (doc.metadata or {} for doc in docs)))
+        return rows
+
+    def delete(self, ids):
+        for row in ids:
+            self.added.pop(row, None)
+
+
+class RowMap(Mapping):
+    """Read-only FAISS position -> chunk row map over an array, usable as index_to_docstore_id."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getitem__(self, position):
+        position = int(position)
+        if not 0 <= position < len(self.rows):
+            raise KeyError(position)
+        return int(self.rows[position])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(range(len(self.rows)))
@@ -0,0 +1,167 @@
+# /backend/services/document_cache.py
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+import faiss
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+
+class DocumentIndexCache:
+    """
+    FAISS stores of single documents for questions about one PDF that is not
+    in the global index, keyed by S3 key and ETag.
+
+    Stores are kept in memory, least recently used first, up to `max_bytes`.
+    Every store is also written to `directory` (index.faiss + chunks.json),
+    so an evicted one is reloaded without downloading, parsing and embedding
+    the PDF again; the directory is pruned by last use above `max_disk_bytes`.
+    A lookup with a different ETag means the object changed in S3, and drops
+    the cached copy.
+    """
+
+    def __init__(self, directory, embeddings, max_bytes, max_disk_bytes):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # s3_key -> (etag, vectorstore, bytes), least recently used first.
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def _path(self, s3_key):
+        return os.path.join(self.directory, hashlib.sha256(s3_key.encode("utf-8")).hexdigest()[:32])
+
+    @staticmethod
+    def _size(vectorstore):
+        index = vectorstore.index
+        text = sum(len(vectorstore.docstore.search(doc_id).page_content)
+                   for doc_id in vectorstore.index_to_docstore_id.values())
+        return index.ntotal * index.d * 4 + text
+
+    def get(self, s3_key, etag):
+        """The cached store for `s3_key` at `etag`, or None."""
+        with self._lock:
+            entry = self._entries.get(s3_key)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(s3_key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(s3_key)
+        vectorstore = self._read(s3_key, etag)
+        with self._lock:
+            if vectorstore is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(s3_key, etag, vectorstore)
+        return vectorstore
+
+    def put(self, s3_key, etag, vectorstore):
+        """Cache `vectorstore` as the store of `s3_key` at `etag`."""
+        try:
+            self._write(s3_key, etag, vectorstore)
+        except OSError as e:
+            # Still cached in memory; it just won't survive eviction.
+            print(f"[DOC CACHE] Could not write {s3_key} to disk: {e}")
+        with self._lock:
+            self._drop(s3_key, remove_file=False)
+            self._remember(s3_key, etag, vectorstore)
+        self._prune_disk()
+
+    def invalidate(self, s3_key):
+        """Forget `s3_key`, in memory and on disk."""
+        with self._lock:
+            self._drop(s3_key)
+
+    def _remember(self, s3_key, etag, vectorstore):
+        size = self._size(vectorstore)
+        self._entries[s3_key] = (etag, vectorstore, size)
+        self._bytes += size
+        # The entry just added always stays, even if it alone is over budget.
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+
+    def _drop(self, s3_key, remove_file=True):
+        entry = self._entries.pop(s3_key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+        if remove_file:
+            shutil.rmtree(self._path(s3_key), ignore_errors=True)
+
+    def _write(self, s3_key, etag, vectorstore):
+        path = self._path(s3_key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_path)
+        ordered = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+        chunks = [vectorstore.docstore.search(doc_id) for doc_id in ordered]
+        faiss.write_index(vectorstore.index, os.path.join(tmp_path, "index.faiss"))
+        with open(os.path.join(tmp_path, "chunks.json"), "w") as f:
+            json.dump({
+                "s3_key": s3_key,
+                "etag": etag,
+                "ids": ordered,
+                "chunks": [{"text": doc.page_content, "metadata": doc.metadata} for doc in chunks],
+            }, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def _read(self, s3_key, etag):
+        path = self._path(s3_key)
+        try:
+            with open(os.path.join(path, "chunks.json")) as f:
+                saved = json.load(f)
+            if saved["s3_key"] != s3_key:
+                return None
+            if saved["etag"] != etag:
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+        except (FileNotFoundError, ValueError, KeyError, RuntimeError):
+            return None
+        # Touch the directory so disk pruning sees it as recently used.
+        os.utime(path)
+        docs = {
+            doc_id: Document(page_content=chunk["text"], metadata=chunk["metadata"], id=doc_id)
+            for doc_id, chunk in zip(saved["ids"], saved["chunks"])
+        }
+        return FAISS(self.embeddings, index, InMemoryDocstore(docs), dict(enumerate(saved["ids"])))
+
+    def _prune_disk(self):
+        if self.max_disk_bytes <= 0 or not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries)[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._entries),
+                "mb": round(self._bytes / 2**20, 1),
+                "budget_mb": round(self.max_bytes / 2**20, 1),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
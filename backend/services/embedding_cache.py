@@ -0,0 +1,274 @@
+# /backend/services/embedding_cache.py
+
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_model_id(embeddings):
+    """
+    Identify the embedding model so vectors from different models never mix.
+    """
+    model = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dimensions = getattr(embeddings, "dimensions", None)
+    return f"{model}:{dimensions}" if dimensions else str(model)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings object with a persistent, content-addressed cache.
+
+    Vectors are stored in SQLite, keyed by sha256(model id + chunk text), so
+    any indexing path that embeds the same text with the same model reuses the
+    stored vector. Only cache misses are sent to the wrapped embedder. The
+    cache is bounded to `max_entries` rows and evicts least-recently-used rows.
+
+    Query embeddings are kept in memory instead, for the last
+    `max_query_entries` distinct queries. Concurrent calls for the same query
+    share one upstream request, whether they come from threads (sync
+    retrievers) or coroutines.
+    """
+
+    def __init__(self, embeddings, path, max_entries=100_000, max_query_entries=10_000):
+        self.embeddings = embeddings
+        self.model_id = embedding_model_id(embeddings)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_query_entries = max_query_entries
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+        self.query_coalesced = 0
+        self._lock = threading.Lock()
+        # query key -> vector, least recently used first; query key -> Future of the call in flight.
+        self._queries = OrderedDict()
+        self._queries_in_flight = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    # Pass through attributes like `model` so the wrapper can stand in for the embedder.
+    def __getattr__(self, name):
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def _split(self, texts):
+        """Return (keys, cached vectors by key, unique texts that still need embedding)."""
+        keys = [self._key(t) for t in texts]
+        cached = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        hits = sum(1 for key in keys if key in cached)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return keys, cached, missing
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys, cached, missing = self._split(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts):
+        texts = list(texts)
+        keys, cached, missing = self._split(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def _join_query(self, text):
+        """
+        (key, cached vector, future, owner) for query `text`: the vector if
+        cached, else the Future of the upstream call for it, which the caller
+        has to make itself if `owner`.
+        """
+        key = self._key(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.query_hits += 1
+                return key, vector, None, False
+            future = self._queries_in_flight.get(key)
+            if future is not None:
+                self.query_coalesced += 1
+                return key, None, future, False
+            future = self._queries_in_flight[key] = Future()
+            # A running Future can't be cancelled by a waiter that gives up.
+            future.set_running_or_notify_cancel()
+            self.query_misses += 1
+            return key, None, future, True
+
+    def _finish_query(self, key, future, vector=None, error=None):
+        with self._lock:
+            del self._queries_in_flight[key]
+            if error is None and self.max_query_entries > 0:
+                self._queries[key] = vector
+                while len(self._queries) > self.max_query_entries:
+                    self._queries.popitem(last=False)
+        if error is None:
+            future.set_result(vector)
+        else:
+            future.set_exception(error)
+
+    def embed_query(self, text):
+        key, vector, future, owner = self._join_query(text)
+        if vector is None and not owner:
+            vector = future.result()
+        elif owner:
+            try:
+                vector = self.embeddings.embed_query(text)
+            except BaseException as e:
+                self._finish_query(key, future, error=e)
+                raise
+            self._finish_query(key, future, vector)
+        return list(vector)
+
+    def embed_queries(self, texts):
+        """
+        embed_query() for each of `texts`, with the uncached ones embedded in
+        one upstream call. That call goes through embed_documents(), which
+        gives the same vectors as embed_query() for OpenAI embeddings.
+        """
+        texts = list(texts)
+        joined = [self._join_query(text) for text in texts]
+        owned = {}
+        for text, (key, _, future, owner) in zip(texts, joined):
+            if owner:
+                owned[key] = (text, future)
+        if owned:
+            try:
+                vectors = self.embeddings.embed_documents([text for text, _ in owned.values()])
+            except BaseException as e:
+                for key, (_, future) in owned.items():
+                    self._finish_query(key, future, error=e)
+                raise
+            for (key, (_, future)), vector in zip(owned.items(), vectors):
+                self._finish_query(key, future, vector)
+        return [list(vector if vector is not None else future.result()) for _, vector, future, _ in joined]
+
+    async def aembed_queries(self, texts):
+        """embed_queries() with the async client."""
+        texts = list(texts)
+        joined = [self._join_query(text) for text in texts]
+        owned = {}
+        for text, (key, _, future, owner) in zip(texts, joined):
+            if owner:
+                owned[key] = (text, future)
+        if owned:
+            try:
+                vectors = await self.embeddings.aembed_documents([text for text, _ in owned.values()])
+            except BaseException as e:
+                for key, (_, future) in owned.items():
+                    self._finish_query(key, future, error=e)
+                raise
+            for (key, (_, future)), vector in zip(owned.items(), vectors):
+                self._finish_query(key, future, vector)
+        return [
+            list(vector if vector is not None else await asyncio.wrap_future(future))
+            for _, vector, future, _ in joined
+        ]
+
+    async def aembed_query(self, text):
+        key, vector, future, owner = self._join_query(text)
+        if vector is None and not owner:
+            vector = await asyncio.wrap_future(future)
+        elif owner:
+            try:
+                vector = await self.embeddings.aembed_query(text)
+            except BaseException as e:
+                self._finish_query(key, future, error=e)
+                raise
+            self._finish_query(key, future, vector)
+        return list(vector)
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            lookups = self.hits + self.misses
+            query_lookups = self.query_hits + self.query_misses + self.query_coalesced
+            return {
+                "model": self.model_id,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "queries": {
+                    "entries": len(self._queries),
+                    "max_entries": self.max_query_entries,
+                    "hits": self.query_hits,
+                    "coalesced": self.query_coalesced,
+                    "misses": self.query_misses,
+                    "hit_rate": round((self.query_hits + self.query_coalesced) / query_lookups, 4) if query_lookups else 0.0,
+                },
+            }
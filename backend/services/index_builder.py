@@ -0,0 +1,255 @@
+# /backend/services/index_builder.py
+
+import os
+import json
+import math
+import shutil
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from services.chunk_store import ChunkStore, remove_chunk_store
+
+# Index types the factory can build:
+#   flat     - exact brute-force scan (LangChain's default)
+#   ivf_flat - inverted lists over k-means cells, full vectors; tune with nprobe
+#   ivf_pq   - inverted lists with product-quantized codes; far smaller, approximate
+#   hnsw     - HNSW graph over full vectors; tune with efSearch
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# Vectors reconstructed and re-added per step when rebuilding an index.
+_REBUILD_BATCH = 65536
+
+
+def docs_in_index_order(vectorstore):
+    """
+    List the documents held by a FAISS store, in vector order. The Document
+    objects are shared with the docstore, so this costs no extra copies.
+    """
+    return [
+        vectorstore.docstore.search(doc_id)
+        for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())
+    ]
+
+
+class ShardedIndexWriter:
+    """
+    Streams embedded chunks into on-disk shards.
+
+    Chunk text and metadata are appended to the chunk store at
+    `chunk_store_path` as they arrive; vectors go to the open shard, a flat
+    FAISS index. Once it holds `shard_size` vectors it is written to
+    `shard_dir` with faiss.write_index, next to the chunk store rows of its
+    vectors, and dropped from memory. The build therefore never holds more
+    than one shard (plus the caller's current batch), and chunk text is
+    written once and never pickled. merge() then reads the shards back, one
+    at a time, into the serving index.
+    """
+
+    def __init__(self, shard_dir, chunk_store_path, shard_size=50_000):
+        self.shard_dir = shard_dir
+        self.chunk_store_path = chunk_store_path
+        self.shard_size = shard_size
+        self.shard_paths = []
+        self.total = 0
+        self._store = ChunkStore(chunk_store_path)
+        self._current = None
+        self._current_rows = []
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def add(self, docs, ids, vectors):
+        if not docs:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = self._store.append(docs, ids)
+        if self._current is None:
+            # LangChain's FAISS default: exact L2 search over unnormalized vectors.
+            self._current = faiss.IndexFlatL2(vectors.shape[1])
+        self._current.add(vectors)
+        self._current_rows.append(rows)
+        self.total += len(docs)
+        if self._current.ntotal >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write the open shard to disk and release it."""
+        if self._current is None:
+            return
+        path = os.path.join(self.shard_dir, f"shard_{len(self.shard_paths):05d}")
+        faiss.write_index(self._current, f"{path}.faiss")
+        np.save(f"{path}.rows.npy", np.concatenate(self._current_rows))
+        self.shard_paths.append(path)
+        print(f"[INDEX BUILDER] Wrote {path} ({self._current.ntotal} vectors, {self.total} total)")
+        self._current = None
+        self._current_rows = []
+
+    def merge(self):
+        """
+        Read all shards into one flat index and delete the shard files.
+        Returns (index, rows), where rows[i] is the chunk store row of the
+        vector at position i, or None if nothing was written.
+        """
+        self.flush()
+        self._store.close()
+        merged = None
+        rows = []
+        for path in self.shard_paths:
+            shard = faiss.read_index(f"{path}.faiss")
+            if merged is None:
+                merged = faiss.IndexFlatL2(shard.d)
+            merged.add(shard.reconstruct_n(0, shard.ntotal))
+            rows.append(np.load(f"{path}.rows.npy"))
+            del shard
+            os.remove(f"{path}.faiss")
+            os.remove(f"{path}.rows.npy")
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+        if merged is None:
+            return None
+        print(f"[INDEX BUILDER] Merged {len(self.shard_paths)} shards into {merged.ntotal} vectors.")
+        return merged, np.concatenate(rows)
+
+    def discard(self):
+        """Delete the shards and the chunk store, e.g. after a failed or cancelled build."""
+        self._current = None
+        self._store.close()
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+        remove_chunk_store(self.chunk_store_path)
+
+
+def write_index_version(path, index, rows, metadata_index, generation):
+    """
+    Write a partition version to the new directory `path`, in the layout
+    vectorstore_manager serves: the FAISS index, the chunk store row of each
+    position, the version's MetadataIndex and the chunk store generation.
+    """
+    os.makedirs(os.path.join(path, "faiss_index"))
+    faiss.write_index(index, os.path.join(path, "faiss_index", "index.faiss"))
+    np.save(os.path.join(path, "rows.npy"), rows)
+    metadata_index.save(path)
+    with open(os.path.join(path, "version.json"), "w") as f:
+        json.dump({"chunks": generation}, f)
+
+
+def default_nlist(n):
+    """Number of IVF cells for ~n vectors: about 4*sqrt(n), with >= 39 training points per cell."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39, 65536))
+
+def default_pq_m(d):
+    """
+    PQ sub-quantizers: one per 4 dimensions (8-bit codes), i.e. 1/16 of the
+    float32 size. Coarser codes (one per 8 dims) lost too much recall in
+    benchmarks/faiss_index_bench.py. d must be divisible by the result.
+    """
+    for m in range(max(1, d // 4), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+def min_training_vectors(index_type, pq_nbits=8):
+    """Fewest vectors `index_type` can be trained on (39 per k-means centroid)."""
+    if index_type == "ivf_pq":
+        return 39 * 2 ** pq_nbits
+    if index_type == "ivf_flat":
+        return 39
+    return 1
+
+def make_faiss_index(index_type, d, n, metric=faiss.METRIC_L2, nlist=0, pq_m=0, pq_nbits=8, hnsw_m=32, ef_construction=80):
+    """
+    Return an empty FAISS index of `index_type` sized for about `n` vectors.
+    IVF indexes still need training (see build_faiss_index).
+    """
+    if index_type == "flat":
+        return faiss.IndexFlat(d, metric)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    nlist = nlist or default_nlist(n)
+    quantizer = faiss.IndexFlat(d, metric)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, d, nlist, pq_m or default_pq_m(d), pq_nbits, metric)
+    raise ValueError(f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time tuning: nprobe for IVF indexes, efSearch for HNSW."""
+    if isinstance(index, faiss.IndexIVF) and nprobe:
+        index.nprobe = min(nprobe, index.nlist)
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        index.hnsw.efSearch = ef_search
+
+def index_code_bytes(index):
+    """Approximate bytes stored per vector."""
+    if isinstance(index, faiss.IndexHNSW):
+        return index.storage.sa_code_size() + 4 * index.hnsw.nb_neighbors(0)
+    try:
+        return index.sa_code_size()
+    except RuntimeError:
+        return index.d * 4
+
+def _add_in_batches(index, source, positions):
+    for start in range(0, len(positions), _REBUILD_BATCH):
+        index.add(source.reconstruct_batch(positions[start:start + _REBUILD_BATCH]))
+
+def _finish(index):
+    if isinstance(index, faiss.IndexIVF):
+        # Lets filtered search reconstruct candidates and keeps remove_ids usable.
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+def build_faiss_index(source, index_type, training_size=0, **params):
+    """
+    Build an `index_type` index holding every vector of the `source` index,
+    in the same order. IVF indexes are trained on a random sample of up to
+    `training_size` vectors (default: 40 per cell, just above FAISS's
+    minimum of 39, and at least 65536); k-means dominates build time.
+    """
+    n, d = source.ntotal, source.d
+    index = make_faiss_index(index_type, d, n, source.metric_type, **params)
+    if not index.is_trained:
+        size = min(n, training_size or max(40 * index.nlist, 65536))
+        sample = np.sort(np.random.default_rng(0).choice(n, size=size, replace=False))
+        index.train(source.reconstruct_batch(sample))
+    _add_in_batches(index, source, np.arange(n))
+    return _finish(index)
+
+def convert_store(vectorstore, index_type, **params):
+    """A copy of `vectorstore` backed by an `index_type` index; documents are shared."""
+    return FAISS(
+        vectorstore.embedding_function,
+        build_faiss_index(vectorstore.index, index_type, **params),
+        vectorstore.docstore,
+        dict(vectorstore.index_to_docstore_id),
+        normalize_L2=vectorstore._normalize_L2,
+        distance_strategy=vectorstore.distance_strategy,
+    )
+
+def delete_from_store(vectorstore, doc_ids):
+    """
+    Delete documents by docstore ID, in place. Flat indexes are compacted by
+    LangChain's delete(). IVF and HNSW indexes cannot be compacted that way
+    (HNSW has no remove_ids, IVF keeps the old labels), so the remaining
+    vectors are re-added, in order, to an emptied copy of the trained index.
+    """
+    doomed = set(doc_ids)
+    if not doomed:
+        return
+    if index_type_of(vectorstore.index) == "flat":
+        vectorstore.delete(list(doomed))
+        return
+    kept = [(pos, doc_id) for pos, doc_id in sorted(vectorstore.index_to_docstore_id.items()) if doc_id not in doomed]
+    index = faiss.clone_index(vectorstore.index)
+    index.reset()
+    _add_in_batches(index, vectorstore.index, np.asarray([pos for pos, _ in kept], dtype=np.int64))
+    vectorstore.index = _finish(index)
+    vectorstore.docstore.delete(list(doomed))
+    vectorstore.index_to_docstore_id = {i: doc_id for i, (_, doc_id) in enumerate(kept)}
@@ -0,0 +1,134 @@
+# /backend/services/index_log.py
+#
+# Append-only write-ahead log of the changes made to a published index version
+# since it was written (see vectorstore_manager). Each record holds the chunk
+# rows an update deleted and the rows and vectors it added, so logging an
+# upload costs O(upload) however large the partition is.
+
+import os
+import time
+import zlib
+import fcntl
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+# Record header: magic, unix time, deleted row count, added row count,
+# vector dimension, CRC32 of the payload. The payload follows: deleted rows
+# (int64), added rows (int64), added vectors (float32, row-major).
+_HEADER = struct.Struct("<4sdIIII")
+_MAGIC = b"WAL1"
+
+
+class LogRecord:
+    """One logged change: chunk rows deleted, and rows added with their vectors."""
+
+    def __init__(self, end, timestamp, deleted, added, vectors):
+        # Byte offset just past this record, where replay resumes.
+        self.end = end
+        self.timestamp = timestamp
+        self.deleted = deleted
+        self.added = added
+        self.vectors = vectors
+
+
+def _payload_size(n_deleted, n_added, dim):
+    return 8 * (n_deleted + n_added) + 4 * n_added * dim
+
+def _read_header(f):
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    fields = _HEADER.unpack(header)
+    return fields if fields[0] == _MAGIC else None
+
+def read_records(path, offset=0):
+    """
+    Yield the complete records of the log at `path` from byte `offset` on.
+    Reading stops at the first incomplete or corrupt record: the tail of a
+    record still being written, or one torn by a crash.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        while True:
+            fields = _read_header(f)
+            if fields is None:
+                return
+            _, timestamp, n_deleted, n_added, dim, crc = fields
+            payload = f.read(_payload_size(n_deleted, n_added, dim))
+            if len(payload) < _payload_size(n_deleted, n_added, dim) or zlib.crc32(payload) != crc:
+                return
+            offset += _HEADER.size + len(payload)
+            deleted = np.frombuffer(payload, dtype=np.int64, count=n_deleted)
+            added = np.frombuffer(payload, dtype=np.int64, count=n_added, offset=8 * n_deleted)
+            vectors = np.frombuffer(payload, dtype=np.float32, offset=8 * (n_deleted + n_added)).reshape(n_added, dim)
+            yield LogRecord(offset, timestamp, deleted, added, vectors)
+
+def first_timestamp(path):
+    """Time the oldest record of the log at `path` was written, or None if it has none."""
+    for record in read_records(path):
+        return record.timestamp
+    return None
+
+def _valid_end(path, offset=0):
+    """
+    Offset just past the last record read_records() accepts, so that nothing
+    is written after a torn or corrupt record that replay would stop at.
+    """
+    end = offset
+    for record in read_records(path, offset):
+        end = record.end
+    return end
+
+def append_record(path, deleted, added, vectors, dim):
+    """
+    Append one change to the log at `path` and fsync it. A torn or corrupt
+    record left by a crash is cut off first, with anything after it. The caller must hold the log's lock (see
+    locked()), so records are never interleaved.
+    """
+    deleted = np.ascontiguousarray(deleted, dtype=np.int64)
+    added = np.ascontiguousarray(added, dtype=np.int64)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(added), dim)
+    payload = deleted.tobytes() + added.tobytes() + vectors.tobytes()
+    header = _HEADER.pack(_MAGIC, time.time(), len(deleted), len(added), dim, zlib.crc32(payload))
+    end = _valid_end(path)
+    with open(path, "a+b") as f:
+        if end < f.seek(0, os.SEEK_END):
+            f.truncate(end)
+        f.write(header + payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return end + len(header) + len(payload)
+
+def copy_tail(source, offset, target):
+    """Copy the complete records of log `source` from `offset` on into a new log `target`."""
+    if not os.path.exists(source):
+        return
+    end = _valid_end(source, offset)
+    with open(source, "rb") as f, open(target, "wb") as out:
+        f.seek(offset)
+        out.write(f.read(max(0, end - offset)))
+        out.flush()
+        os.fsync(out.fileno())
+
+@contextmanager
+def locked(path, blocking=True):
+    """
+    Hold an exclusive lock on the file `path` (created if missing), shared by
+    every thread and process. With blocking=False, yields False instead of
+    waiting if someone else holds it.
+    """
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
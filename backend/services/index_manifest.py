@@ -0,0 +1,85 @@
+# /backend/services/index_manifest.py
+
+import os
+import pickle
+import hashlib
+from config import INDEXED_FILES_PATH
+
+# Manifest layout (pickled dict, one entry per indexed S3 object):
+#   {
+#       "<folder>/<filename>.pdf": {
+#           "etag": "<S3 ETag>",
+#           "size": <bytes>,
+#           "chunk_ids": [<sha256 of chunk text>, ...],
+#           "vector_ids": [<docstore id in FAISS>, ...],
+#       },
+#       ...
+#   }
+
+
+def load_manifest(path=INDEXED_FILES_PATH):
+    """
+    Load the indexed-files manifest. Older versions of this file stored a
+    plain set of filenames; those carry no ETags or vector IDs, so they are
+    treated as an empty manifest (forcing one full rebuild).
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "rb") as f:
+            manifest = pickle.load(f)
+    except Exception as e:
+        print(f"[MANIFEST] Could not read {path}: {e}")
+        return {}
+    if not isinstance(manifest, dict):
+        print("[MANIFEST] Legacy manifest format found; ignoring it.")
+        return {}
+    return manifest
+
+
+def save_manifest(manifest, path=INDEXED_FILES_PATH):
+    """
+    Write the manifest next to the FAISS index (atomically, via a temp file).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(manifest, f)
+    os.replace(tmp_path, path)
+    print(f"[MANIFEST] Saved manifest with {len(manifest)} entries.")
+
+
+def chunk_id(text):
+    """Content hash of a chunk's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_manifest_entry(s3_object, chunks, vector_ids):
+    return {
+        "etag": s3_object.get("etag"),
+        "size": s3_object.get("size"),
+        "chunk_ids": [chunk_id(c.page_content) for c in chunks],
+        "vector_ids": list(vector_ids),
+    }
+
+
+def diff_manifest(manifest, s3_objects):
+    """
+    Compare the manifest with a fresh S3 listing.
+    Returns (new, changed, removed):
+        new     - S3 objects not in the manifest
+        changed - S3 objects whose ETag or size differ from the manifest
+        removed - manifest keys that no longer exist in S3
+    """
+    new, changed = [], []
+    seen = set()
+    for obj in s3_objects:
+        key = obj["key"]
+        seen.add(key)
+        entry = manifest.get(key)
+        if entry is None:
+            new.append(obj)
+        elif entry.get("etag") != obj.get("etag") or entry.get("size") != obj.get("size"):
+            changed.append(obj)
+    removed = [key for key in manifest if key not in seen]
+    return new, changed, removed
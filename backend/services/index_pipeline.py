@@ -0,0 +1,191 @@
+# /backend/services/index_pipeline.py
+
+import os
+import queue
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from config import (
+    embedding_model,
+    INDEX_DOWNLOAD_WORKERS,
+    INDEX_PARSE_WORKERS,
+    INDEX_EMBED_BATCH_SIZE,
+    INDEX_MAX_FILES_IN_FLIGHT,
+)
+from services.s3_service import download_file_from_s3
+from utils.chunking import load_split_and_enrich_s3_pdf
+from status import (
+    new_indexing_status,
+    update_indexing_status,
+    set_indexing_current_file,
+    increment_indexing_success,
+    increment_indexing_fail,
+)
+
+# Stages:
+#   1. download  - S3 -> tmp file, on a pool of I/O threads
+#   2. parse     - PyPDFLoader (via the parsed-PDF cache) + split + metadata, on a process pool (all cores)
+#   3. embed     - batches of chunks sent to the embedder while parsing continues
+# At most `max_files_in_flight` files are downloaded-but-not-yet-consumed at once,
+# and at most `max_pending_batches` embedding batches are outstanding, so memory
+# and tmp disk usage stay bounded.
+
+
+def _local_path_for(tmp_dir, s3_key):
+    # Same filename can exist in several folders; prefix with a hash of the key.
+    digest = hashlib.sha1(s3_key.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tmp_dir, f"{digest}_{os.path.basename(s3_key)}")
+
+
+def _download(s3_object, tmp_dir):
+    local_path = _local_path_for(tmp_dir, s3_object["key"])
+    ok = download_file_from_s3(s3_object["filename"], local_path, folder=s3_object["folder"])
+    return local_path if ok else None
+
+
+def _remove(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        print(f"[WARN] Could not delete temp file: {e}")
+
+
+def run_index_pipeline(
+    s3_objects,
+    tmp_dir,
+    on_file_parsed,
+    on_batch_embedded,
+    download_workers=INDEX_DOWNLOAD_WORKERS,
+    parse_workers=INDEX_PARSE_WORKERS,
+    embed_batch_size=INDEX_EMBED_BATCH_SIZE,
+    max_files_in_flight=INDEX_MAX_FILES_IN_FLIGHT,
+    max_pending_batches=2,
+    check_cancelled=None,
+    status=None,
+):
+    """
+    Download, parse, split and embed `s3_objects` concurrently.
+
+    on_file_parsed(s3_object, chunks) -> list of vector IDs for `chunks`
+        Called once per successfully parsed file, in completion order.
+    on_batch_embedded(docs, ids, vectors)
+        Called once per embedded batch, in submission order.
+
+    Both callbacks run on the calling thread, which also owns the updates of
+    `status` (the caller's status dict), so callers never need locking.
+    `check_cancelled` is called at every file boundary and may raise to abort
+    the run. Returns (success_count, fail_count).
+    """
+    status = new_indexing_status() if status is None else status
+    os.makedirs(tmp_dir, exist_ok=True)
+    results = queue.Queue()
+    in_flight = threading.BoundedSemaphore(max(1, max_files_in_flight))
+    stop = threading.Event()
+    success_count = fail_count = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="s3-dl") as io_pool, \
+                ProcessPoolExecutor(max_workers=max(1, parse_workers),
+                                    mp_context=multiprocessing.get_context("spawn")) as cpu_pool, \
+                ThreadPoolExecutor(max_workers=max_pending_batches, thread_name_prefix="embed") as embed_pool:
+
+            def on_downloaded(s3_object, future):
+                try:
+                    local_path = future.result()
+                except Exception as e:
+                    results.put((s3_object, None, None, e))
+                    return
+                if local_path is None:
+                    results.put((s3_object, None, None, None))
+                    return
+                try:
+                    parse_future = cpu_pool.submit(load_split_and_enrich_s3_pdf, local_path, s3_object)
+                except Exception as e:  # pool shut down after a failure elsewhere
+                    results.put((s3_object, local_path, None, e))
+                    return
+                parse_future.add_done_callback(
+                    lambda f: results.put((s3_object, local_path, f, None))
+                )
+
+            def feed():
+                for s3_object in s3_objects:
+                    while not in_flight.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    future = io_pool.submit(_download, s3_object, tmp_dir)
+                    future.add_done_callback(lambda f, obj=s3_object: on_downloaded(obj, f))
+
+            feeder = threading.Thread(target=feed, name="index-feeder", daemon=True)
+            feeder.start()
+
+            pending = deque()
+            batch_docs, batch_ids = [], []
+
+            def submit_batch():
+                texts = [doc.page_content for doc in batch_docs]
+                pending.append((list(batch_docs), list(batch_ids), embed_pool.submit(embedding_model.embed_documents, texts)))
+                batch_docs.clear()
+                batch_ids.clear()
+
+            def drain(limit):
+                while len(pending) > limit:
+                    docs, ids, future = pending.popleft()
+                    on_batch_embedded(docs, ids, future.result())
+
+            try:
+                for current_counter in range(1, len(s3_objects) + 1):
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    s3_object, local_path, parse_future, error = results.get()
+                    in_flight.release()
+                    _remove(local_path)
+                    key = s3_object["key"]
+                    update_indexing_status(status, current=current_counter, status=f"Indexing {key} ({current_counter})")
+                    set_indexing_current_file(status, key)
+
+                    if parse_future is not None:
+                        try:
+                            chunks = parse_future.result()
+                        except Exception as e:
+                            error = e
+                    if error is not None:
+                        print(f"[ERROR] Failed to process {key}: {error}")
+                        update_indexing_status(status, last_error=str(error))
+                        increment_indexing_fail(status)
+                        fail_count += 1
+                        continue
+                    if parse_future is None:
+                        print(f"[WARN] Skipped {key} — download failed.")
+                        update_indexing_status(status, last_error=f"Failed to download {key}")
+                        increment_indexing_fail(status)
+                        fail_count += 1
+                        continue
+
+                    ids = on_file_parsed(s3_object, chunks)
+                    increment_indexing_success(status)
+                    success_count += 1
+                    for doc, vector_id in zip(chunks, ids):
+                        batch_docs.append(doc)
+                        batch_ids.append(vector_id)
+                        if len(batch_docs) >= embed_batch_size:
+                            submit_batch()
+                            drain(max_pending_batches)
+                if batch_docs:
+                    submit_batch()
+                drain(0)
+            finally:
+                stop.set()
+                feeder.join()
+                for _, _, future in pending:
+                    future.cancel()
+    finally:
+        # After an early exit, files that were downloaded but never consumed are still on disk.
+        while not results.empty():
+            _remove(results.get_nowait()[1])
+    return success_count, fail_count
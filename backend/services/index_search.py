@@ -0,0 +1,126 @@
+# /backend/services/index_search.py
+
+import heapq
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from langchain_core.retrievers import BaseRetriever
+from config import embedding_model, QUERY_SEARCH_WORKERS
+from services.metadata_index import clean_filters, query_vector, query_vectors
+from services.vectorstore_manager import acquire_partition, list_partitions, partition_name, partition_states
+
+# Index work of the async query path (searches, and the partition loads they
+# may trigger) runs on this small pool instead of the event loop or the shared
+# request thread pool. FAISS searches are CPU-bound and FAISS already uses
+# several cores per search, so more threads than cores only add contention.
+_search_executor = ThreadPoolExecutor(max_workers=QUERY_SEARCH_WORKERS, thread_name_prefix="index-search")
+
+
+async def run_search(fn, *args):
+    """Run blocking index function `fn(*args)` on the search executor."""
+    return await asyncio.get_running_loop().run_in_executor(_search_executor, partial(fn, *args))
+
+def resolve_partitions(filters=None):
+    """
+    Partitions a query has to search: those named by a `category` filter,
+    otherwise all of them.
+    """
+    categories = (filters or {}).get("category")
+    available = list_partitions()
+    if not categories:
+        return available
+    if isinstance(categories, str):
+        categories = [categories]
+    wanted = {partition_name(category) for category in categories}
+    return [name for name in available if name in wanted]
+
+def index_version(filters=None):
+    """
+    Version of the part of the index a query with `filters` searches; it
+    changes whenever any of those partitions is updated.
+    """
+    states = partition_states(resolve_partitions(clean_filters(filters)))
+    return ",".join(f"{name}@{state}" for name, state in sorted(states.items()))
+
+def count_matches(filters=None):
+    """Number of indexed chunks matching `filters` (all chunks if no filters)."""
+    filters = clean_filters(filters)
+    total = 0
+    for name in resolve_partitions(filters):
+        with acquire_partition(name) as snapshot:
+            if snapshot is None:
+                continue
+            total += snapshot.count(filters)
+    return total
+
+def search_index(query, k, filters=None, embedding=None):
+    """
+    Top-k Documents for `query` across the partitions selected by `filters`.
+    Each partition is searched for its own top-k within the matching chunks
+    and the results are merged by distance. Partitions are pinned one at a
+    time, so a cross-category query never needs all of them in memory at once.
+    `embedding` is the query's raw embedding, if already known.
+    """
+    filters = clean_filters(filters)
+    vector = None
+    results = []
+    for name in resolve_partitions(filters):
+        with acquire_partition(name) as snapshot:
+            if snapshot is None:
+                continue
+            if vector is None:
+                vector = query_vector(snapshot.vectorstore, query, embedding)
+            results += snapshot.search(vector, k, filters)
+    return [doc for doc, _ in heapq.nsmallest(k, results, key=lambda hit: hit[1])]
+
+def search_index_batch(queries, k, filters=None, embeddings=None):
+    """
+    search_index() for each of `queries`: all of them are embedded in one
+    call and each partition is searched once for the whole query matrix.
+    """
+    filters = clean_filters(filters)
+    vectors = None
+    results = [[] for _ in queries]
+    for name in resolve_partitions(filters):
+        with acquire_partition(name) as snapshot:
+            if snapshot is None:
+                continue
+            if vectors is None:
+                vectors = query_vectors(snapshot.vectorstore, list(queries), embeddings)
+            for found, hits in zip(results, snapshot.search_batch(vectors, k, filters)):
+                found += hits
+    return [[doc for doc, _ in heapq.nsmallest(k, found, key=lambda hit: hit[1])] for found in results]
+
+async def asearch_index(query, k, filters=None):
+    """
+    search_index() without blocking the event loop: the query is embedded
+    with the async client, then searched on the search executor.
+    """
+    filters = clean_filters(filters)  # reject bad filters before embedding anything
+    embedding = await embedding_model.aembed_query(query)
+    return await run_search(search_index, query, k, filters, embedding)
+
+async def asearch_index_batch(queries, k, filters=None):
+    """search_index_batch() without blocking the event loop (see asearch_index)."""
+    filters = clean_filters(filters)
+    embeddings = await embedding_model.aembed_queries(queries)
+    return await run_search(search_index_batch, queries, k, filters, embeddings)
+
+async def asearch_store(vectorstore, query, k):
+    """Top-k Documents for `query` in a single FAISS store, searched like asearch_index()."""
+    embedding = await vectorstore.embedding_function.aembed_query(query)
+    return await run_search(vectorstore.similarity_search_by_vector, embedding, k)
+
+
+class IndexRetriever(BaseRetriever):
+    """Retriever over the partitioned index, honouring metadata filters (see search_index)."""
+
+    filters: Optional[dict] = None
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return search_index(query, self.k, self.filters)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return await asearch_index(query, self.k, self.filters)
@@ -0,0 +1,241 @@
+# /backend/services/jobs.py
+
+import os
+import re
+import json
+import uuid
+import fcntl
+import datetime
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import VECTORSTORE_DIR
+from status import new_indexing_status, set_indexing_error
+
+MAX_JOB_HISTORY = 50
+
+# Jobs may be started, polled and cancelled through different uvicorn workers,
+# so everything they share lives in VECTORSTORE_DIR:
+#   MUTATION.lock        -> flock held by whatever is mutating the FAISS index
+#                           (a reindex job or an upload), in any process, so
+#                           only one mutation runs at a time; it names the holder
+#   jobs/<job id>.json   -> state and progress of a job, saved by the worker
+#                           running it at every change of state and file boundary
+#   jobs/<job id>.cancel -> cancellation requested through another worker
+MUTATION_LOCK_PATH = os.path.join(VECTORSTORE_DIR, "MUTATION.lock")
+JOBS_DIR = os.path.join(VECTORSTORE_DIR, "jobs")
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+_CONFLICTS = {
+    "reindex": "Re-indexing is in progress.",
+    "upload": "Another upload is being indexed.",
+}
+
+_JOBS_LOCK = threading.Lock()
+# Jobs started by this process.
+_JOBS = OrderedDict()
+
+
+class JobConflict(Exception):
+    """Raised when a mutation is requested while another one is running."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+def _job_path(job_id, suffix=".json"):
+    return os.path.join(JOBS_DIR, f"{job_id}{suffix}")
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = "queued"
+        self.error = None
+        self.created_at = datetime.datetime.utcnow().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.status = new_indexing_status()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        if not self._cancel.is_set() and os.path.exists(_job_path(self.id, ".cancel")):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Call at safe points (e.g. file boundaries) to honour a cancel request."""
+        self.save()
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} was cancelled.")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cancel_requested": self.cancel_requested,
+            "progress": dict(self.status),
+        }
+
+    def save(self):
+        """Write the job's state where every worker can read it."""
+        path = _job_path(self.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+
+def _try_lock(kind):
+    """Take the mutation lock for `kind`; returns the lock file, or raises JobConflict."""
+    os.makedirs(VECTORSTORE_DIR, exist_ok=True)
+    f = open(MUTATION_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.seek(0)
+        holder = f.read().strip()
+        f.close()
+        raise JobConflict(f"{_CONFLICTS.get(holder, 'Another index update is in progress.')} "
+                          "Please try again when it has finished.")
+    f.truncate(0)
+    f.write(kind)
+    f.flush()
+    return f
+
+def _unlock(f):
+    fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
+
+
+def _remember(job):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job.save()
+    with _JOBS_LOCK:
+        _JOBS[job.id] = job
+        while len(_JOBS) > MAX_JOB_HISTORY:
+            _JOBS.popitem(last=False)
+    # Forget the oldest saved jobs, whichever worker ran them.
+    for old in _saved_jobs()[MAX_JOB_HISTORY:]:
+        for suffix in (".json", ".cancel"):
+            try:
+                os.remove(_job_path(old["job_id"], suffix))
+            except FileNotFoundError:
+                pass
+
+
+def _run(job, lock, fn, args, kwargs):
+    job.state = "running"
+    job.started_at = datetime.datetime.utcnow().isoformat()
+    try:
+        job.save()
+        fn(*args, job=job, **kwargs)
+        job.state = "cancelled" if job.cancel_requested else "succeeded"
+    except JobCancelled:
+        job.state = "cancelled"
+        print(f"[JOBS] {job.kind} job {job.id} cancelled.")
+    except Exception as e:
+        traceback.print_exc()
+        job.state = "failed"
+        job.error = str(e)
+        set_indexing_error(job.status, str(e))
+        print(f"[JOBS] {job.kind} job {job.id} failed: {e}")
+    finally:
+        job.status["running"] = False
+        job.finished_at = datetime.datetime.utcnow().isoformat()
+        try:
+            job.save()
+        finally:
+            _unlock(lock)
+
+
+def start_mutation_job(kind, fn, *args, **kwargs):
+    """
+    Run fn(*args, job=job, **kwargs) on a background thread and return the Job
+    immediately; fn reports its progress on job.status. Raises JobConflict if
+    another index mutation is in progress, in this process or another one.
+    """
+    lock = _try_lock(kind)
+    try:
+        job = Job(kind)
+        _remember(job)
+        thread = threading.Thread(target=_run, args=(job, lock, fn, args, kwargs), name=f"job-{kind}", daemon=True)
+        thread.start()
+    except Exception:
+        _unlock(lock)
+        raise
+    print(f"[JOBS] Started {kind} job {job.id}")
+    return job
+
+
+@contextmanager
+def mutation_lock(kind="upload"):
+    """
+    Hold the index mutation lock for a short, synchronous mutation such as an
+    upload. Raises JobConflict instead of waiting behind a long reindex.
+    """
+    lock = _try_lock(kind)
+    try:
+        yield
+    finally:
+        _unlock(lock)
+
+
+def _load_job(job_id):
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _saved_jobs():
+    """Saved job dicts, newest first."""
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    jobs = [_load_job(name[:-len(".json")]) for name in os.listdir(JOBS_DIR) if name.endswith(".json")]
+    return sorted((job for job in jobs if job), key=lambda job: job["created_at"], reverse=True)
+
+
+def get_job(job_id):
+    """The job's state and progress as a dict, from whichever worker runs it, or None."""
+    if not _JOB_ID.fullmatch(job_id):
+        return None
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    return job.to_dict() if job is not None else _load_job(job_id)
+
+
+def list_jobs():
+    with _JOBS_LOCK:
+        local = {job.id: job.to_dict() for job in _JOBS.values()}
+    return [local.get(job["job_id"], job) for job in _saved_jobs()]
+
+
+def cancel_job(job_id):
+    """Request cancellation of a queued or running job; returns get_job(job_id)."""
+    job = get_job(job_id)
+    if job is None:
+        return None
+    if job["state"] in ("queued", "running"):
+        with _JOBS_LOCK:
+            local = _JOBS.get(job_id)
+        if local is not None:
+            local.cancel()
+        else:
+            # Picked up by the worker running it at the next file boundary.
+            open(_job_path(job_id, ".cancel"), "w").close()
+        job = get_job(job_id)
+        job["cancel_requested"] = True
+    return job
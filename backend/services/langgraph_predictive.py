@@ -1,5 +1,7 @@
 
-from services.vectorstore_manager import get_faiss_index
+from services.vectorstore_manager import list_partitions
+from services.index_search import search_index, asearch_index
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 from typing import TypedDict, List, Optional
 
@@ -17,16 +19,24 @@ graph = StateGraph(PredictiveState)
 # ---- 1. Node: Context Retrieval (FAISS) ----
 def retrieve_context(state):
     question = state['input'].get('analysis_question', 'Give me relevant maintenance data')
-    vectorstore = get_faiss_index()
-    if not vectorstore:
+    if not list_partitions():
         state['context_docs'] = []
         state['context_warning'] = "No FAISS index loaded"
         return state
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-    docs = retriever.get_relevant_documents(question)
+    docs = search_index(question, 10)
     state['context_docs'] = docs
     return state
 
+async def aretrieve_context(state):
+    # Same as retrieve_context, for ainvoke(): embeds asynchronously and searches off the event loop.
+    question = state['input'].get('analysis_question', 'Give me relevant maintenance data')
+    if not list_partitions():
+        state['context_docs'] = []
+        state['context_warning'] = "No FAISS index loaded"
+        return state
+    state['context_docs'] = await asearch_index(question, 10)
+    return state
+
 # ---- 2. Node: Predictive ML/Stats Model ----
 def run_predictive_model(state):
     # This is a stub – replace with your own ML/stat analysis
@@ -66,7 +76,7 @@ def output_node(state):
 
 # ---- Build the workflow graph ----
 graph = StateGraph(PredictiveState)
-graph.add_node("context_retrieval", retrieve_context)
+graph.add_node("context_retrieval", RunnableLambda(retrieve_context, afunc=aretrieve_context))
 graph.add_node("predictive_model", run_predictive_model)
 graph.add_node("llm_judgement", llm_judgement)
 graph.add_node("output", output_node)
@@ -75,6 +85,15 @@ graph.add_edge("predictive_model", "llm_judgement")
 graph.add_edge("llm_judgement", "output")
 graph.add_edge("__start__", "context_retrieval")
 
+_compiled_graph = None
+
+def compiled_graph():
+    """The workflow graph, compiled once per process on first use."""
+    global _compiled_graph
+    if _compiled_graph is None:
+        _compiled_graph = graph.compile()
+    return _compiled_graph
+
 # ---- Entrypoint for your backend ----
 def run_predictive_workflow(sensor_log_text, question=None):
     """
@@ -82,14 +101,19 @@ def run_predictive_workflow(sensor_log_text, question=None):
     question: str – what analysis to retrieve (optional)
     Returns: dict – workflow output
     """
+    result = compiled_graph().invoke(_initial_state(sensor_log_text, question))
+    return result
+
+async def arun_predictive_workflow(sensor_log_text, question=None):
+    """run_predictive_workflow() for async callers; it never blocks the event loop."""
+    return await compiled_graph().ainvoke(_initial_state(sensor_log_text, question))
+
+def _initial_state(sensor_log_text, question):
     input_dict = {
         "analysis_question": question or "Analyze last 24 hours of equipment logs for anomalies.",
         "sensor_log_text": sensor_log_text
     }
-    state = {"input": input_dict}
-    compiled_graph = graph.compile()
-    result = compiled_graph.invoke(state)
-    return result
+    return {"input": input_dict}
 
 # ---- (Optional) Test ----
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+# /backend/services/llm_service.py
+
+import asyncio
+import weakref
+import threading
+from langchain_openai import ChatOpenAI
+from config import OPENAI_API_KEY, QUERY_LLM_CONCURRENCY, openai_http_client, openai_async_http_client
+
+# Model calls of the Q&A endpoints. Questions are answered from already
+# retrieved chunks, prompted as RetrievalQA's "stuff" chain does, through the
+# model's async API, so a call waiting on OpenAI holds no thread. At most
+# QUERY_LLM_CONCURRENCY calls are in flight per worker; the others wait their turn.
+#
+# Chat clients and prompt | model chains are built once per process and
+# reused by every request, over the process's shared OpenAI connection pool
+# (see config.py). The chains don't depend on how many chunks were retrieved,
+# so one chain per (model, prompt) serves every k.
+DEFAULT_MODEL = "gpt-4o"
+
+_slots = weakref.WeakKeyDictionary()
+_llms = {}
+_chains = {}
+_registry_lock = threading.Lock()
+
+
+def _llm_slots():
+    # One semaphore per event loop: asyncio primitives can't be shared between loops.
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(QUERY_LLM_CONCURRENCY)
+    return slots
+
+def get_llm(model=DEFAULT_MODEL, temperature=0):
+    """The process's chat client for `model`, built on first use."""
+    key = (model, temperature)
+    llm = _llms.get(key)
+    if llm is None:
+        with _registry_lock:
+            llm = _llms.get(key)
+            if llm is None:
+                llm = _llms[key] = ChatOpenAI(
+                    openai_api_key=OPENAI_API_KEY,
+                    model=model,
+                    temperature=temperature,
+                    http_client=openai_http_client,
+                    http_async_client=openai_async_http_client,
+                )
+    return llm
+
+def get_chain(prompt, model=DEFAULT_MODEL):
+    """The process's `prompt | model` chain, built on first use."""
+    key = (model, prompt.template)
+    chain = _chains.get(key)
+    if chain is None:
+        llm = get_llm(model)
+        with _registry_lock:
+            chain = _chains.setdefault(key, prompt | llm)
+    return chain
+
+def stuff_inputs(question, docs):
+    """Prompt inputs with `docs` as the context, as RetrievalQA's "stuff" chain fills them."""
+    return {"context": "\n\n".join(doc.page_content for doc in docs), "question": question}
+
+async def ask_llm(question, docs, prompt):
+    """The model's raw answer to `question` from `docs`."""
+    async with _llm_slots():
+        result = await get_chain(prompt).ainvoke(stuff_inputs(question, docs))
+    return result.content.strip()
+
+async def stream_llm(question, docs, prompt):
+    """ask_llm() as an async iterator of answer text chunks."""
+    async with _llm_slots():
+        async for chunk in get_chain(prompt).astream(stuff_inputs(question, docs)):
+            if chunk.content:
+                yield chunk.content
+
+async def warm_up(prompts=(), connect=True):
+    """
+    Build the chat client and the chains for `prompts` ahead of the first
+    request, and if `connect`, open a connection to OpenAI (one cheap
+    authenticated request) so the first question skips the TLS handshake.
+    Failures are logged, never raised.
+    """
+    llm = get_llm()
+    for prompt in prompts:
+        get_chain(prompt)
+    if not connect:
+        return
+    try:
+        client = llm.root_async_client.with_options(max_retries=0, timeout=10)
+        await client.models.retrieve(llm.model_name)
+        print(f"[LLM] Warmed up {llm.model_name} connection pool.")
+    except Exception as e:
+        print(f"[LLM] Warmup request failed (first request will connect): {e}")
@@ -0,0 +1,349 @@
+# /backend/services/metadata_index.py
+
+import os
+import re
+import json
+import math
+import datetime
+import numpy as np
+import faiss
+
+# Exact-match fields. Values are compared case-insensitively with punctuation
+# ignored, so "Work Order Documents" matches the stored "Work_Order_Documents".
+KEYWORD_FIELDS = ("asset_id", "category", "source", "s3_key")
+# Free-text fields: every word of the filter must occur in the chunk's value,
+# so failure_type="bearing" matches "Bearing Wear".
+TEXT_FIELDS = ("failure_type", "handled_by")
+# `date` takes a period ("2024", "2024-Q1", "2024-03", "2024-03-05");
+# `date_from` / `date_to` are inclusive bounds in the same format.
+DATE_FILTERS = ("date", "date_from", "date_to")
+FILTER_KEYS = KEYWORD_FIELDS + TEXT_FIELDS + DATE_FILTERS
+
+# Below this many candidate vectors, filtered search reconstructs them and
+# ranks them directly instead of scanning the whole index with a selector.
+EXACT_SEARCH_MAX_CANDIDATES = 4096
+# Upper bound on the widened HNSW efSearch used for filtered queries.
+MAX_FILTERED_EF_SEARCH = 4096
+
+
+def _words(value):
+    return re.findall(r"[a-z0-9]+", str(value).lower())
+
+def _keyword(value):
+    return " ".join(_words(value))
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+def _period(value):
+    """Return the (first, last) day covered by a period string."""
+    value = str(value).strip()
+    match = re.fullmatch(r"(\d{4})(?:-(?:[Qq]([1-4])|(\d{2})(?:-(\d{2}))?))?", value)
+    if not match:
+        raise ValueError(f"Invalid date filter: {value!r} (use YYYY, YYYY-Qn, YYYY-MM or YYYY-MM-DD)")
+    year, quarter, month, day = match.groups()
+    year = int(year)
+    try:
+        if day:
+            first = last = datetime.date(year, int(month), int(day))
+        elif month:
+            first = datetime.date(year, int(month), 1)
+            last = (first.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+        elif quarter:
+            first = datetime.date(year, 3 * int(quarter) - 2, 1)
+            last = (datetime.date(year + 1, 1, 1) if quarter == "4"
+                    else datetime.date(year, 3 * int(quarter) + 1, 1)) - datetime.timedelta(days=1)
+        else:
+            first, last = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    except ValueError:
+        raise ValueError(f"Invalid date filter: {value!r}")
+    return first, last
+
+def clean_filters(filters):
+    """
+    Drop empty values and reject unknown keys. Returns a new dict, or {} if
+    nothing is left to filter on.
+    """
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("Filters must be an object of field: value pairs.")
+    cleaned = {}
+    for key, value in (filters or {}).items():
+        if value is None or value == "" or value == []:
+            continue
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Unknown filter: {key!r} (supported: {', '.join(FILTER_KEYS)})")
+        cleaned[key] = value
+    return cleaned
+
+
+class MetadataIndex:
+    """
+    Inverted index over chunk metadata, built next to a FAISS store.
+
+    Maps keyword values and free-text words to the chunk-store rows of the
+    chunks that carry them, and keeps the chunk dates sorted so a date range
+    is two binary searches. Rows, unlike FAISS positions, do not change when
+    other chunks are deleted, so a new index version can start from the
+    previous one's postings. select() turns a filter dict into the FAISS
+    positions to search, which filtered_search() then restricts FAISS to.
+    """
+
+    def __init__(self, rows, entries, base=None):
+        """
+        `rows` maps FAISS positions to chunk rows. `entries` yields (row,
+        metadata) for every chunk not already indexed by `base`, the index of
+        an earlier version whose postings are kept for rows still in `rows`.
+        """
+        self._set_rows(rows)
+        postings = {field: {} for field in KEYWORD_FIELDS + TEXT_FIELDS}
+        dated = []
+        for row, metadata in entries:
+            metadata = metadata or {}
+            if not metadata.get("category") and "/" in metadata.get("s3_key", ""):
+                # Chunks uploaded without a category still carry their S3 folder.
+                metadata = {**metadata, "category": metadata["s3_key"].rsplit("/", 1)[0]}
+            for field in KEYWORD_FIELDS:
+                if metadata.get(field):
+                    postings[field].setdefault(_keyword(metadata[field]), []).append(row)
+            for field in TEXT_FIELDS:
+                if metadata.get(field):
+                    for word in set(_words(metadata[field])):
+                        postings[field].setdefault(word, []).append(row)
+            if metadata.get("date"):
+                try:
+                    dated.append((datetime.date.fromisoformat(metadata["date"]).toordinal(), row))
+                except (TypeError, ValueError):
+                    pass
+        arrays = {field: {value: np.asarray(found, dtype=np.int64) for value, found in values.items()}
+                  for field, values in postings.items()}
+        dates = np.asarray(dated, dtype=np.int64).reshape(-1, 2)
+        if base is not None:
+            for field, values in base._postings.items():
+                for value in values:
+                    new = arrays[field].get(value)
+                    kept = base._lookup(field, value)
+                    arrays[field][value] = kept if new is None else np.concatenate([kept, new])
+            dates = np.concatenate([base._dates, dates])
+        # Only rows of this version are indexed (the base has rows deleted since).
+        live = np.zeros(int(self._rows.max(initial=-1)) + 1, dtype=bool)
+        live[self._rows] = True
+        def is_live(found):
+            inside = found < live.size
+            inside[inside] = live[found[inside]]
+            return inside
+        # All posting lists live in one array; _postings maps field -> value -> (start, stop).
+        self._postings = {field: {} for field in arrays}
+        chunks = []
+        offset = 0
+        for field, values in arrays.items():
+            for value, found in values.items():
+                found = np.unique(found[is_live(found)])
+                if not found.size:
+                    continue
+                self._postings[field][value] = (offset, offset + found.size)
+                chunks.append(found)
+                offset += found.size
+        self._data = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        dates = dates[is_live(dates[:, 1])]
+        self._dates = dates[np.lexsort((dates[:, 1], dates[:, 0]))]
+
+    def _set_rows(self, rows):
+        self._rows = rows
+        self.size = len(rows)
+        # Rows are appended in position order, so they are normally sorted already.
+        self._order = None if np.all(rows[1:] > rows[:-1]) else np.argsort(rows, kind="stable")
+
+    def save(self, path):
+        """Write the index to `path` (a directory) for load()."""
+        np.save(os.path.join(path, "metadata_postings.npy"), self._data)
+        np.save(os.path.join(path, "metadata_dates.npy"), self._dates)
+        with open(os.path.join(path, "metadata_index.json"), "w") as f:
+            json.dump({"postings": self._postings}, f)
+
+    @classmethod
+    def load(cls, path, rows, mmap=False):
+        """
+        Read an index written by save(), for a version whose positions map to
+        `rows`. With `mmap`, the posting arrays are memory-mapped read-only,
+        so processes loading the same files share them.
+        """
+        index = cls.__new__(cls)
+        index._set_rows(rows)
+        with open(os.path.join(path, "metadata_index.json")) as f:
+            saved = json.load(f)
+        index._postings = {
+            field: {value: tuple(span) for value, span in values.items()}
+            for field, values in saved["postings"].items()
+        }
+        mmap_mode = "r" if mmap else None
+        index._data = np.load(os.path.join(path, "metadata_postings.npy"), mmap_mode=mmap_mode)
+        index._dates = np.load(os.path.join(path, "metadata_dates.npy"), mmap_mode=mmap_mode)
+        return index
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes + self._dates.nbytes + self._rows.nbytes
+
+    def _lookup(self, field, value):
+        span = self._postings[field].get(value)
+        return self._data[span[0]:span[1]] if span else np.empty(0, dtype=np.int64)
+
+    def positions(self, rows):
+        """FAISS positions of `rows` (sorted), which must all be in this version."""
+        if self._order is None:
+            return np.searchsorted(self._rows, rows)
+        return np.sort(self._order[np.searchsorted(self._rows, rows, sorter=self._order)])
+
+    def _match_keyword(self, field, values):
+        matches = [self._lookup(field, _keyword(value)) for value in _as_list(values)]
+        return np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+
+    def _match_text(self, field, values):
+        matches = []
+        for value in _as_list(values):
+            words = _words(value)
+            if not words:
+                continue
+            match = self._lookup(field, words[0])
+            for word in words[1:]:
+                match = np.intersect1d(match, self._lookup(field, word), assume_unique=True)
+            matches.append(match)
+        return np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+
+    def _match_dates(self, first, last):
+        ordinals = self._dates[:, 0]
+        lo = np.searchsorted(ordinals, first.toordinal(), side="left")
+        hi = np.searchsorted(ordinals, last.toordinal(), side="right")
+        return np.unique(self._dates[lo:hi, 1])
+
+    def select(self, filters):
+        """
+        Return the sorted FAISS positions matching every filter, or None if
+        `filters` is empty (search everything). Values of keyword and
+        free-text filters may be lists, meaning "any of".
+        """
+        filters = clean_filters(filters)
+        if not filters:
+            return None
+        selected = None
+        for field in KEYWORD_FIELDS + TEXT_FIELDS:
+            if field in filters:
+                match = (self._match_keyword if field in KEYWORD_FIELDS else self._match_text)(field, filters[field])
+                selected = match if selected is None else np.intersect1d(selected, match, assume_unique=True)
+        if any(key in filters for key in DATE_FILTERS):
+            first, last = datetime.date.min, datetime.date.max
+            if "date" in filters:
+                first, last = _period(filters["date"])
+            if "date_from" in filters:
+                first = max(first, _period(filters["date_from"])[0])
+            if "date_to" in filters:
+                last = min(last, _period(filters["date_to"])[1])
+            match = self._match_dates(first, last)
+            selected = match if selected is None else np.intersect1d(selected, match, assume_unique=True)
+        return self.positions(selected)
+
+    def stats(self):
+        return {
+            "chunks": self.size,
+            "dated_chunks": int(self._dates.shape[0]),
+            "values": {field: len(values) for field, values in self._postings.items()},
+        }
+
+
+def query_vector(vectorstore, query, embedding=None):
+    """
+    Embed `query` the way `vectorstore` expects it (normalised if the store
+    is); `embedding` is its raw embedding if already known.
+    """
+    if embedding is None:
+        embedding = vectorstore._embed_query(query)
+    vector = np.asarray([embedding], dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(vector)
+    return vector
+
+def query_vectors(vectorstore, queries, embeddings=None):
+    """query_vector() for several queries, embedded in one call if the embedder can batch queries."""
+    if embeddings is not None:
+        vectors = embeddings
+    elif hasattr(vectorstore.embedding_function, "embed_queries"):
+        vectors = vectorstore.embedding_function.embed_queries(queries)
+    else:
+        vectors = [vectorstore._embed_query(query) for query in queries]
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(queries), -1)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def _selector_params(index, selector, count):
+    """
+    Search parameters restricting `index` to the `count` vectors `selector`
+    accepts. Approximate indexes visit proportionally more cells / graph
+    nodes when only a fraction of the vectors qualify, so a selective filter
+    still fills its top-k.
+    """
+    widen = index.ntotal / max(1, count)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(index.nlist, math.ceil(index.nprobe * widen)))
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=min(MAX_FILTERED_EF_SEARCH, math.ceil(index.hnsw.efSearch * widen)))
+    return faiss.SearchParameters(sel=selector)
+
+def filtered_search_by_vector(vectorstore, vector, k, positions=None, exclude=None):
+    """
+    Top-k (Document, distance) pairs for an embedded query, searching only
+    FAISS `positions` (all vectors if None) and skipping the sorted positions
+    in `exclude` (vectors deleted since the index was written). Distances
+    are "lower is better" for every metric, so results from several stores
+    can be merged directly. Small candidate sets are ranked exactly from
+    their reconstructed vectors; larger ones use a FAISS ID selector.
+    """
+    return filtered_search_by_vectors(vectorstore, vector, k, positions, exclude)[0]
+
+def filtered_search_by_vectors(vectorstore, vectors, k, positions=None, exclude=None):
+    """filtered_search_by_vector() for each row of `vectors`, in one FAISS search."""
+    index = vectorstore.index
+    if exclude is not None and not len(exclude):
+        exclude = None
+    if exclude is not None and positions is not None:
+        positions = np.setdiff1d(positions, exclude, assume_unique=True)
+        exclude = None
+    limit = len(positions) if positions is not None else index.ntotal - (0 if exclude is None else len(exclude))
+    k = min(k, limit)
+    if k <= 0:
+        return [[] for _ in vectors]
+    inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    if positions is not None and len(positions) <= EXACT_SEARCH_MAX_CANDIDATES:
+        # Approximate indexes reconstruct from their stored codes, which ranks
+        # candidates the same way their own search would.
+        candidates = index.reconstruct_batch(positions)
+        hits = []
+        for vector in vectors:
+            if inner_product:
+                scores = candidates @ vector
+            else:
+                scores = ((candidates - vector) ** 2).sum(axis=1)
+            order = np.argsort(-scores if inner_product else scores, kind="stable")[:k]
+            hits.append(zip(positions[order], scores[order]))
+    else:
+        params = None
+        if positions is not None:
+            params = _selector_params(index, faiss.IDSelectorBatch(positions), limit)
+        elif exclude is not None:
+            excluded = faiss.IDSelectorNot(faiss.IDSelectorBatch(exclude))
+            params = _selector_params(index, excluded, limit)
+        scores, found = index.search(vectors, k, params=params)
+        hits = [[(i, score) for i, score in zip(row_found, row_scores) if i != -1]
+                for row_found, row_scores in zip(found, scores)]
+    return [
+        [
+            (vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)]), float(-score if inner_product else score))
+            for i, score in row
+        ]
+        for row in hits
+    ]
+
+def filtered_search(vectorstore, query, k, positions=None):
+    """Top-k Documents for `query` (see filtered_search_by_vector)."""
+    vector = query_vector(vectorstore, query)
+    return [doc for doc, _ in filtered_search_by_vector(vectorstore, vector, k, positions)]
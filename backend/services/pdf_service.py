@@ -1,52 +1,74 @@
 # /backend/services/pdf_service.py
 
-import re
+import io
 import os
-from dotenv import load_dotenv
+import shutil
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.concurrency import run_in_threadpool
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import CharacterTextSplitter
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain.schema import Document
 
-from services.vectorstore_manager import get_faiss_index, save_faiss_index, get_docs
+from services.vectorstore_manager import (
+    list_partitions,
+    group_by_partition,
+    make_vector_id,
+    update_index,
+    replace_index,
+    new_chunk_store_path,
+    built_store,
+    replace_by_source,
+)
+from services.index_search import (
+    count_matches,
+    index_version,
+    run_search,
+    asearch_index,
+    asearch_index_batch,
+    asearch_store,
+)
+from services.llm_service import ask_llm
+from services.metadata_index import clean_filters
+from services.answer_cache import answer_scope
+from services.answer_stream import answer_events, message_events
+from services.index_builder import ShardedIndexWriter
 from status import (
+    new_indexing_status,
     update_indexing_status,
-    reset_indexing_status,
-    increment_indexing_current,
+    start_indexing,
     set_indexing_current_file,
+    increment_indexing_success,
+    increment_indexing_fail,
     set_indexing_error,
     finish_indexing,
-    indexing_status
 )
-from config import VECTORSTORE_PATH, embedding_model, OPENAI_API_KEY
+from config import INDEX_SHARD_DIR, INDEX_SHARD_SIZE, embedding_model, document_cache, answer_cache, ASK_BATCH_CONCURRENCY
 from services.s3_service import (
+    S3_FOLDERS,
     upload_pdf_to_s3,
     download_file_from_s3,
-    list_pdfs_in_s3,
+    get_s3_etag,
+    s3_object_exists,
+    delete_s3_object,
+    iter_pdf_objects,
     sanitize_s3_folder_name,
+    make_s3_key,
 )
-from utils.s3_wrappers import (
-    list_pdfs_in_s3_folder,
-    download_file_from_s3_folder,
+from services.index_manifest import (
+    load_manifest,
+    save_manifest,
+    diff_manifest,
+    make_manifest_entry,
 )
+from services.index_pipeline import run_index_pipeline
+from utils.metadata_extractor import metadata_extractor
+from utils.pdf_parser import load_pdf_pages, load_pdf_bytes
 
 def get_temp_path(filename):
     temp_folder = os.path.join(os.getcwd(), "tmp")
     os.makedirs(temp_folder, exist_ok=True)
     return os.path.join(temp_folder, filename)
 
-S3_FOLDERS = [
-    "Document_Management_System_(DMS)_Integration",
-    "Maintenance_Notification_Documents",
-    "Maintenance_Planning_Documents",
-    "Procurement_and_Material_Management",
-    "Reporting_and_Historical_Documents",
-    "Work_Order_Documents",
-]
-
 qa_template = """
 You are a helpful assistant. Use ONLY the context below to answer the user's question.
 If the answer cannot be found directly, but you can summarize or infer from the context, please do so.
@@ -71,82 +93,139 @@ os.makedirs(TMP_DIR, exist_ok=True)
 
 
 # ======= REINDEX ALL PDFS ==========
-import re
 
-def reindex_all_pdfs():
-    print("[INFO] Starting full re-indexing of all S3 PDFs")
-    reset_indexing_status()
-    all_docs = []
-    current_counter = 0
+def list_all_s3_pdf_objects():
+    """
+    List every PDF object (key, ETag, size) across all S3_FOLDERS. S3 errors
+    are raised: a folder whose listing failed must never read as empty, or
+    its documents would be dropped from the index.
+    """
+    s3_objects = []
     for folder in S3_FOLDERS:
-        filenames = [f for f in list_pdfs_in_s3_folder(folder) if f and isinstance(f, str)]
-        print(f"[INFO] Indexing {folder}: {len(filenames)} PDFs")
-        for filename in filenames:
-            if not isinstance(filename, str) or not filename.strip() or not folder:
-                print(f"[WARN] Invalid filename or folder: {folder}/{filename}")
-                continue
-            current_counter += 1
-            update_indexing_status(current=current_counter, status=f"Indexing {folder}/{filename} ({current_counter})")
-            set_indexing_current_file(f"{folder}/{filename}")
-            local_path = os.path.join(TMP_DIR, filename)
-            success = download_file_from_s3_folder(filename, local_path, folder=folder)
-            if not success:
-                print(f"[WARN] Skipped {filename} — download failed.")
-                set_indexing_error(f"Failed to download {filename} from {folder}")
-                continue
-            try:
-                loader = PyPDFLoader(local_path)
-                raw_pages = loader.load()
-                if not raw_pages:
-                    print(f"[WARN] Empty PDF: {filename}")
-                    continue
-                splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-                chunks = splitter.split_documents(raw_pages)
-
-                # ========== ENRICH METADATA FOR EACH CHUNK ==========
-                for chunk in chunks:
-                    chunk.metadata["source"] = filename
-
-                    # Equipment/Asset ID
-                    match = re.search(r"(Equipment|Asset)[\s:]+([\w\-]+)", chunk.page_content)
-                    if match:
-                        chunk.metadata["asset_id"] = match.group(2)
-
-                    # Failure Type
-                    match = re.search(r"Failure Type[\s:]+([A-Za-z\s]+)", chunk.page_content)
-                    if match:
-                        chunk.metadata["failure_type"] = match.group(1).strip()
-
-                    # Date
-                    match = re.search(r"Date[\s:]+(\d{4}-\d{2}-\d{2})", chunk.page_content)
-                    if match:
-                        chunk.metadata["date"] = match.group(1)
-
-                    # Handled By
-                    match = re.search(r"Handled By[\s:]+([A-Za-z\s.]+)", chunk.page_content)
-                    if match:
-                        chunk.metadata["handled_by"] = match.group(1).strip()
-                # ========== END METADATA ENRICHMENT ==========
-
-                all_docs.extend(chunks)
-            except Exception as e:
-                print(f"[ERROR] Failed to process {filename}: {e}")
-                set_indexing_error(str(e))
-            finally:
-                try:
-                    os.remove(local_path)
-                except Exception as e:
-                    print(f"[WARN] Could not delete temp file: {e}")
-
-    if all_docs:
-        print(f"[INFO] Total chunks generated: {len(all_docs)}")
-        from langchain_community.vectorstores import FAISS
-        faiss_index = FAISS.from_documents(all_docs, embedding_model)
-        save_faiss_index(faiss_index, all_docs)
-        print("[INFO] Re-indexing completed and saved.")
+        objects = list(iter_pdf_objects(prefix=folder))
+        print(f"[INFO] {folder}: {len(objects)} PDFs in S3")
+        for obj in objects:
+            obj["folder"] = folder
+        s3_objects.extend(objects)
+    return s3_objects
+
+def reindex_all_pdfs(incremental=True, job=None):
+    """
+    Re-index the S3 PDF library.
+
+    incremental=True (default) compares a fresh S3 listing against the
+    manifest in INDEXED_FILES_PATH and only downloads/embeds new or changed
+    objects (by ETag and size); vectors of changed or deleted objects are
+    dropped from the index. Falls back to a full rebuild when there is no
+    manifest or no index on disk. Only the partitions (categories) touched by
+    the changes are rewritten.
+
+    When run as a background job (services/jobs.py), progress is reported on
+    the job's status and cancellation is checked at file boundaries; a
+    cancelled run leaves the index and manifest untouched.
+    """
+    status = job.status if job is not None else new_indexing_status()
+    start_indexing(status, 0)
+    manifest = load_manifest() if incremental else {}
+    if incremental and (not manifest or not list_partitions()):
+        print("[INFO] No manifest or index found; doing a full re-index.")
+        incremental = False
+        manifest = {}
+
+    print(f"[INFO] Starting {'incremental' if incremental else 'full'} re-indexing of all S3 PDFs")
+    s3_objects = list_all_s3_pdf_objects()
+    if incremental and manifest and not s3_objects:
+        # Never read an empty bucket (e.g. a misconfigured one) as "everything was deleted".
+        print("[WARN] S3 listing returned no PDFs; keeping the current index.")
+        raise RuntimeError("S3 listing returned no PDFs; keeping the current index.")
+    if incremental:
+        new, changed, removed = diff_manifest(manifest, s3_objects)
+        print(f"[INFO] {len(new)} new, {len(changed)} changed, {len(removed)} removed PDFs")
     else:
-        print("[WARN] No documents were indexed.")
-    finish_indexing()
+        new, changed, removed = s3_objects, [], []
+    to_index = new + changed
+    update_indexing_status(status, total=len(to_index))
+
+    stale_keys = set(removed)
+    new_chunk_count = 0
+    # Full re-index: streamed into on-disk shards and a new chunk store per
+    # partition, then merged and published one partition at a time.
+    # Incremental: batches are applied after stale vectors are dropped.
+    writers = {}
+    pending_batches = []
+    if not incremental:
+        shutil.rmtree(INDEX_SHARD_DIR, ignore_errors=True)
+
+    def on_file_parsed(obj, chunks):
+        key = obj["key"]
+        stale_keys.add(key)
+        ids = [make_vector_id(key, i) for i in range(len(chunks))]
+        manifest[key] = make_manifest_entry(obj, chunks, ids)
+        return ids
+
+    def on_batch_embedded(docs, ids, vectors):
+        nonlocal new_chunk_count
+        new_chunk_count += len(docs)
+        if incremental:
+            pending_batches.append((docs, ids, vectors))
+            return
+        for name, batch in group_by_partition(docs, ids, vectors).items():
+            if name not in writers:
+                writers[name] = ShardedIndexWriter(
+                    os.path.join(INDEX_SHARD_DIR, name), new_chunk_store_path(name), INDEX_SHARD_SIZE
+                )
+            writers[name].add(*batch)
+
+    def partition_stores():
+        # Each partition is merged only once the previous one has been
+        # published, so memory is bounded by one partition, not the corpus.
+        while writers:
+            name, writer = writers.popitem()
+            merged = writer.merge()
+            if merged is not None:
+                yield name, built_store(*merged, writer.chunk_store_path)
+            merged = None
+
+    try:
+        # Failed downloads/parses never reach on_file_parsed, so their previous
+        # vectors and manifest entries are kept.
+        run_index_pipeline(
+            to_index, TMP_DIR, on_file_parsed, on_batch_embedded,
+            check_cancelled=job.check_cancelled if job else None,
+            status=status,
+        )
+        if not incremental and new_chunk_count:
+            print(f"[INFO] Total chunks generated: {new_chunk_count}")
+            partition_count = len(writers)
+            replace_index(partition_stores())
+            save_manifest(manifest)
+            print(f"[INFO] Re-indexing completed and saved ({partition_count} partitions).")
+    except BaseException:
+        # Writers not yet published leave no shards or chunk stores behind.
+        for writer in writers.values():
+            writer.discard()
+        raise
+
+    if not incremental:
+        if not new_chunk_count:
+            print("[WARN] No documents were indexed.")
+    elif new_chunk_count or stale_keys:
+        # Drop old vectors of every re-parsed or removed object first: a changed
+        # PDF reuses its IDs, and an uploaded one may already be in the index.
+        # Each touched partition is modified as a private copy and then published.
+        removed_count, added_count = update_index(stale_keys, pending_batches)
+        if removed_count:
+            print(f"[INFO] Removed {removed_count} stale vectors.")
+        if added_count:
+            print(f"[INFO] Added {added_count} new chunks.")
+        for key in removed:
+            manifest.pop(key, None)
+        save_manifest(manifest)
+        print("[INFO] Incremental re-indexing completed and saved.")
+    else:
+        print("[INFO] Index is up to date; nothing to re-index.")
+    finish_indexing(status)
+
 
 
 
@@ -156,24 +235,67 @@ def reindex_all_pdfs():
 
 
 def process_and_index_pdf(pdf_file, pdf_filename, category=None, skip_s3_upload=False):
-    sanitized_category = sanitize_s3_folder_name(category) if category else None
+    """
+    Index an uploaded PDF, and upload it to S3 unless skip_s3_upload.
 
-    # Upload to S3 if required
-    if not skip_s3_upload:
-        pdf_file.seek(0)
-        upload_success = upload_pdf_to_s3(pdf_file, pdf_filename, folder=sanitized_category)
-        if not upload_success:
-            set_indexing_error("Upload to S3 failed.")
+    The file is read once. It is parsed and embedded from memory while the S3
+    upload runs alongside, and the index is only updated once both have
+    succeeded. If indexing fails after the upload, the object is deleted from
+    S3 again, unless it replaced an earlier copy (whose chunks stay indexed).
+    Progress is reported on a status of its own, never on a reindex job's.
+    """
+    sanitized_category = sanitize_s3_folder_name(category) if category else None
+    s3_key = make_s3_key(pdf_filename, sanitized_category)
+    status = new_indexing_status()
+    start_indexing(status, 1)
+    set_indexing_current_file(status, s3_key)
+    pdf_file.seek(0)
+    data = pdf_file.read()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        upload = None if skip_s3_upload else pool.submit(_upload_pdf_bytes, data, pdf_filename, sanitized_category)
+        try:
+            chunks, vectors = _chunk_and_embed(data, pdf_filename, s3_key, sanitized_category)
+        except Exception as e:
+            print(f"[ERROR] Indexing {s3_key} failed: {e}")
+            if upload is not None:
+                _roll_back_upload(upload.result(), pdf_filename, sanitized_category)
+            increment_indexing_fail(status)
+            set_indexing_error(status, f"Failed to index PDF: {e}")
+            return False, "Failed to parse or embed the PDF."
+        if upload is not None and upload.result()[0] is None:
+            increment_indexing_fail(status)
+            set_indexing_error(status, "Upload to S3 failed.")
             return False, "Upload to S3 failed."
 
-    temp_path = get_temp_path(pdf_filename)
-    download_success = download_file_from_s3(pdf_filename, temp_path, folder=sanitized_category)
-    if not download_success:
-        set_indexing_error("Failed to download PDF from S3 for indexing.")
-        return False, "Failed to download PDF from S3 for indexing."
+    # ===============================
+    # Replace any earlier copy of this document in the index and save
+    # ===============================
+    replace_by_source(s3_key, chunks, vectors)
+    # Questions about this document now search the main index instead.
+    document_cache.invalidate(s3_key)
+
+    update_indexing_status(status, current=1)
+    increment_indexing_success(status)
+    finish_indexing(status)
+    return True, "PDF indexed successfully." if skip_s3_upload else "PDF uploaded and indexed successfully."
+
+def _upload_pdf_bytes(data, pdf_filename, sanitized_category):
+    """(S3 URL or None on failure, whether the upload replaced an existing object)."""
+    existed = s3_object_exists(pdf_filename, folder=sanitized_category)
+    return upload_pdf_to_s3(io.BytesIO(data), pdf_filename, folder=sanitized_category), existed
+
+def _roll_back_upload(upload_result, pdf_filename, sanitized_category):
+    url, existed = upload_result
+    if url is None:
+        return
+    if existed is False:
+        delete_s3_object(pdf_filename, folder=sanitized_category)
+    else:
+        print(f"[WARN] {pdf_filename} replaced an existing S3 object; its earlier chunks stay indexed.")
 
-    loader = PyPDFLoader(temp_path)
-    docs = loader.load()
+def _chunk_and_embed(data, pdf_filename, s3_key, sanitized_category):
+    docs = load_pdf_bytes(data, pdf_filename)
     splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
     chunks = splitter.split_documents(docs)
 
@@ -182,128 +304,143 @@ def process_and_index_pdf(pdf_file, pdf_filename, category=None, skip_s3_upload=
     # ===============================
     for chunk in chunks:
         chunk.metadata["source"] = pdf_filename
+        chunk.metadata["s3_key"] = s3_key
+        if sanitized_category:
+            chunk.metadata["category"] = sanitized_category
 
-        # Extract Asset/Equipment ID
-        match = re.search(r"(Equipment|Asset)[\s:]+([\w\-]+)", chunk.page_content)
-        if match:
-            chunk.metadata["asset_id"] = match.group(2)
+    metadata_extractor.enrich(chunks)
+    vectors = embedding_model.embed_documents([chunk.page_content for chunk in chunks]) if chunks else []
+    return chunks, vectors
 
-        # Extract Failure Type
-        match = re.search(r"Failure Type[\s:]+([A-Za-z\s]+)", chunk.page_content)
-        if match:
-            chunk.metadata["failure_type"] = match.group(1).strip()
 
-        # Extract Date
-        match = re.search(r"Date[\s:]+(\d{4}-\d{2}-\d{2})", chunk.page_content)
-        if match:
-            chunk.metadata["date"] = match.group(1)
 
-        # Extract Handled By
-        match = re.search(r"Handled By[\s:]+([A-Za-z\s.]+)", chunk.page_content)
-        if match:
-            chunk.metadata["handled_by"] = match.group(1).strip()
 
-    # ===============================
-    # Add to vectorstore and save
-    # ===============================
-    vectorstore = get_faiss_index()
-    if vectorstore:
-        vectorstore.add_texts([doc.page_content for doc in chunks], metadatas=[doc.metadata for doc in chunks])
-        save_faiss_index(vectorstore, get_docs() + chunks)
-    else:
-        from langchain_community.vectorstores import FAISS
-        vectorstore = FAISS.from_documents(chunks, embedding_model)
-        save_faiss_index(vectorstore, chunks)
 
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
 
-    finish_indexing()
-    return True, "PDF indexed successfully." if skip_s3_upload else "PDF uploaded and indexed successfully."
+# ======= SINGLE PDF QUERY ==========
+class _DocumentUnavailable(Exception):
+    """A single-PDF question that cannot be answered; the message is returned instead (and not cached)."""
 
 
+async def ask_pdf(question, filename, category=None, use_cache=True):
+    """
+    Answer a question for a single PDF (optionally specifying a sanitized category/folder).
+    An indexed PDF is answered from its own chunks in the main index; any
+    other PDF gets a per-document index, cached by S3 key and ETag so that
+    follow-up questions skip the download, parsing and embedding. Answers
+    are cached per index version (or ETag) unless use_cache is False.
+    """
+    try:
+        scope, make_search = await _pdf_question(filename, category)
 
+        async def compute():
+            return await _ask_document(await make_search(), question)
 
+        return await answer_cache.get_or_compute(scope, question, compute, use_cache)
+    except _DocumentUnavailable as e:
+        return str(e)
 
+async def stream_ask_pdf(question, filename, category=None, use_cache=True):
+    """ask_pdf() as Server-Sent Events (see services/answer_stream.py)."""
+    try:
+        scope, make_search = await _pdf_question(filename, category)
+        cached, vector = await answer_cache.lookup(scope, question, use_cache)
+        search = await make_search()
+    except _DocumentUnavailable as e:
+        return message_events(str(e))
+    docs = await search(question)
+    if not any(d.page_content.strip() for d in docs):
+        return message_events("Not found in the document.")
+    store = (lambda answer: answer_cache.store(scope, question, answer, vector)) if use_cache else None
+    return answer_events(question, docs, prompt, _document_answer, cached=cached, store=store)
+
+async def _pdf_question(filename, category):
+    """
+    (answer cache scope, async function returning an async search function)
+    for questions about one PDF. Raises _DocumentUnavailable if it is neither
+    indexed nor in S3.
+    """
+    sanitized_category = sanitize_s3_folder_name(category) if category else None
+    s3_key = make_s3_key(filename, sanitized_category)
+    filters = {"s3_key": s3_key}
+    if sanitized_category:
+        # Also keeps the search to the category's partition.
+        filters["category"] = sanitized_category
 
-import re
+    if await run_search(count_matches, filters):
+        version = await run_search(index_version, filters)
 
-# ======= SINGLE PDF QUERY ==========
-async def ask_pdf(question, filename, category=None):
+        async def make_search():
+            return lambda question: asearch_index(question, 10, filters)
+    else:
+        version = await run_in_threadpool(get_s3_etag, filename, sanitized_category)
+        if version is None:
+            raise _DocumentUnavailable("Error downloading PDF from S3.")
+
+        async def make_search():
+            vectorstore = await run_in_threadpool(_document_store, filename, sanitized_category, s3_key, version)
+            return lambda question: asearch_store(vectorstore, question, 10)
+
+    return answer_scope("ask_pdf", s3_key=s3_key, version=version), make_search
+
+async def _ask_document(search, question):
+    retrieved_docs = await search(question)
+
+    if not retrieved_docs or not any(d.page_content.strip() for d in retrieved_docs):
+        return "Not found in the document."
+
+    # LLM Q&A
+    raw_answer = await ask_llm(question, retrieved_docs, prompt)
+    return _document_answer(raw_answer, retrieved_docs)
+
+def _not_found(raw_answer):
+    return not raw_answer or "not found" in raw_answer.lower()
+
+def _document_answer(raw_answer, retrieved_docs):
+    """The model's answer about one PDF, or its most relevant content if the model found none."""
+    if not _not_found(raw_answer):
+        return raw_answer
+    if retrieved_docs and any(d.page_content.strip() for d in retrieved_docs):
+        context_snippet = retrieved_docs[0].page_content.strip()[:1000]
+        return f"Direct answer not found. Here is the most relevant content from the document:\n\n{context_snippet}"
+    return "Not found in the document."
+
+def _document_store(filename, sanitized_category, s3_key, etag):
     """
-    Answer a question for a single PDF (optionally specifying a sanitized category/folder).
+    FAISS store over one PDF that is not in the main index, from the document
+    cache if its S3 ETag is unchanged. Raises _DocumentUnavailable if there
+    is none.
     """
-    temp_path = get_temp_path(filename)
-    sanitized_category = sanitize_s3_folder_name(category) if category else None
+    vectorstore = document_cache.get(s3_key, etag)
+    if vectorstore is not None:
+        return vectorstore
 
+    temp_path = get_temp_path(filename)
     try:
         # Download PDF from S3
         download_success = download_file_from_s3(filename, temp_path, folder=sanitized_category)
         if not download_success:
-            return "Error downloading PDF from S3."
+            raise _DocumentUnavailable("Error downloading PDF from S3.")
 
         # Load and split PDF
-        loader = PyPDFLoader(temp_path)
-        docs = loader.load()
+        docs = load_pdf_pages(temp_path)
         splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
         chunks = splitter.split_documents(docs)
 
         if not chunks:
-            return "PDF appears empty or unreadable."
+            raise _DocumentUnavailable("PDF appears empty or unreadable.")
 
         # Enrich chunk metadata
         for chunk in chunks:
             chunk.metadata["source"] = filename
+        metadata_extractor.enrich(chunks)
 
-            # Regex-based metadata enrichment
-            match = re.search(r"(Equipment|Asset)[\s:]+([\w\-]+)", chunk.page_content)
-            if match:
-                chunk.metadata["asset_id"] = match.group(2)
-
-            match = re.search(r"Failure Type[\s:]+([A-Za-z\s]+)", chunk.page_content)
-            if match:
-                chunk.metadata["failure_type"] = match.group(1).strip()
-
-            match = re.search(r"Date[\s:]+(\d{4}-\d{2}-\d{2})", chunk.page_content)
-            if match:
-                chunk.metadata["date"] = match.group(1)
-
-            match = re.search(r"Handled By[\s:]+([A-Za-z\s.]+)", chunk.page_content)
-            if match:
-                chunk.metadata["handled_by"] = match.group(1).strip()
-
-        # Create temporary vectorstore and retriever
         from langchain_community.vectorstores import FAISS
         vectorstore = FAISS.from_documents(chunks, embedding_model)
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-        retrieved_docs = retriever.get_relevant_documents(question)
-
-        if not retrieved_docs or not any(d.page_content.strip() for d in retrieved_docs):
-            return "Not found in the document."
-
-        # LLM Q&A
-        llm = ChatOpenAI(
-            openai_api_key=OPENAI_API_KEY,
-            model="gpt-4o",
-            temperature=0,
-        )
-        qa_chain = RetrievalQA.from_chain_type(
-            llm,
-            retriever=retriever,
-            chain_type="stuff",
-            chain_type_kwargs={"prompt": prompt},
-            return_source_documents=True
-        )
-        result = await run_in_threadpool(qa_chain, {"query": question})
-        raw_answer = result['result'].strip()
-
-        if not raw_answer or "not found" in raw_answer.lower():
-            if retrieved_docs and any(d.page_content.strip() for d in retrieved_docs):
-                context_snippet = retrieved_docs[0].page_content.strip()[:1000]
-                return f"Direct answer not found. Here is the most relevant content from the document:\n\n{context_snippet}"
-            else:
-                return "Not found in the document."
-        return raw_answer
+        # The ETag read before downloading: if the object changed in between,
+        # the next question sees a different ETag and rebuilds.
+        document_cache.put(s3_key, etag, vectorstore)
+        return vectorstore
 
     finally:
         # Always clean up temp file
@@ -323,37 +460,104 @@ async def ask_pdf(question, filename, category=None):
 
 
 # ======= GLOBAL QUERY (ALL INDEXED PDFS) ==========
-async def ask_all_pdfs(question, category=None):
+async def ask_all_pdfs(question, category=None, filters=None, use_cache=True):
+    """
+    Answer a question across all PDFs, optionally restricted to a category/folder
+    and to chunks matching metadata `filters` (see services.metadata_index).
+    Searches the category partition only, or fans out across all partitions.
+    Answers are cached per index version unless use_cache is False.
+    """
+    filters, unanswerable = await _index_question(category, filters)
+    if unanswerable:
+        return unanswerable
+    scope = answer_scope("ask_all_pdfs", filters=filters, version=await run_search(index_version, filters))
+
+    async def compute():
+        return await _ask_docs(question, await asearch_index(question, 10, filters))
+
+    return await answer_cache.get_or_compute(scope, question, compute, use_cache)
+
+async def stream_ask_all_pdfs(question, category=None, filters=None, use_cache=True):
+    """ask_all_pdfs() as Server-Sent Events (see services/answer_stream.py)."""
+    filters, unanswerable = await _index_question(category, filters)
+    if unanswerable:
+        return message_events(unanswerable)
+    scope = answer_scope("ask_all_pdfs", filters=filters, version=await run_search(index_version, filters))
+    cached, vector = await answer_cache.lookup(scope, question, use_cache)
+    docs = await asearch_index(question, 10, filters)
+    store = (lambda answer: answer_cache.store(scope, question, answer, vector)) if use_cache else None
+    return answer_events(question, docs, prompt, _index_answer, cached=cached, store=store)
+
+async def ask_all_pdfs_batch(questions, category=None, filters=None, use_cache=True, ordered=False):
     """
-    Answer a question across all PDFs (optionally restricted to a sanitized category/folder).
-    Uses only the in-memory singleton FAISS index for fast querying.
+    ask_all_pdfs() for each of `questions` (same category and filters), as an
+    async iterator of (position, answer or None, error or None). Questions are
+    embedded in one call and searched as one query matrix; their LLM calls run
+    at most ASK_BATCH_CONCURRENCY at a time, and results come back as they
+    complete, or in order if `ordered`.
     """
-    vectorstore = get_faiss_index()
-    if not vectorstore:
-        return "No FAISS index loaded. Please re-index or upload PDFs first."
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-
-    llm = ChatOpenAI(
-        openai_api_key=OPENAI_API_KEY,
-        model="gpt-4o",
-        temperature=0,
-    )
-    qa_chain = RetrievalQA.from_chain_type(
-        llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt},
-        return_source_documents=True
-    )
-    result = await run_in_threadpool(qa_chain, {"query": question})
-    raw_answer = result['result'].strip()
-
-
-    if not raw_answer or "not found" in raw_answer.lower():
-        docs = retriever.get_relevant_documents(question)
-        if docs and any(d.page_content.strip() for d in docs):
-            context_snippet = docs[0].page_content.strip()[:1000]
-            return f"Here is the most relevant content from the document:\n\n{context_snippet}"
+    filters, unanswerable = await _index_question(category, filters)
+    if unanswerable:
+        return _batch_results([_static_answer(unanswerable) for _ in questions], ordered=True)
+    scope = answer_scope("ask_all_pdfs", filters=filters, version=await run_search(index_version, filters))
+    retrieved = await asearch_index_batch(questions, 10, filters)
+    semaphore = asyncio.Semaphore(ASK_BATCH_CONCURRENCY)
+
+    async def answer(question, docs):
+        async with semaphore:
+            return await answer_cache.get_or_compute(scope, question, lambda: _ask_docs(question, docs), use_cache)
+
+    return _batch_results([answer(q, docs) for q, docs in zip(questions, retrieved)], ordered)
+
+async def _static_answer(answer):
+    return answer
+
+async def _batch_results(answers, ordered):
+    tasks = [asyncio.ensure_future(answer) for answer in answers]
+    positions = {task: i for i, task in enumerate(tasks)}
+
+    async def settle(task):
+        try:
+            return positions[task], await task, None
+        except Exception as e:
+            print(f"[BATCH] Question {positions[task]} failed: {e}")
+            return positions[task], None, "Answer generation failed."
+
+    try:
+        if ordered:
+            for task in tasks:
+                yield await settle(task)
         else:
-            return "Not found in the documents."
-    return raw_answer
+            for result in asyncio.as_completed([settle(task) for task in tasks]):
+                yield await result
+    finally:
+        # The client went away: don't keep answering for nobody.
+        for task in tasks:
+            task.cancel()
+
+async def _ask_docs(question, docs):
+    """ask_all_pdfs()'s answer from already retrieved `docs`, prompted as RetrievalQA's "stuff" chain does."""
+    if not docs:
+        return "Not found in the documents."
+    return _index_answer(await ask_llm(question, docs, prompt), docs)
+
+async def _index_question(category, filters):
+    """(filters including the category, or the reason there is nothing to search)."""
+    filters = clean_filters(filters)
+    if category:
+        filters["category"] = sanitize_s3_folder_name(category)
+    # Category-scoped questions only load and search that category's partition.
+    if not await run_search(count_matches, filters):
+        if not list_partitions():
+            return filters, "No FAISS index loaded. Please re-index or upload PDFs first."
+        return filters, "No indexed documents match the given filters."
+    return filters, None
+
+def _index_answer(raw_answer, docs):
+    """The model's answer across PDFs, or the most relevant content if the model found none."""
+    if not _not_found(raw_answer):
+        return raw_answer
+    if docs and any(d.page_content.strip() for d in docs):
+        context_snippet = docs[0].page_content.strip()[:1000]
+        return f"Here is the most relevant content from the document:\n\n{context_snippet}"
+    return "Not found in the documents."
@@ -0,0 +1,109 @@
+# /backend/services/pdf_text_cache.py
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import pypdf
+from langchain_core.documents import Document
+
+
+class PdfTextCache:
+    """
+    Persistent cache of parsed PDF pages, shared by every process that parses.
+
+    Entries are keyed by sha256(parser version + file bytes), so a PDF is
+    parsed once however it reaches us: an upload, an S3 download for a
+    re-index or a question, or a local build. Each entry is the file's pages
+    (text + metadata) as zlib-compressed JSON in SQLite. Above `max_bytes` of
+    stored data, least-recently-used entries are evicted. Hit and miss counts
+    are kept in the database too, so they include the re-index pipeline's
+    parse worker processes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.parser_id = f"pypdf-{pypdf.__version__}"
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_last_used ON pages(last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0)")
+        self._conn.commit()
+
+    def key(self, pdf_path):
+        digest = hashlib.sha256(self.parser_id.encode("utf-8") + b"\x00")
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key_for_bytes(self, data):
+        """key() of a PDF held in memory."""
+        return hashlib.sha256(self.parser_id.encode("utf-8") + b"\x00" + data).hexdigest()
+
+    def get(self, key):
+        """The cached pages for `key` as Documents without a `source`, or None."""
+        with self._lock:
+            found = self._conn.execute("SELECT data FROM pages WHERE key = ?", (key,)).fetchone()
+            if found is not None:
+                self._conn.execute("UPDATE pages SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.execute(
+                "UPDATE counters SET value = value + 1 WHERE name = ?", ("hits" if found else "misses",)
+            )
+            self._conn.commit()
+        if found is None:
+            return None
+        pages = json.loads(zlib.decompress(found[0]))
+        return [Document(page_content=page["text"], metadata=page["metadata"]) for page in pages]
+
+    def put(self, key, pages):
+        """Store parsed `pages` (Documents); their `source` path is not kept."""
+        data = zlib.compress(json.dumps([
+            {"text": page.page_content, "metadata": {k: v for k, v in page.metadata.items() if k != "source"}}
+            for page in pages
+        ]).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM pages ORDER BY last_used ASC"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        self._conn.executemany("DELETE FROM pages WHERE key = ?", doomed)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "entries": entries,
+            "mb": round(size / 2**20, 1),
+            "max_mb": round(self.max_bytes / 2**20, 1),
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -1,62 +1,64 @@
-from services.vectorstore_manager import get_faiss_index, get_docs
-from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
-from config import OPENAI_API_KEY, prompt
-
-async def contextual_recommendation(question, top_k=5):
-    index = get_faiss_index()
-    docs = get_docs()
-    if not index or not docs:
-        return {"error": "No vectorstore loaded. Please index documents first."}
-
-    retriever = index.as_retriever(search_kwargs={"k": top_k})
-
-    # 1. Get main LLM answer using RAG (same as global Q&A)
-    llm = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model="gpt-4o", temperature=0)
-    qa_chain = RetrievalQA.from_chain_type(
-        llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt},
-        return_source_documents=True,
+from services.vectorstore_manager import list_partitions
+from services.index_search import count_matches, index_version, run_search, asearch_index
+from services.answer_cache import answer_scope
+from services.answer_stream import answer_events, error_events, previews
+from services.llm_service import ask_llm
+from config import prompt, answer_cache
+
+async def contextual_recommendation(question, top_k=5, filters=None, use_cache=True):
+    error = await _index_error(filters)
+    if error:
+        return {"error": error}
+    version = await run_search(index_version, filters)
+    scope = answer_scope("contextual_recommendation", filters=filters, top_k=top_k, version=version)
+    return await answer_cache.get_or_compute(
+        scope, question, lambda: _contextual_recommendation(question, top_k, filters), use_cache
     )
-    answer_result = await qa_chain.acall({"query": question})
-    main_answer = answer_result['result'].strip()
-
-    # 2. Get similar/relevant document chunks as recommendations
-    similar_chunks = retriever.get_relevant_documents(question)
-    recommendations = []
-    for doc in similar_chunks:
-        preview = doc.page_content[:400] + ("..." if len(doc.page_content) > 400 else "")
-        rec = {
-            "content": preview,
-            "filename": doc.metadata.get("source", "Unknown"),
-            "metadata": doc.metadata
-        }
-        recommendations.append(rec)
-    return {
-            "answer": main_answer,
-            "recommendations": recommendations
-        }
 
 
-async def semantic_search(query, top_k=5):
-    index = get_faiss_index()
-    docs = get_docs()
-    if not index or not docs:
-        return []
-
-    retriever = index.as_retriever(search_kwargs={"k": top_k})
-    matched_docs = retriever.get_relevant_documents(query)
-    results = []
-    for doc in matched_docs:
-        preview = doc.page_content[:400] + ("..." if len(doc.page_content) > 400 else "")
-        result = {
-            "content": preview,
-            "filename": doc.metadata.get("source", "Unknown"),
-            "metadata": doc.metadata
+async def stream_contextual_recommendation(question, top_k=5, filters=None, use_cache=True):
+    """
+    contextual_recommendation() as Server-Sent Events (see
+    services/answer_stream.py); the "sources" event carries the recommendations.
+    """
+    error = await _index_error(filters)
+    if error:
+        return error_events(error)
+    version = await run_search(index_version, filters)
+    scope = answer_scope("contextual_recommendation", filters=filters, top_k=top_k, version=version)
+    cached, vector = await answer_cache.lookup(scope, question, use_cache)
+    if cached is not None:
+        return answer_events(question, [], prompt, None, cached=cached["answer"], sources=cached["recommendations"])
+    docs = await asearch_index(question, top_k, filters)
+    recommendations = previews(docs)
+
+    def store(answer):
+        if use_cache:
+            answer_cache.store(scope, question, {"answer": answer, "recommendations": recommendations}, vector)
+
+    return answer_events(question, docs, prompt, lambda raw_answer, _: raw_answer, sources=recommendations, store=store)
+
+
+async def _index_error(filters):
+    if not await run_search(count_matches, filters):
+        if not list_partitions():
+            return "No vectorstore loaded. Please index documents first."
+        return "No indexed documents match the given filters."
+    return None
+
+
+async def _contextual_recommendation(question, top_k, filters):
+    # 1. Get similar/relevant document chunks; they are both the context and the recommendations
+    similar_chunks = await asearch_index(question, top_k, filters)
+
+    # 2. Get main LLM answer using RAG (same as global Q&A)
+    main_answer = await ask_llm(question, similar_chunks, prompt)
+    return {
+            "answer": main_answer,
+            "recommendations": previews(similar_chunks)
         }
-        results.append(result)
-    return results
 
 
+async def semantic_search(query, top_k=5, filters=None):
+    # Embedded with the async client, searched on the index search executor.
+    return previews(await asearch_index(query, top_k, filters))
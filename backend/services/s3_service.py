@@ -1,20 +1,17 @@
 # /backend/services/s3_service.py
 
 import os
+import time
 import boto3
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 import re
 import logging
 
-from status import (
-    update_indexing_status,
-    reset_indexing_status,
-    set_indexing_current_file,
-    set_indexing_error,
-    finish_indexing,
-)
-
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -25,13 +22,139 @@ AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-s3_client = boto3.client(
-    "s3",
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL") or None  # e.g. a local moto server or MinIO
+
+# Top-level category folders of the bucket, searched and synced by default.
+S3_FOLDERS = [
+    "Document_Management_System_(DMS)_Integration",
+    "Maintenance_Notification_Documents",
+    "Maintenance_Planning_Documents",
+    "Procurement_and_Material_Management",
+    "Reporting_and_Historical_Documents",
+    "Work_Order_Documents",
+]
+
+# Client tuning. The connection pool has to cover every thread that talks to S3
+# at once (sync/index download workers x S3_TRANSFER_CONCURRENCY for multipart
+# transfers), or urllib3 warns "Connection pool is full" and throws connections
+# away. "adaptive" retries back off exponentially with jitter and rate-limit
+# the client when S3 throttles.
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "64"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
+# Objects above the threshold are transferred as parallel parts / ranged GETs.
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16"))
+S3_MULTIPART_CHUNK_MB = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8"))
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "8"))
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD_MB * 2**20,
+    multipart_chunksize=S3_MULTIPART_CHUNK_MB * 2**20,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
 )
 
+
+class S3Metrics:
+    """
+    Per-operation counters of the S3 calls made through this module: calls,
+    errors, bytes transferred and latency (including retries), plus the number
+    of retries botocore made.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+        self.retries = 0
+
+    def _entry(self, operation):
+        return self._operations.setdefault(
+            operation, {"calls": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0}
+        )
+
+    def record(self, operation, seconds, error=False):
+        with self._lock:
+            entry = self._entry(operation)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def add_bytes(self, operation, count):
+        with self._lock:
+            self._entry(operation)["bytes"] += count
+
+    @contextmanager
+    def track(self, operation):
+        """
+        Time one `operation`. Yields a progress callback (boto3's transfer
+        `Callback`) that counts the bytes transferred.
+        """
+        start = time.perf_counter()
+        error = True
+        try:
+            yield lambda count: self.add_bytes(operation, count)
+            error = False
+        finally:
+            self.record(operation, time.perf_counter() - start, error)
+
+    def count_retries(self, parsed=None, **kwargs):
+        """botocore "after-call" handler."""
+        attempts = ((parsed or {}).get("ResponseMetadata") or {}).get("RetryAttempts", 0)
+        if attempts:
+            with self._lock:
+                self.retries += attempts
+
+    def stats(self):
+        with self._lock:
+            operations = {}
+            for operation, entry in self._operations.items():
+                calls = entry["calls"]
+                operations[operation] = {
+                    "calls": calls,
+                    "errors": entry["errors"],
+                    "bytes": entry["bytes"],
+                    "avg_ms": round(1000 * entry["seconds"] / calls, 2) if calls else 0.0,
+                    "max_ms": round(1000 * entry["max_seconds"], 2),
+                    "mb_per_s": round(entry["bytes"] / 2**20 / entry["seconds"], 2) if entry["seconds"] else 0.0,
+                }
+            return {
+                "max_pool_connections": S3_MAX_POOL_CONNECTIONS,
+                "retry_mode": S3_RETRY_MODE,
+                "max_attempts": S3_MAX_ATTEMPTS,
+                "retries": self.retries,
+                "operations": operations,
+            }
+
+s3_metrics = S3Metrics()
+
+def make_s3_client(**config):
+    """
+    An S3 client with the pool, retry and timeout settings above; keyword
+    arguments override botocore Config options. Its retries are counted in
+    s3_metrics.
+    """
+    options = {
+        "max_pool_connections": S3_MAX_POOL_CONNECTIONS,
+        "retries": {"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+        "connect_timeout": S3_CONNECT_TIMEOUT,
+        "read_timeout": S3_READ_TIMEOUT,
+    }
+    options.update(config)
+    client = boto3.client(
+        "s3",
+        region_name=AWS_REGION,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=AWS_S3_ENDPOINT_URL,
+        config=Config(**options),
+    )
+    client.meta.events.register("after-call.s3", s3_metrics.count_retries)
+    return client
+
+s3_client = make_s3_client()
+
 def sanitize_s3_name(name):
     safe = re.sub(r"[^A-Za-z0-9_\-(). ]", "", name)
     safe = re.sub(r"\s+", " ", safe)
@@ -40,19 +163,53 @@ def sanitize_s3_name(name):
 
 sanitize_s3_folder_name = sanitize_s3_name
 
+def make_s3_key(filename, folder=None):
+    """The object key used for `filename` in (sanitized) `folder`."""
+    sanitized_filename = sanitize_s3_name(filename)
+    sanitized_folder = sanitize_s3_name(folder) if folder else ""
+    return f"{sanitized_folder}/{sanitized_filename}" if sanitized_folder else sanitized_filename
+
+def iter_pdf_objects(bucket=AWS_S3_BUCKET, prefix=""):
+    """
+    Every PDF object under (sanitized) folder `prefix`, across all listing
+    pages, as a dict with its full key, filename, ETag and size. S3 errors
+    are raised.
+    """
+    sanitized_prefix = sanitize_s3_name(prefix) + "/" if prefix else ""
+    pages = iter(s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=sanitized_prefix))
+    while True:
+        start = time.perf_counter()
+        try:
+            page = next(pages, None)
+        except Exception:
+            s3_metrics.record("list", time.perf_counter() - start, error=True)
+            raise
+        if page is None:
+            return
+        s3_metrics.record("list", time.perf_counter() - start)
+        for item in page.get("Contents", []):
+            if item["Key"].lower().endswith(".pdf"):
+                yield {
+                    "key": item["Key"],
+                    "filename": os.path.basename(item["Key"]),
+                    "etag": item.get("ETag", "").strip('"'),
+                    "size": item.get("Size", 0),
+                }
+
 def list_pdfs_in_s3(bucket=AWS_S3_BUCKET, prefix=""):
+    return [obj["filename"] for obj in list_pdf_objects_in_s3(bucket=bucket, prefix=prefix)]
+
+def list_pdf_objects_in_s3(bucket=AWS_S3_BUCKET, prefix=""):
+    """
+    Like list_pdfs_in_s3, but returns one dict per PDF with its full key,
+    filename, ETag and size so callers can detect changed objects.
+    """
     if not bucket:
         logger.error("AWS_S3_BUCKET is not set! Cannot list PDFs.")
         return []
     try:
-        sanitized_prefix = sanitize_s3_name(prefix) + "/" if prefix else ""
-        logger.info(f"[S3 LIST] Listing PDFs under prefix: {sanitized_prefix}")
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=sanitized_prefix)
-        return [
-            os.path.basename(item["Key"])
-            for item in response.get("Contents", [])
-            if item["Key"].lower().endswith(".pdf")
-        ]
+        logger.info(f"[S3 LIST] Listing PDF objects under prefix: {prefix}")
+        return list(iter_pdf_objects(bucket=bucket, prefix=prefix))
     except (BotoCoreError, ClientError) as e:
         logger.error("S3 list failed: %s", e)
         return []
@@ -65,13 +222,10 @@ def list_pdfs_in_s3_folder(folder, bucket=AWS_S3_BUCKET):
 
 def download_file_from_s3(filename, local_path, folder=None, bucket=AWS_S3_BUCKET):
     try:
-        sanitized_filename = sanitize_s3_name(filename)
-        sanitized_folder = sanitize_s3_name(folder) if folder else ""
-        s3_key = f"{sanitized_folder}/{sanitized_filename}" if sanitized_folder else sanitized_filename
+        s3_key = make_s3_key(filename, folder)
 
         logger.info(f"[S3 DOWNLOAD] Downloading from: {bucket}/{s3_key}")
-        with open(local_path, "wb") as f:
-            s3_client.download_fileobj(bucket, s3_key, f)
+        download_s3_object(s3_key, local_path, bucket=bucket)
         return True
     except (BotoCoreError, ClientError) as e:
         logger.error("S3 download failed: %s", e)
@@ -80,18 +234,69 @@ def download_file_from_s3(filename, local_path, folder=None, bucket=AWS_S3_BUCKE
         logger.error("Unexpected S3 download error: %s", e)
         return False
 
+def download_s3_object(s3_key, local_path, bucket=AWS_S3_BUCKET):
+    """
+    Download object `s3_key` to `local_path` (large objects as parallel ranged
+    GETs). The file is written under a temporary name and only replaces
+    `local_path` once complete. S3 errors are raised.
+    """
+    with s3_metrics.track("download") as progress:
+        s3_client.download_file(bucket, s3_key, local_path, Config=TRANSFER_CONFIG, Callback=progress)
+
+def get_s3_etag(filename, folder=None, bucket=AWS_S3_BUCKET):
+    """ETag of an object (one HEAD request, no download), or None if it can't be read."""
+    try:
+        s3_key = make_s3_key(filename, folder)
+        with s3_metrics.track("head"):
+            response = s3_client.head_object(Bucket=bucket, Key=s3_key)
+        return response.get("ETag", "").strip('"')
+    except (BotoCoreError, ClientError) as e:
+        logger.error("S3 head failed: %s", e)
+        return None
+    except Exception as e:
+        logger.error("Unexpected S3 head error: %s", e)
+        return None
+
+def s3_object_exists(filename, folder=None, bucket=AWS_S3_BUCKET):
+    """True/False if the object does/doesn't exist, None if that can't be told."""
+    try:
+        with s3_metrics.track("head"):
+            s3_client.head_object(Bucket=bucket, Key=make_s3_key(filename, folder))
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        logger.error("S3 head failed: %s", e)
+        return None
+    except Exception as e:
+        logger.error("Unexpected S3 head error: %s", e)
+        return None
+
+def delete_s3_object(filename, folder=None, bucket=AWS_S3_BUCKET):
+    try:
+        s3_key = make_s3_key(filename, folder)
+        logger.info(f"[S3 DELETE] Deleting: {bucket}/{s3_key}")
+        with s3_metrics.track("delete"):
+            s3_client.delete_object(Bucket=bucket, Key=s3_key)
+        return True
+    except (BotoCoreError, ClientError) as e:
+        logger.error("S3 delete failed: %s", e)
+        return False
+    except Exception as e:
+        logger.error("Unexpected S3 delete error: %s", e)
+        return False
+
 def download_file_from_s3_folder(s3_key, local_path, bucket=AWS_S3_BUCKET):
     folder, filename = os.path.split(s3_key)
     return download_file_from_s3(filename, local_path, folder=folder, bucket=bucket)
 
 def upload_pdf_to_s3(fileobj, filename, folder=None, bucket=AWS_S3_BUCKET):
     try:
-        sanitized_filename = sanitize_s3_name(filename)
-        sanitized_folder = sanitize_s3_name(folder) if folder else ""
-        s3_key = f"{sanitized_folder}/{sanitized_filename}" if sanitized_folder else sanitized_filename
+        s3_key = make_s3_key(filename, folder)
 
         logger.info(f"[S3 UPLOAD] Uploading to: {bucket}/{s3_key}")
-        s3_client.upload_fileobj(fileobj, bucket, s3_key)
+        with s3_metrics.track("upload") as progress:
+            s3_client.upload_fileobj(fileobj, bucket, s3_key, Config=TRANSFER_CONFIG, Callback=progress)
         s3_url = f"https://{bucket}.s3.amazonaws.com/{s3_key}"
         return s3_url
     except (BotoCoreError, ClientError) as e:
@@ -101,55 +306,31 @@ def upload_pdf_to_s3(fileobj, filename, folder=None, bucket=AWS_S3_BUCKET):
         logger.error("Unexpected S3 upload error: %s", e)
         return None
 
-async def download_all_pdfs_from_s3(local_dir):
+async def download_all_pdfs_from_s3(local_dir, refresh=False):
     """
-    Download all PDFs from all S3 folders to a local directory.
-    This function is async-safe: it uses asyncio.to_thread for blocking S3 operations.
-    Also updates indexing status.
+    Mirror the PDFs of all S3 folders into a local directory (see
+    services/s3_sync.py). This function is async-safe: the sync runs in a
+    worker thread. Also updates indexing status.
     """
     import asyncio
-    os.makedirs(local_dir, exist_ok=True)
-    folders = [
-        "Document_Management_System_(DMS)_Integration",
-        "Maintenance_Notification_Documents",
-        "Maintenance_Planning_Documents",
-        "Procurement_and_Material_Management",
-        "Reporting_and_Historical_Documents",
-        "Work_Order_Documents",
-    ]
-
-    reset_indexing_status()
-    total_files = 0
-    for folder in folders:
-        pdfs = list_pdfs_in_s3_folder(folder)
-        total_files += len(pdfs)
-    update_indexing_status(total=total_files, current=0, running=True)
-    current_counter = 0
-
-    for folder in folders:
-        pdfs = list_pdfs_in_s3_folder(folder)
-        for pdf in pdfs:
-            local_path = os.path.join(local_dir, pdf)
-            set_indexing_current_file(f"{folder}/{pdf}")
-            if not os.path.exists(local_path):
-                logger.info(f"[S3 → LOCAL] Downloading {folder}/{pdf} to {local_path}")
-                try:
-                    await asyncio.to_thread(download_file_from_s3, pdf, local_path, folder=folder)
-                    current_counter += 1
-                    update_indexing_status(current=current_counter)
-                except Exception as e:
-                    logger.error(f"Failed to download {folder}/{pdf}: {e}")
-                    set_indexing_error(str(e))
-            else:
-                logger.info(f"[S3 → LOCAL] Exists: {local_path}, skipping.")
-    finish_indexing()
+    from services.s3_sync import sync_pdfs_from_s3
+    return await asyncio.to_thread(sync_pdfs_from_s3, local_dir, refresh=refresh)
 
 __all__ = [
+    "S3_FOLDERS",
     "upload_pdf_to_s3",
     "download_file_from_s3",
+    "download_s3_object",
+    "s3_object_exists",
+    "delete_s3_object",
     "list_pdfs_in_s3",
+    "list_pdf_objects_in_s3",
+    "iter_pdf_objects",
     "list_pdfs_in_s3_folder",
     "download_file_from_s3_folder",
     "sanitize_s3_folder_name",
-    "download_all_pdfs_from_s3"
+    "make_s3_key",
+    "download_all_pdfs_from_s3",
+    "make_s3_client",
+    "s3_metrics",
 ]
@@ -0,0 +1,184 @@
+# /backend/services/s3_sync.py
+
+import os
+import json
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.exceptions import BotoCoreError, ClientError
+
+from services.s3_service import AWS_S3_BUCKET, S3_FOLDERS, download_s3_object, iter_pdf_objects, logger
+from status import (
+    new_indexing_status,
+    start_indexing,
+    update_indexing_status,
+    set_indexing_current_file,
+    set_indexing_error,
+    finish_indexing,
+)
+
+# Mirrors S3 PDFs into a local directory as <local_dir>/<folder>/<filename>.
+# PDFs left directly in <local_dir> by the flat <local_dir>/<filename> layout
+# used before are moved into place if they match an object, else deleted.
+# What was listed and downloaded is kept in <local_dir>/.s3_sync.json, so an
+# object is only downloaded again when its ETag changes, and a listing younger
+# than S3_SYNC_LISTING_TTL_SECONDS is reused instead of listing the bucket again
+# (e.g. when several workers start at once). Downloads run S3_SYNC_WORKERS at a
+# time; large objects are fetched as parallel ranged GETs (see s3_service).
+S3_SYNC_WORKERS = int(os.getenv("S3_SYNC_WORKERS", "8"))
+S3_SYNC_LISTING_TTL_SECONDS = int(os.getenv("S3_SYNC_LISTING_TTL_SECONDS", "300"))
+
+SYNC_FOLDERS = S3_FOLDERS
+MANIFEST_NAME = ".s3_sync.json"
+
+_SYNC_LOCK = threading.Lock()
+
+
+def _manifest_path(local_dir):
+    return os.path.join(local_dir, MANIFEST_NAME)
+
+def _load_manifest(local_dir):
+    try:
+        with open(_manifest_path(local_dir)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_manifest(local_dir, manifest):
+    path = _manifest_path(local_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def _list_objects(bucket, folders):
+    """All PDF objects under `folders`, one paginated listing per folder. Raises on S3 errors."""
+    objects = {}
+    for folder in folders:
+        for obj in iter_pdf_objects(bucket=bucket, prefix=folder):
+            objects[obj["key"]] = {"etag": obj["etag"], "size": obj["size"]}
+    return objects
+
+def _local_path(local_dir, key):
+    path = os.path.normpath(os.path.join(local_dir, key))
+    if not path.startswith(os.path.normpath(local_dir) + os.sep):
+        raise ValueError(f"S3 key {key!r} escapes the sync directory")
+    return path
+
+def _matches_etag(path, obj):
+    """True if the file at `path` has the content of `obj`, judged by its MD5 ETag (single-part uploads only)."""
+    if "-" in obj["etag"] or os.path.getsize(path) != obj["size"]:
+        return False
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            md5.update(block)
+    return md5.hexdigest() == obj["etag"]
+
+def _adopt_flat_copies(local_dir, objects, synced):
+    """
+    Move PDFs of the old flat layout into <folder>/<filename> when their
+    content matches a listed object without a local copy yet, recording them
+    as synced, and delete the others.
+    """
+    flat = [name for name in os.listdir(local_dir)
+            if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(local_dir, name))]
+    adopted = 0
+    for name in flat:
+        path = os.path.join(local_dir, name)
+        for key, obj in objects.items():
+            target = _local_path(local_dir, key)
+            if os.path.basename(key) == name and not os.path.exists(target) and _matches_etag(path, obj):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+                synced[key] = obj["etag"]
+                adopted += 1
+                break
+        else:
+            os.remove(path)
+    if flat:
+        print(f"[S3 SYNC] Moved {adopted} flat-layout PDFs into their folders, deleted {len(flat) - adopted}.")
+
+def _download(bucket, key, local_path):
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    download_s3_object(key, local_path, bucket=bucket)
+
+def sync_pdfs_from_s3(local_dir, folders=SYNC_FOLDERS, bucket=AWS_S3_BUCKET, workers=S3_SYNC_WORKERS, refresh=False, status=None):
+    """
+    Bring `local_dir` up to date with the PDFs under `folders`: download new
+    and changed objects, and delete local copies of objects removed from S3.
+    `refresh` forces a new listing even if the cached one is fresh. Reports
+    progress on `status` (a new status dict if None); returns {"listed",
+    "downloaded", "skipped", "removed", "failed"}.
+    """
+    status = new_indexing_status() if status is None else status
+    with _SYNC_LOCK:
+        os.makedirs(local_dir, exist_ok=True)
+        manifest = _load_manifest(local_dir)
+        synced = manifest.get("synced", {}) if manifest.get("bucket") == bucket else {}
+        listing_fresh = (
+            not refresh
+            and manifest.get("bucket") == bucket
+            and manifest.get("folders") == list(folders)
+            and time.time() - manifest.get("listed_at", 0) < S3_SYNC_LISTING_TTL_SECONDS
+        )
+        start_indexing(status, 0)
+        if listing_fresh:
+            objects = manifest["objects"]
+            print(f"[S3 SYNC] Reusing listing of {len(objects)} PDFs from {manifest['listed_at']:.0f}.")
+        else:
+            try:
+                objects = _list_objects(bucket, folders)
+            except (BotoCoreError, ClientError) as e:
+                # Never read a failed listing as "everything was deleted".
+                logger.error("S3 sync listing failed: %s", e)
+                set_indexing_error(status, f"S3 listing failed: {e}")
+                finish_indexing(status)
+                return {"listed": 0, "downloaded": 0, "skipped": 0, "removed": 0, "failed": 0}
+            manifest.update(bucket=bucket, folders=list(folders), listed_at=time.time(), objects=objects)
+        _adopt_flat_copies(local_dir, objects, synced)
+
+        def up_to_date(key, obj):
+            path = _local_path(local_dir, key)
+            return synced.get(key) == obj["etag"] and os.path.exists(path) and os.path.getsize(path) == obj["size"]
+
+        todo = [key for key, obj in objects.items() if not up_to_date(key, obj)]
+        removed = [key for key in synced if key not in objects]
+        for key in removed:
+            try:
+                os.remove(_local_path(local_dir, key))
+            except FileNotFoundError:
+                pass
+            del synced[key]
+
+        update_indexing_status(status, total=len(todo))
+        downloaded = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(_download, bucket, key, _local_path(local_dir, key)): key for key in todo}
+            for future in as_completed(futures):
+                key = futures[future]
+                set_indexing_current_file(status, key)
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Failed to download {key}: {e}")
+                    set_indexing_error(status, f"{key}: {e}")
+                    continue
+                downloaded += 1
+                synced[key] = objects[key]["etag"]
+                update_indexing_status(status, current=downloaded)
+
+        manifest["synced"] = synced
+        _save_manifest(local_dir, manifest)
+        finish_indexing(status)
+        result = {
+            "listed": len(objects),
+            "downloaded": downloaded,
+            "skipped": len(objects) - len(todo),
+            "removed": len(removed),
+            "failed": failed,
+        }
+        print(f"[S3 SYNC] {result}")
+        return result
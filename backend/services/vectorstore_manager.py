@@ -1,67 +1,1037 @@
 # backend/services/vectorstore_manager.py
 
 import os
-import pickle
+import json
+import time
+import shutil
+import sqlite3
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
-from config import VECTORSTORE_PATH, embedding_model
+from config import (
+    VECTORSTORE_DIR,
+    VECTORSTORE_PATH,
+    INDEX_MEMORY_BUDGET_MB,
+    INDEX_LOAD_MODE,
+    INDEX_WAL_MAX_MB,
+    INDEX_WAL_MAX_AGE_SECONDS,
+    INDEX_COMPACT_INTERVAL_SECONDS,
+    INDEX_TYPE,
+    INDEX_ANN_MIN_VECTORS,
+    INDEX_NLIST,
+    INDEX_PQ_M,
+    INDEX_HNSW_M,
+    INDEX_NPROBE,
+    INDEX_EF_SEARCH,
+    embedding_model,
+)
+from services.s3_service import sanitize_s3_folder_name
+from services.index_builder import (
+    INDEX_TYPES,
+    docs_in_index_order,
+    index_type_of,
+    index_code_bytes,
+    min_training_vectors,
+    set_search_params,
+    convert_store,
+    delete_from_store,
+    write_index_version,
+)
+from services.metadata_index import MetadataIndex, filtered_search_by_vectors
+from services.chunk_store import ChunkStore, ChunkDocstore, RowMap, remove_chunk_store
+from services.index_log import read_records, first_timestamp, append_record, copy_tail, locked
 
-# Singleton variables
-_VECTORSTORE = None
-_DOCS = None
+# On-disk layout: one copy-on-write index per S3 category folder.
+#   vectorstore/partitions/<category>/CURRENT      -> name of the published version
+#   vectorstore/partitions/<category>/chunks/<generation>.sqlite  -> append-only chunk text + metadata
+#   vectorstore/partitions/<category>/versions/<version>/faiss_index/index.faiss
+#   vectorstore/partitions/<category>/versions/<version>/rows.npy      -> FAISS position -> chunk row
+#   vectorstore/partitions/<category>/versions/<version>/metadata_*    -> MetadataIndex
+#   vectorstore/partitions/<category>/versions/<version>/version.json  -> {"chunks": <generation>}
+#   vectorstore/partitions/<category>/versions/<version>/wal.log       -> changes since (index_log)
+# Chunk text is written once: incremental updates append their new chunks to the
+# chunk store of the version they started from, and only a full rebuild starts a
+# new generation. An update then appends the rows it deletes and the rows and
+# vectors it adds to the current version's log, which every snapshot of that
+# version replays as a small exact index next to the published one. The
+# compactor (and full rebuilds) write a complete new version directory, then
+# publish it by atomically replacing the partition's CURRENT and swapping its
+# in-memory snapshot. Snapshots are never mutated (replaying the log makes a new
+# one), so readers need no locks and keep the snapshot they started with.
+# Log appends and CURRENT replacements happen under the partition's LOCK file, so
+# a record is never appended to a version that has just been compacted away.
+# Partitions are loaded on first use. When the loaded partitions exceed
+# INDEX_MEMORY_BUDGET_MB, the least recently used ones that no query is reading
+# are dropped from memory (their files stay on disk).
+# Several processes (uvicorn workers) can serve the same directory: each one
+# notices new partitions and republished versions on its next query, and
+# version directories newer than CURRENT are never garbage-collected, since
+# another process may still be writing them.
+# A pre-partitioning index (vectorstore/faiss_index + docs.pkl) is split into
+# partitions, and versions written before chunk stores are converted, by
+# load_faiss_index().
+PARTITIONS_DIR = os.path.join(VECTORSTORE_DIR, "partitions")
+# Chunks with neither a category nor a folder in their S3 key (legacy uploads).
+UNCATEGORIZED = "_uncategorized"
+if INDEX_TYPE not in INDEX_TYPES:
+    raise ValueError(f"INDEX_TYPE must be one of {', '.join(INDEX_TYPES)}, not {INDEX_TYPE!r}")
+if INDEX_LOAD_MODE not in ("memory", "mmap"):
+    raise ValueError(f"INDEX_LOAD_MODE must be 'memory' or 'mmap', not {INDEX_LOAD_MODE!r}")
 
-def load_faiss_index():
+
+class PublishConflict(Exception):
+    """Raised when the version a compaction started from was replaced before it could publish."""
+
+
+class LogDelta:
+    """
+    Changes logged against a published version, as replayed up to `offset`:
+    chunks added since (searched through an exact index of their own) and
+    rows of the version deleted since, which searches of the version skip.
+    """
+
+    def __init__(self, dim):
+        self.offset = 0
+        # When the oldest replayed record was written.
+        self.first_time = None
+        self.rows = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.deleted = np.empty(0, dtype=np.int64)
+        # `deleted` as the version's (sorted) FAISS positions.
+        self.excluded = np.empty(0, dtype=np.int64)
+        self.vectorstore = None
+        self.metadata_index = None
+
+    @property
+    def nbytes(self):
+        indexed = self.metadata_index.nbytes if self.metadata_index is not None else 0
+        return 2 * self.vectors.nbytes + self.deleted.nbytes + self.excluded.nbytes + indexed
+
+
+class IndexSnapshot:
     """
-    Loads (or reloads) the FAISS index and docs metadata into memory.
-    """
-    print("Using vectorstore_manager.py version 1.0")
-    global _VECTORSTORE, _DOCS
-    index_path = VECTORSTORE_PATH
-    docs_path = os.path.join(os.path.dirname(index_path), "docs.pkl")
-    if os.path.exists(index_path) and os.path.exists(docs_path):
-        print(f"[FAISS MANAGER] Loading FAISS index from {index_path}")
-        with open(docs_path, "rb") as f:
-            _DOCS = pickle.load(f)
-        _VECTORSTORE = FAISS.load_local(
-            index_path,
-            embedding_model,
-            allow_dangerous_deserialization=True,
+    An immutable, published version of one partition and the changes logged
+    against it so far, plus its reader count and the metadata indexes used
+    for filtered search.
+    """
+
+    def __init__(self, partition, version, vectorstore, path, metadata_index, mapped=False, log=None):
+        self.partition = partition
+        self.version = version
+        self.vectorstore = vectorstore
+        self.path = path
+        self.mapped = mapped
+        self.readers = 0
+        self.metadata_index = metadata_index
+        self.log = log or LogDelta(vectorstore.index.d)
+        self.size = vectorstore.index.ntotal - len(self.log.excluded) + len(self.log.rows)
+        # Documents stay in the chunk store either way. Mapped snapshots count
+        # the files they map; the pages themselves are shared with every other
+        # process mapping the same version.
+        if mapped:
+            self.nbytes = _mapped_bytes(path) + self.log.nbytes
+        else:
+            self.nbytes = (vectorstore.index.ntotal * index_code_bytes(vectorstore.index)
+                           + metadata_index.nbytes + self.log.nbytes)
+
+    def count(self, filters=None):
+        """Number of chunks matching `filters` (all chunks if None)."""
+        positions = self.metadata_index.select(filters)
+        if positions is None:
+            return self.size
+        total = len(np.setdiff1d(positions, self.log.excluded, assume_unique=True))
+        if self.log.metadata_index is not None:
+            total += len(self.log.metadata_index.select(filters))
+        return total
+
+    def search(self, vector, k, filters=None):
+        """
+        Top-k (Document, distance) pairs for an embedded query among the chunks
+        matching `filters`: the version's own, less those deleted since, and
+        those added since.
+        """
+        return self.search_batch(vector, k, filters)[0]
+
+    def search_batch(self, vectors, k, filters=None):
+        """search() for each row of `vectors`, with one FAISS search per index."""
+        positions = self.metadata_index.select(filters)
+        hits = filtered_search_by_vectors(self.vectorstore, vectors, k, positions, self.log.excluded)
+        if self.log.vectorstore is not None:
+            logged = filtered_search_by_vectors(self.log.vectorstore, vectors, k, self.log.metadata_index.select(filters))
+            hits = [own + added for own, added in zip(hits, logged)]
+        return hits
+
+
+class IndexPartition:
+    """One category's index versions on disk, and its snapshot if loaded."""
+
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(PARTITIONS_DIR, name)
+        self.versions_dir = os.path.join(self.path, "versions")
+        self.pointer = os.path.join(self.path, "CURRENT")
+        # Held while appending to a log or replacing CURRENT, and while compacting.
+        self.lock_file = os.path.join(self.path, "LOCK")
+        self.compact_lock_file = os.path.join(self.path, "COMPACTING")
+        # (inode, mtime) of CURRENT when last checked, to notice publishes by other processes.
+        self.pointer_stat = None
+        self.snapshot = None
+        # Replaced snapshots still pinned by readers, and versions being written.
+        self.retired = []
+        self.in_progress = set()
+        self.load_lock = threading.Lock()
+
+
+# Guards partitions, snapshots, reader counts and the LRU; never held while
+# searching or loading from disk.
+_LOCK = threading.Lock()
+_PARTITIONS = {}
+# Names of partitions with a loaded snapshot, least recently used first.
+_LRU = OrderedDict()
+# mtime of PARTITIONS_DIR when it was last scanned for partitions.
+_PARTITIONS_DIR_MTIME = None
+# Set to run the compactor before its next scheduled check.
+_COMPACT_WAKE = threading.Event()
+_COMPACTOR = None
+# Files of a version that a mapped snapshot reads.
+_MAPPED_FILES = ("faiss_index/index.faiss", "rows.npy", "metadata_postings.npy", "metadata_dates.npy")
+
+
+def _mapped_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in _MAPPED_FILES)
+
+def _mmap_flags(index_file):
+    """
+    faiss.read_index flags that map `index_file` read-only. Flat codes (flat
+    and HNSW indexes) are mapped in place; IVF inverted lists are opened as
+    on-disk lists. The two modes cannot be combined, so the index type is
+    read from the file's fourcc.
+    """
+    with open(index_file, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_SKIP_PRECOMPUTE_TABLE
+    return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+def build_partition_index(vectorstore):
+    """
+    Index factory for partitions. A flat store with at least
+    INDEX_ANN_MIN_VECTORS vectors is rebuilt as INDEX_TYPE (IVF types are
+    trained on the partition's own vectors); smaller partitions stay exact.
+    Partitions already of another type are kept as they are until the next
+    full re-index. Search parameters are applied either way.
+    """
+    min_vectors = max(INDEX_ANN_MIN_VECTORS, min_training_vectors(INDEX_TYPE))
+    if (INDEX_TYPE != "flat" and index_type_of(vectorstore.index) == "flat"
+            and vectorstore.index.ntotal >= min_vectors):
+        started = time.time()
+        vectorstore = convert_store(
+            vectorstore, INDEX_TYPE, nlist=INDEX_NLIST, pq_m=INDEX_PQ_M, hnsw_m=INDEX_HNSW_M,
         )
-        print("[FAISS MANAGER] FAISS index loaded and ready.")
+        print(f"[FAISS MANAGER] Built {INDEX_TYPE} index over {vectorstore.index.ntotal} vectors "
+              f"in {time.time() - started:.1f}s.")
+    set_search_params(vectorstore.index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH)
+    return vectorstore
+
+def _new_version_name():
+    return f"v{time.time_ns()}"
+
+def _version_time(version):
+    try:
+        return int(version.lstrip("v"))
+    except ValueError:
+        return 0
+
+def _chunk_store_path(partition, generation):
+    return os.path.join(partition.path, "chunks", f"{generation}.sqlite")
+
+def _generation(path):
+    """Chunk store generation of the version directory `path`."""
+    with open(os.path.join(path, "version.json")) as f:
+        return json.load(f)["chunks"]
+
+def _log_path(path):
+    return os.path.join(path, "wal.log")
+
+
+def _read_pointer(partition):
+    try:
+        with open(partition.pointer) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_pointer(partition, version):
+    tmp_path = partition.pointer + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, partition.pointer)
+
+def partition_name(category):
+    """Partition that holds documents uploaded under `category`."""
+    return sanitize_s3_folder_name(category) if category else UNCATEGORIZED
+
+def partition_for_key(s3_key):
+    folder = os.path.dirname(s3_key)
+    return folder or UNCATEGORIZED
+
+def partition_for_doc(doc):
+    metadata = doc.metadata or {}
+    if metadata.get("category"):
+        return metadata["category"]
+    if metadata.get("s3_key"):
+        return partition_for_key(metadata["s3_key"])
+    return UNCATEGORIZED
+
+def group_by_partition(docs, ids, vectors):
+    """Split an embedded batch into {partition: (docs, ids, vectors)}."""
+    groups = {}
+    for doc, vector_id, vector in zip(docs, ids, vectors):
+        group = groups.setdefault(partition_for_doc(doc), ([], [], []))
+        group[0].append(doc)
+        group[1].append(vector_id)
+        group[2].append(vector)
+    return groups
+
+def _get_partition(name):
+    with _LOCK:
+        return _PARTITIONS.get(name)
+
+def _discover():
+    """
+    Pick up partitions published or dropped by other processes since
+    PARTITIONS_DIR was last scanned.
+    """
+    global _PARTITIONS_DIR_MTIME
+    try:
+        mtime = os.stat(PARTITIONS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if mtime == _PARTITIONS_DIR_MTIME:
+        return
+    names = {
+        name for name in os.listdir(PARTITIONS_DIR)
+        if os.path.exists(os.path.join(PARTITIONS_DIR, name, "CURRENT"))
+    }
+    with _LOCK:
+        _PARTITIONS_DIR_MTIME = mtime
+        for name in names - set(_PARTITIONS):
+            _PARTITIONS[name] = IndexPartition(name)
+        for name in set(_PARTITIONS) - names:
+            partition = _PARTITIONS[name]
+            if partition.in_progress or os.path.exists(partition.pointer):
+                continue
+            del _PARTITIONS[name]
+            _LRU.pop(name, None)
+            if partition.snapshot is not None:
+                partition.retired.append(partition.snapshot)
+                partition.snapshot = None
+
+def list_partitions():
+    """Names of the partitions that have a published index."""
+    _discover()
+    with _LOCK:
+        return sorted(_PARTITIONS)
+
+def partition_states(names):
+    """
+    {name: "<version>+<logged bytes>"} for partitions `names`, read from disk
+    without loading them. A partition's state changes with every update
+    logged or version published, by any process.
+    """
+    states = {}
+    for name in names:
+        partition = _get_partition(name)
+        version = _read_pointer(partition) if partition is not None else None
+        if version is None:
+            continue
+        try:
+            logged = os.path.getsize(_log_path(os.path.join(partition.versions_dir, version)))
+        except OSError:
+            logged = 0
+        states[name] = f"{version}+{logged}"
+    return states
+
+def load_faiss_index():
+    """
+    Discover the published partitions on disk and start the log compactor.
+    Partitions are loaded lazily on first query, replaying their logs; a
+    legacy single index is split into partitions first. Returns True if
+    there is anything to query.
+    """
+    global _PARTITIONS_DIR_MTIME
+    print(f"Using vectorstore_manager.py version 3.3 (load mode: {INDEX_LOAD_MODE})")
+    with _LOCK:
+        _PARTITIONS.clear()
+        _LRU.clear()
+        _PARTITIONS_DIR_MTIME = None
+    names = list_partitions()
+    if not names and os.path.exists(VECTORSTORE_PATH):
+        _split_legacy_index()
+    for name in names:
+        partition = _get_partition(name)
+        if partition is not None:
+            _upgrade_legacy_version(partition)
+            _gc_versions(partition)
+    start_compactor()
+    partitions = list_partitions()
+    if partitions:
+        print(f"[FAISS MANAGER] {len(partitions)} index partitions available: {', '.join(partitions)}")
         return True
+    print("[FAISS MANAGER] No FAISS index found on disk.")
+    return False
+
+def _split_legacy_index():
+    print(f"[FAISS MANAGER] Splitting legacy index {VECTORSTORE_PATH} into partitions...")
+    vectorstore = FAISS.load_local(VECTORSTORE_PATH, embedding_model, allow_dangerous_deserialization=True)
+    docs = docs_in_index_order(vectorstore)
+    ids = [doc_id for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())]
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    stores = {}
+    for name, (group_docs, group_ids, group_vectors) in group_by_partition(docs, ids, vectors).items():
+        stores[name] = _build_store(group_docs, group_ids, group_vectors)
+    replace_index(stores)
+    print(f"[FAISS MANAGER] Legacy index split into {len(stores)} partitions; {VECTORSTORE_PATH} can be removed.")
+
+def _upgrade_legacy_version(partition):
+    """Republish a version written before chunk stores (LangChain pickle + docs.pkl) in the current format."""
+    version = _read_pointer(partition)
+    path = os.path.join(partition.versions_dir, version or "")
+    if not version or os.path.exists(os.path.join(path, "version.json")):
+        return
+    print(f"[FAISS MANAGER] Converting partition {partition.name} {version} to a chunk store...")
+    vectorstore = FAISS.load_local(os.path.join(path, "faiss_index"), embedding_model, allow_dangerous_deserialization=True)
+    publish_partition(partition.name, vectorstore)
+
+def _reader_store(index, chunk_store_path, rows):
+    """Read-only FAISS store serving `index`, with documents from the chunk store."""
+    return FAISS(embedding_model, index, ChunkDocstore(ChunkStore(chunk_store_path, readonly=True)), RowMap(rows))
+
+def _open_version(partition, version):
+    """
+    Open a published version as a snapshot, with its log replayed: vectors
+    mapped from disk in mmap mode, otherwise read into memory. Documents are
+    read from the chunk store as search hits need them in both modes.
+    """
+    path = os.path.join(partition.versions_dir, version)
+    generation = _generation(path)
+    index_file = os.path.join(path, "faiss_index", "index.faiss")
+    mapped = INDEX_LOAD_MODE == "mmap"
+    index = faiss.read_index(index_file, _mmap_flags(index_file) if mapped else 0)
+    rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r" if mapped else None)
+    vectorstore = _reader_store(index, _chunk_store_path(partition, generation), rows)
+    set_search_params(vectorstore.index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH)
+    metadata_index = MetadataIndex.load(path, rows, mmap=mapped)
+    return _replay(IndexSnapshot(partition.name, version, vectorstore, path, metadata_index, mapped))
+
+def _replay(snapshot):
+    """
+    Apply the records appended to the snapshot's log since it was made.
+    Returns a new snapshot sharing the version's index, or `snapshot` itself
+    if there is nothing new. Costs O(changes logged), not O(partition).
+    """
+    log = snapshot.log
+    records = list(read_records(_log_path(snapshot.path), log.offset))
+    if not records:
+        return snapshot
+    base = snapshot.vectorstore
+    rows, vectors, deleted = log.rows, log.vectors, log.deleted
+    for record in records:
+        if record.deleted.size:
+            kept = ~np.isin(rows, record.deleted)
+            rows, vectors = rows[kept], vectors[kept]
+            deleted = np.union1d(deleted, record.deleted[np.isin(record.deleted, base.index_to_docstore_id.rows)])
+        rows = np.concatenate([rows, record.added])
+        vectors = np.concatenate([vectors, record.vectors])
+    replayed = LogDelta(base.index.d)
+    replayed.offset = records[-1].end
+    replayed.first_time = log.first_time or records[0].timestamp
+    replayed.rows, replayed.vectors, replayed.deleted = rows, vectors, deleted
+    replayed.excluded = snapshot.metadata_index.positions(deleted)
+    if rows.size:
+        index = faiss.IndexFlat(base.index.d, base.index.metric_type)
+        index.add(vectors)
+        replayed.vectorstore = FAISS(
+            embedding_model, index, base.docstore, RowMap(rows),
+            normalize_L2=base._normalize_L2, distance_strategy=base.distance_strategy,
+        )
+        new_rows = rows[~np.isin(rows, log.rows)]
+        entries = ((row, doc.metadata) for row, doc in base.docstore.store.iter_documents(new_rows))
+        replayed.metadata_index = MetadataIndex(rows, entries, base=log.metadata_index)
+    return IndexSnapshot(
+        snapshot.partition, snapshot.version, base, snapshot.path, snapshot.metadata_index, snapshot.mapped, replayed,
+    )
+
+def _load(partition):
+    """Load the partition's published version. Returns False if it has none."""
+    with partition.load_lock:
+        if partition.snapshot is not None:
+            return True
+        for _ in range(3):
+            version = _read_pointer(partition)
+            if not version:
+                return False
+            print(f"[FAISS MANAGER] Loading partition {partition.name} version {version} ({INDEX_LOAD_MODE})")
+            try:
+                snapshot = _open_version(partition, version)
+                break
+            except (FileNotFoundError, RuntimeError, sqlite3.OperationalError):
+                # Republished and garbage-collected by another process since
+                # CURRENT was read; read it again.
+                if _read_pointer(partition) == version:
+                    raise
+        else:
+            return False
+        with _LOCK:
+            if partition.snapshot is None:
+                partition.snapshot = snapshot
+                _LRU[partition.name] = None
+                _LRU.move_to_end(partition.name)
+        print(f"[FAISS MANAGER] Partition {partition.name} {version} loaded "
+              f"({snapshot.size} vectors, ~{snapshot.nbytes // 2**20} MB).")
+    _evict()
+    return True
+
+def _evict():
+    """Drop least recently used, unpinned partitions until within the memory budget."""
+    budget = INDEX_MEMORY_BUDGET_MB * 2**20
+    if budget <= 0:
+        return
+    with _LOCK:
+        loaded = [_PARTITIONS[name] for name in _LRU if name in _PARTITIONS]
+        total = sum(partition.snapshot.nbytes for partition in loaded if partition.snapshot)
+        # The most recently used partition always stays, even if it alone is over budget.
+        for partition in loaded[:-1]:
+            if total <= budget:
+                break
+            snapshot = partition.snapshot
+            if snapshot is None or snapshot.readers > 0:
+                continue
+            partition.snapshot = None
+            del _LRU[partition.name]
+            total -= snapshot.nbytes
+            print(f"[FAISS MANAGER] Evicted partition {partition.name} from memory.")
+
+def _refresh(partition):
+    """
+    Retire the loaded snapshot if another process has published a newer
+    version; otherwise catch it up with records appended to its log since.
+    """
+    try:
+        stat = os.stat(partition.pointer)
+    except FileNotFoundError:
+        return
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if key != partition.pointer_stat:
+        version = _read_pointer(partition)
+        with _LOCK:
+            partition.pointer_stat = key
+            snapshot = partition.snapshot
+            republished = snapshot is not None and snapshot.version != version
+            if republished:
+                partition.retired.append(snapshot)
+                partition.snapshot = None
+                _LRU.pop(partition.name, None)
+        if republished:
+            print(f"[FAISS MANAGER] Partition {partition.name} was republished as {version}.")
+            return
+    _catch_up(partition)
+
+def _catch_up(partition):
+    """Replace the loaded snapshot with one that includes its log's new records."""
+    snapshot = partition.snapshot
+    if snapshot is None:
+        return
+    try:
+        if os.path.getsize(_log_path(snapshot.path)) <= snapshot.log.offset:
+            return
+    except FileNotFoundError:
+        return
+    with partition.load_lock:
+        snapshot = partition.snapshot
+        if snapshot is None:
+            return
+        replayed = _replay(snapshot)
+        with _LOCK:
+            if replayed is snapshot or partition.snapshot is not snapshot:
+                return
+            partition.retired.append(snapshot)
+            partition.snapshot = replayed
+
+@contextmanager
+def acquire_partition(name):
+    """
+    Pin the current snapshot of partition `name` for the duration of a query,
+    loading it first if needed:
+
+        with acquire_partition("Work_Order_Documents") as snapshot:
+            if snapshot: snapshot.vectorstore.similarity_search(...)
+
+    A concurrent publish does not affect the pinned snapshot; it is neither
+    evicted nor garbage-collected until every reader has released it.
+    """
+    partition = _get_partition(name)
+    snapshot = None
+    if partition is not None:
+        _refresh(partition)
+    while partition is not None:
+        with _LOCK:
+            snapshot = partition.snapshot
+            if snapshot is not None:
+                snapshot.readers += 1
+                if name in _LRU:
+                    _LRU.move_to_end(name)
+                break
+        if not _load(partition):
+            break
+    try:
+        yield snapshot
+    finally:
+        if snapshot is not None:
+            with _LOCK:
+                snapshot.readers -= 1
+            if snapshot is not partition.snapshot:
+                _gc_versions(partition)
+            _evict()
+
+def clone_faiss_index(vectorstore, index=None, base_index=None):
+    """
+    Return a writable copy of a store served from a chunk store: its index
+    (or `index`, if given) plus its position -> row map. Documents are not
+    copied; new chunks are appended to the same chunk store. `base_index` is
+    the store's MetadataIndex, which publishing then updates incrementally.
+    """
+    rows = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    return FAISS(
+        vectorstore.embedding_function,
+        index if index is not None else faiss.clone_index(vectorstore.index),
+        ChunkDocstore(ChunkStore(vectorstore.docstore.store.path), base_index),
+        dict(enumerate(rows)),
+        normalize_L2=vectorstore._normalize_L2,
+        distance_strategy=vectorstore.distance_strategy,
+    )
+
+def _fold_log(snapshot):
+    """A writable copy of the snapshot's version with its logged changes applied."""
+    # Mapped indexes can only be cloned as read-only views; read a private copy.
+    index = faiss.read_index(os.path.join(snapshot.path, "faiss_index", "index.faiss")) if snapshot.mapped else None
+    vectorstore = clone_faiss_index(snapshot.vectorstore, index, snapshot.metadata_index)
+    log = snapshot.log
+    if log.deleted.size:
+        delete_from_store(vectorstore, log.deleted.tolist())
+    if log.rows.size:
+        docstore = vectorstore.docstore
+        docstore.added.update((row, doc.metadata) for row, doc in docstore.store.iter_documents(log.rows))
+        start = vectorstore.index.ntotal
+        vectorstore.index.add(log.vectors)
+        vectorstore.index_to_docstore_id.update({start + i: int(row) for i, row in enumerate(log.rows)})
+    return vectorstore
+
+def _write_chunks(partition, version, vectorstore):
+    """
+    Make sure every chunk of `vectorstore` is in a chunk store. Returns
+    (chunk store generation, rows in position order, MetadataIndex). Stores
+    cloned from a published version only wrote their new chunks, on append;
+    other stores (full rebuilds) are written to a new generation.
+    """
+    docstore = vectorstore.docstore
+    if isinstance(docstore, ChunkDocstore):
+        if not os.path.exists(docstore.store.path):
+            raise RuntimeError(f"Chunk store {docstore.store.path} was removed by a concurrent rebuild.")
+        generation = os.path.splitext(os.path.basename(docstore.store.path))[0]
+        rows = np.asarray([vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)], dtype=np.int64)
+        if docstore.base_index is not None:
+            entries = docstore.added.items()
+        else:
+            entries = ((row, doc.metadata) for row, doc in docstore.store.iter_documents(rows))
+        return generation, rows, MetadataIndex(rows, entries, base=docstore.base_index)
+    ordered = sorted(vectorstore.index_to_docstore_id.items())
+    docs = [docstore.search(doc_id) for _, doc_id in ordered]
+    store = ChunkStore(_chunk_store_path(partition, version))
+    try:
+        rows = store.append(docs, [doc_id for _, doc_id in ordered])
+    finally:
+        store.close()
+    return version, rows, MetadataIndex(rows, zip(rows.tolist(), (doc.metadata for doc in docs)))
+
+def publish_partition(name, vectorstore, base=None):
+    """
+    Publish `vectorstore` as a new version of partition `name`: write it to its
+    own directory, atomically repoint CURRENT, then swap the in-memory snapshot.
+    `vectorstore` must not be modified after this call. Large flat stores are
+    first rebuilt as the configured index type (see build_partition_index).
+
+    `base` is the snapshot a compaction folded into `vectorstore`: records
+    logged against its version after that snapshot are carried over to the
+    new version's log, and PublishConflict is raised if CURRENT no longer
+    points at its version.
+    """
+    vectorstore = build_partition_index(vectorstore)
+    version = _new_version_name()
+    with _LOCK:
+        partition = _PARTITIONS.get(name)
+        if partition is None:
+            partition = _PARTITIONS[name] = IndexPartition(name)
+        partition.in_progress.add(version)
+    path = os.path.join(partition.versions_dir, version)
+    try:
+        generation, rows, metadata_index = _write_chunks(partition, version, vectorstore)
+        write_index_version(path, vectorstore.index, rows, metadata_index, generation)
+        with locked(partition.lock_file):
+            if base is not None:
+                if _read_pointer(partition) != base.version:
+                    raise PublishConflict(f"Partition {name} was republished during compaction.")
+                copy_tail(_log_path(base.path), base.log.offset, _log_path(path))
+            _write_pointer(partition, version)
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        remove_chunk_store(_chunk_store_path(partition, version))
+        raise
+    finally:
+        with _LOCK:
+            partition.in_progress.discard(version)
+    if INDEX_LOAD_MODE == "mmap":
+        # Serve the files just written, so the in-memory copy can be freed.
+        snapshot = _open_version(partition, version)
+    else:
+        vectorstore = _reader_store(vectorstore.index, _chunk_store_path(partition, generation), rows)
+        snapshot = _replay(IndexSnapshot(name, version, vectorstore, path, metadata_index))
+    with _LOCK:
+        if partition.snapshot is not None:
+            partition.retired.append(partition.snapshot)
+        partition.snapshot = snapshot
+        _LRU[name] = None
+        _LRU.move_to_end(name)
+    print(f"[FAISS MANAGER] Published partition {name} version {version}.")
+    _gc_versions(partition)
+    _evict()
+
+def drop_partition(name):
+    """Unpublish partition `name`; its files are removed once no reader holds them."""
+    with _LOCK:
+        partition = _PARTITIONS.pop(name, None)
+        if partition is None:
+            return
+        _LRU.pop(name, None)
+        if partition.snapshot is not None:
+            partition.retired.append(partition.snapshot)
+            partition.snapshot = None
+    try:
+        os.remove(partition.pointer)
+    except FileNotFoundError:
+        pass
+    print(f"[FAISS MANAGER] Dropped partition {name}.")
+    _gc_versions(partition)
+
+def _gc_versions(partition):
+    """
+    Delete the partition's version directories that are neither current nor
+    pinned by a reader. Versions newer than CURRENT are left alone: another
+    process may be writing them.
+    """
+    with _LOCK:
+        keep = {partition.snapshot.version} if partition.snapshot else set()
+        keep.update(partition.in_progress)
+        still_read = [snap for snap in partition.retired if snap.readers > 0]
+        partition.retired[:] = still_read
+        keep.update(snap.version for snap in still_read)
+        pointer = _read_pointer(partition)
+        if pointer:
+            keep.add(pointer)
+    if not os.path.isdir(partition.versions_dir):
+        return
+
+    def newer(name):
+        return bool(pointer) and _version_time(name) > _version_time(pointer)
+
+    generations = set()
+    for name in os.listdir(partition.versions_dir):
+        if name not in keep and not newer(name):
+            shutil.rmtree(os.path.join(partition.versions_dir, name), ignore_errors=True)
+            print(f"[FAISS MANAGER] Removed old index version {partition.name}/{name}.")
+            continue
+        try:
+            with open(os.path.join(partition.versions_dir, name, "version.json")) as f:
+                generations.add(json.load(f)["chunks"])
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+    chunks_dir = os.path.join(partition.path, "chunks")
+    if os.path.isdir(chunks_dir):
+        for filename in os.listdir(chunks_dir):
+            generation = filename.split(".", 1)[0]
+            if filename.endswith(".sqlite") and generation not in generations and not newer(generation):
+                remove_chunk_store(os.path.join(chunks_dir, filename))
+                print(f"[FAISS MANAGER] Removed unused chunk store {partition.name}/{generation}.")
+    if not keep and _get_partition(partition.name) is None:
+        shutil.rmtree(partition.path, ignore_errors=True)
+
+def make_vector_id(s3_key, chunk_index):
+    """Stable docstore ID for a chunk, derived from its S3 key."""
+    return f"{s3_key}#{chunk_index}"
+
+def _rows_for_sources(snapshot, s3_keys):
+    """
+    Live chunk rows of a snapshot that came from any of `s3_keys`, looked up in
+    the chunk store's source index. Chunks indexed before S3 keys were recorded
+    (no `s3_key` metadata) are matched by their bare filename instead.
+    """
+    sources = list(s3_keys) + [os.path.basename(s3_key) for s3_key in s3_keys]
+    rows = snapshot.vectorstore.docstore.store.rows_for_sources(sources)
+    published = np.isin(rows, snapshot.vectorstore.index_to_docstore_id.rows) & ~np.isin(rows, snapshot.log.deleted)
+    return rows[published | np.isin(rows, snapshot.log.rows)]
+
+def _build_store(docs, ids, vectors):
+    text_embeddings = [(doc.page_content, vector) for doc, vector in zip(docs, vectors)]
+    return FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=[doc.metadata for doc in docs], ids=ids)
+
+def _log_update(name, s3_keys, docs, ids, vectors):
+    """
+    Apply one partition's share of an update by appending it to the log of
+    the published version: the new chunks go to the version's chunk store,
+    and one record lists the rows of `s3_keys` to delete plus the new rows
+    and their vectors. Returns (vectors removed, vectors added), or None if
+    the partition has no published version.
+    """
+    partition = _get_partition(name)
+    for _ in range(3):
+        with acquire_partition(name) as snapshot:
+            if snapshot is None:
+                return None
+            deleted = _rows_for_sources(snapshot, s3_keys) if s3_keys else np.empty(0, dtype=np.int64)
+            if not (deleted.size or docs):
+                return 0, 0
+            dim = snapshot.vectorstore.index.d
+            vectors = np.asarray(vectors, dtype=np.float32).reshape(len(docs), dim)
+            if snapshot.vectorstore._normalize_L2:
+                faiss.normalize_L2(vectors)
+            chunk_store_path = snapshot.vectorstore.docstore.store.path
+            rows = np.empty(0, dtype=np.int64)
+            if docs and os.path.exists(chunk_store_path):
+                store = ChunkStore(chunk_store_path)
+                try:
+                    rows = store.append(docs, ids)
+                finally:
+                    store.close()
+            with locked(partition.lock_file):
+                # A compaction may have published since the snapshot was taken;
+                # its version shares the chunk store, so log against it instead.
+                version = _read_pointer(partition)
+                if not version:
+                    return None
+                path = os.path.join(partition.versions_dir, version)
+                if len(rows) == len(docs) and _generation(path) == _generation(snapshot.path):
+                    size = append_record(_log_path(path), deleted, rows, vectors, dim)
+                    break
+        # A full rebuild replaced the chunk store; rows appended above stay unreferenced.
+        _refresh(partition)
     else:
-        print("[FAISS MANAGER] No FAISS index found on disk.")
-        _VECTORSTORE, _DOCS = None, None
+        raise RuntimeError(f"Partition {name} kept being rebuilt; update not applied.")
+    print(f"[FAISS MANAGER] Logged {len(deleted)} deletions and {len(docs)} additions "
+          f"to {name} (log {size / 2**20:.1f} MB).")
+    _refresh(partition)
+    if INDEX_WAL_MAX_MB <= 0:
+        compact_partition(name)
+    elif size >= INDEX_WAL_MAX_MB * 2**20:
+        _COMPACT_WAKE.set()
+    return len(deleted), len(docs)
+
+def update_index(stale_keys=(), batches=()):
+    """
+    Apply one update across partitions: drop every chunk of `stale_keys`, then
+    add `batches` of (docs, ids, vectors). A published partition gets the
+    change appended to its log (see _log_update) and is compacted later; a
+    new partition is built and published. Other partitions are not loaded.
+    Returns (vectors removed, vectors added).
+    """
+    changes = {}
+    has_uncategorized = UNCATEGORIZED in list_partitions()
+    for s3_key in stale_keys:
+        changes.setdefault(partition_for_key(s3_key), ([], []))[0].append(s3_key)
+        # Legacy copies without an S3 key live in the uncategorized partition.
+        if has_uncategorized:
+            changes.setdefault(UNCATEGORIZED, ([], []))[0].append(s3_key)
+    for docs, ids, vectors in batches:
+        for name, batch in group_by_partition(docs, ids, vectors).items():
+            changes.setdefault(name, ([], []))[1].append(batch)
+
+    removed = added = 0
+    for name, (keys, partition_batches) in changes.items():
+        docs, ids, vectors = [], [], []
+        for batch_docs, batch_ids, batch_vectors in partition_batches:
+            docs += batch_docs
+            ids += batch_ids
+            vectors += list(batch_vectors)
+        logged = _log_update(name, keys, docs, ids, vectors)
+        if logged is None:
+            if docs:
+                publish_partition(name, _build_store(docs, ids, vectors))
+            logged = (0, len(docs))
+        removed += logged[0]
+        added += logged[1]
+    return removed, added
+
+def compact_partition(name):
+    """
+    Fold partition `name`'s log into a new version, so that loading it no
+    longer replays the log. Records logged while the new version is built
+    are carried over to its log. Only one thread or process compacts a
+    partition at a time; returns True if a new version was published.
+    """
+    partition = _get_partition(name)
+    if partition is None:
         return False
+    with locked(partition.compact_lock_file, blocking=False) as acquired:
+        if not acquired:
+            return False
+        with acquire_partition(name) as snapshot:
+            if snapshot is None or not snapshot.log.offset:
+                return False
+            started = time.time()
+            vectorstore = _fold_log(snapshot)
+            if not vectorstore.index.ntotal:
+                return _drop_emptied(partition, snapshot)
+            try:
+                publish_partition(name, vectorstore, base=snapshot)
+            except PublishConflict as error:
+                print(f"[FAISS MANAGER] Compaction of {name} abandoned: {error}")
+                return False
+            print(f"[FAISS MANAGER] Compacted {name}: {len(snapshot.log.deleted)} deletions and "
+                  f"{len(snapshot.log.rows)} additions folded in {time.time() - started:.1f}s.")
+    return True
 
+def _drop_emptied(partition, snapshot):
+    """Drop a partition whose log deletes everything, unless more was logged meanwhile."""
+    with locked(partition.lock_file):
+        if _read_pointer(partition) != snapshot.version:
+            return False
+        if os.path.getsize(_log_path(snapshot.path)) != snapshot.log.offset:
+            return False
+        drop_partition(partition.name)
+    return True
 
-def get_faiss_index():
+def _compaction_due(name):
+    partition = _get_partition(name)
+    version = _read_pointer(partition) if partition is not None else None
+    if not version:
+        return False
+    path = _log_path(os.path.join(partition.versions_dir, version))
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return False
+    if not size:
+        return False
+    if size >= INDEX_WAL_MAX_MB * 2**20:
+        return True
+    logged_at = first_timestamp(path)
+    return logged_at is not None and time.time() - logged_at >= INDEX_WAL_MAX_AGE_SECONDS
+
+def _run_compactor():
+    while True:
+        _COMPACT_WAKE.wait(INDEX_COMPACT_INTERVAL_SECONDS)
+        _COMPACT_WAKE.clear()
+        for name in list_partitions():
+            try:
+                if _compaction_due(name):
+                    compact_partition(name)
+            except Exception:
+                print(f"[FAISS MANAGER] Compaction of {name} failed:")
+                traceback.print_exc()
+
+def start_compactor():
     """
-    Returns the loaded FAISS index, or None if not loaded.
+    Start the background thread that compacts a partition's log once it
+    reaches INDEX_WAL_MAX_MB or its oldest record INDEX_WAL_MAX_AGE_SECONDS.
     """
-    return _VECTORSTORE
+    global _COMPACTOR
+    with _LOCK:
+        if _COMPACTOR is not None:
+            return
+        _COMPACTOR = threading.Thread(target=_run_compactor, name="index-compactor", daemon=True)
+    _COMPACTOR.start()
 
-def get_docs():
-    return _DOCS
+def new_chunk_store_path(name):
+    """Path of a new chunk store generation, for a full rebuild of partition `name`."""
+    return _chunk_store_path(IndexPartition(name), _new_version_name())
 
-def save_faiss_index(vectorstore, docs):
+def built_store(index, rows, chunk_store_path):
     """
-    Save the FAISS index and document metadata, then update in-memory singleton.
+    A store to publish over a freshly built `index` whose positions hold the
+    chunks at `rows` of the chunk store at `chunk_store_path` (see
+    ShardedIndexWriter).
     """
-    index_path = VECTORSTORE_PATH
-    docs_path = os.path.join(os.path.dirname(index_path), "docs.pkl")
-    vectorstore.save_local(index_path)
-    with open(docs_path, "wb") as f:
-        pickle.dump(docs, f)
-    print("[FAISS MANAGER] Index and docs saved to disk.")
-    # Refresh the singleton
-    global _VECTORSTORE, _DOCS
-    _VECTORSTORE = vectorstore
-    _DOCS = docs
+    return _reader_store(index, chunk_store_path, rows)
 
-def reset_faiss_index():
+def replace_index(stores):
     """
-    Clears the in-memory index and docs.
+    Publish a complete rebuild: {partition: vectorstore}, or an iterable of
+    (partition, vectorstore) pairs. Partitions not among them are dropped.
+    Each partition switches over independently, before the next pair is
+    taken, so a generator of stores only needs one of them in memory at a time.
     """
-    global _VECTORSTORE, _DOCS
-    _VECTORSTORE, _DOCS = None, None
+    published = set()
+    for name, vectorstore in (stores.items() if isinstance(stores, dict) else stores):
+        publish_partition(name, vectorstore)
+        published.add(name)
+        del vectorstore
+    for name in set(list_partitions()) - published:
+        drop_partition(name)
+
+def delete_by_sources(s3_keys):
+    """
+    Remove every chunk of the given S3 keys from the affected partitions.
+    Returns the number of vectors removed.
+    """
+    return update_index(stale_keys=s3_keys)[0]
+
+def delete_by_source(s3_key):
+    """Remove every chunk of a single S3 key. See delete_by_sources."""
+    return delete_by_sources([s3_key])
 
+def replace_by_source(s3_key, chunks, vectors=None):
+    """
+    Replace all chunks of `s3_key` with `chunks` (re-upload of a document), as
+    one logged change of the affected partition. Chunks get stable IDs from make_vector_id,
+    so replacing never leaves duplicates behind. `vectors` are the chunks'
+    embeddings if already computed. Returns the new vector IDs.
+    """
+    ids = [make_vector_id(s3_key, i) for i in range(len(chunks))]
+    if vectors is None:
+        vectors = embedding_model.embed_documents([doc.page_content for doc in chunks]) if chunks else []
+    update_index(stale_keys=[s3_key], batches=[(chunks, ids, vectors)] if chunks else [])
+    return ids
+
+def index_stats():
+    """Loaded partitions and their estimated memory use."""
+    with _LOCK:
+        loaded = {
+            name: {
+                "version": p.snapshot.version,
+                "vectors": p.snapshot.size,
+                "logged": {"added": len(p.snapshot.log.rows), "deleted": len(p.snapshot.log.deleted)},
+                "mb": round(p.snapshot.nbytes / 2**20, 1),
+            }
+            for name, p in _PARTITIONS.items() if p.snapshot is not None
+        }
+        return {
+            "partitions": sorted(_PARTITIONS),
+            "loaded": loaded,
+            "loaded_mb": round(sum(p["mb"] for p in loaded.values()), 1),
+            "budget_mb": INDEX_MEMORY_BUDGET_MB,
+            "load_mode": INDEX_LOAD_MODE,
+        }
+
+def reset_faiss_index():
+    """
+    Drops all loaded partitions from memory; they are reloaded on next use.
+    """
+    with _LOCK:
+        for partition in _PARTITIONS.values():
+            partition.snapshot = None
+        _LRU.clear()
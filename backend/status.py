@@ -3,12 +3,14 @@
 import datetime
 from typing import Optional, Dict, Any
 
-indexing_status: Dict[str, Any] = {}
+# Each indexing run (a reindex job, an upload, an S3 sync) has its own status
+# dict, which the helpers below take as their first argument. The run started
+# most recently is the one get_indexing_status() reports.
+_latest_status: Optional[Dict[str, Any]] = None
 
-def reset_indexing_status():
-    """Reset the indexing status to initial state."""
-    global indexing_status
-    indexing_status = {
+def new_indexing_status() -> Dict[str, Any]:
+    """Return a fresh status dict in its initial state."""
+    return {
         "current": 0,
         "total": 0,
         "running": False,
@@ -20,25 +22,24 @@ def reset_indexing_status():
         "fail_count": 0
     }
 
-reset_indexing_status()  # Initialize on import
-
-def set_indexing_status(updates: dict):
-    """Update the global indexing status with new values."""
-    global indexing_status
-    indexing_status.update(updates)
+def set_indexing_status(status: Dict[str, Any], updates: dict):
+    """Update `status` with new values."""
+    status.update(updates)
     # If "running" changes to False, set end_time
     if "running" in updates and not updates["running"]:
-        indexing_status["end_time"] = datetime.datetime.utcnow().isoformat()
+        status["end_time"] = datetime.datetime.utcnow().isoformat()
 
-def update_indexing_status(**kwargs):
+def update_indexing_status(status: Dict[str, Any], /, **kwargs):
     """
     Update any part of the status.
-    Usage: update_indexing_status(current=5) or update_indexing_status(current=3, running=True)
+    Usage: update_indexing_status(status, current=5) or update_indexing_status(status, current=3, running=True)
     """
-    set_indexing_status(kwargs)
+    set_indexing_status(status, kwargs)
 
-def start_indexing(total: int):
-    set_indexing_status({
+def start_indexing(status: Dict[str, Any], total: int):
+    """Start a run on `status`, which get_indexing_status() reports from now on."""
+    global _latest_status
+    set_indexing_status(status, {
         "running": True,
         "current": 0,
         "total": total,
@@ -49,52 +50,54 @@ def start_indexing(total: int):
         "last_error": None,
         "current_file": None
     })
+    _latest_status = status
 
-def finish_indexing():
-    set_indexing_status({
+def finish_indexing(status: Dict[str, Any]):
+    set_indexing_status(status, {
         "running": False,
         "end_time": datetime.datetime.utcnow().isoformat()
     })
 
 def get_indexing_status() -> dict:
-    return indexing_status
+    """Status of the most recently started run (a fresh status if none has started)."""
+    return _latest_status if _latest_status is not None else new_indexing_status()
 
-def is_indexing_running() -> bool:
-    return indexing_status.get("running", False)
+def is_indexing_running(status: Dict[str, Any]) -> bool:
+    return status.get("running", False)
 
-def set_indexing_running(running: bool):
-    update_indexing_status(running=running)
+def set_indexing_running(status: Dict[str, Any], running: bool):
+    update_indexing_status(status, running=running)
     if running:
-        indexing_status["start_time"] = datetime.datetime.utcnow().isoformat()
-        indexing_status["end_time"] = None
+        status["start_time"] = datetime.datetime.utcnow().isoformat()
+        status["end_time"] = None
     else:
-        indexing_status["end_time"] = datetime.datetime.utcnow().isoformat()
+        status["end_time"] = datetime.datetime.utcnow().isoformat()
 
-def set_indexing_current_file(filename: str):
-    update_indexing_status(current_file=filename)
+def set_indexing_current_file(status: Dict[str, Any], filename: str):
+    update_indexing_status(status, current_file=filename)
 
-def set_indexing_total(total: int):
-    update_indexing_status(total=total)
+def set_indexing_total(status: Dict[str, Any], total: int):
+    update_indexing_status(status, total=total)
 
-def increment_indexing_current():
-    indexing_status["current"] += 1
+def increment_indexing_current(status: Dict[str, Any]):
+    status["current"] += 1
 
-def increment_indexing_success():
-    indexing_status["success_count"] += 1
+def increment_indexing_success(status: Dict[str, Any]):
+    status["success_count"] += 1
 
-def increment_indexing_fail():
-    indexing_status["fail_count"] += 1
+def increment_indexing_fail(status: Dict[str, Any]):
+    status["fail_count"] += 1
 
-def set_indexing_error(error: str):
-    update_indexing_status(last_error=error, running=False, end_time=datetime.datetime.utcnow().isoformat())
+def set_indexing_error(status: Dict[str, Any], error: str):
+    update_indexing_status(status, last_error=error, running=False, end_time=datetime.datetime.utcnow().isoformat())
 
-def get_indexing_summary() -> dict:
+def get_indexing_summary(status: Dict[str, Any]) -> dict:
     return {
-        "total_files": indexing_status["total"],
-        "indexed_files": indexing_status["success_count"],
-        "failed_files": indexing_status["fail_count"],
-        "current_file": indexing_status["current_file"],
-        "last_error": indexing_status["last_error"],
-        "start_time": indexing_status["start_time"],
-        "end_time": indexing_status["end_time"]
+        "total_files": status["total"],
+        "indexed_files": status["success_count"],
+        "failed_files": status["fail_count"],
+        "current_file": status["current_file"],
+        "last_error": status["last_error"],
+        "start_time": status["start_time"],
+        "end_time": status["end_time"]
     }
@@ -1,9 +1,10 @@
 # /backend/utils/chunking.py
 
 import os
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.schema import Document
+from utils.metadata_extractor import metadata_extractor
+from utils.pdf_parser import load_pdf_pages
 
 def get_temp_path(filename):
     """Create and return a temp file path in ./tmp/."""
@@ -13,14 +14,34 @@ def get_temp_path(filename):
 
 def load_and_split_pdf(local_path, chunk_size=1000, chunk_overlap=200):
     """
-    Load a PDF and split it into chunks.
+    Load a PDF (through the parsed-PDF cache) and split it into chunks.
     Returns: list of Document chunks
     """
-    loader = PyPDFLoader(local_path)
-    docs = loader.load()
+    docs = load_pdf_pages(local_path)
     splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     return splitter.split_documents(docs)
 
+def enrich_chunk_metadata(chunks, filename, s3_key=None, category=None):
+    """
+    Tag each chunk with its source and the SAP fields found by the shared
+    metadata extractor (asset ID, failure type, date, handled by, ...).
+    """
+    for chunk in chunks:
+        chunk.metadata["source"] = filename
+        if s3_key:
+            chunk.metadata["s3_key"] = s3_key
+        if category:
+            chunk.metadata["category"] = category
+
+    return metadata_extractor.enrich(chunks)
+
+def load_split_and_enrich_s3_pdf(local_path, s3_object):
+    """Parse, split and enrich a downloaded S3 PDF."""
+    chunks = load_and_split_pdf(local_path)
+    return enrich_chunk_metadata(
+        chunks, s3_object["filename"], s3_key=s3_object["key"], category=s3_object.get("folder")
+    )
+
 def merge_chunks_to_single_doc(chunks, metadata=None):
     """
     Combine multiple Document chunks into a single Document.
@@ -0,0 +1,101 @@
+# /backend/utils/metadata_extractor.py
+
+import os
+import re
+
+# A field is a label followed by separators (whitespace/colons) and a value:
+#     <label>[\s:]+(<value>)
+# e.g. "Failure Type: Bearing Wear" -> failure_type = "Bearing Wear".
+# `anchors` are plain substrings every match must start with; they let the
+# extractor skip straight to the first candidate with str.find.
+DEFAULT_FIELDS = [
+    {"name": "asset_id", "label": r"Equipment|Asset", "value": r"[\w\-]+", "anchors": ["Equipment", "Asset"]},
+    {"name": "failure_type", "label": r"Failure Type", "value": r"[A-Za-z\s]+", "anchors": ["Failure Type"]},
+    {"name": "date", "label": r"Date", "value": r"\d{4}-\d{2}-\d{2}", "anchors": ["Date"]},
+    {"name": "handled_by", "label": r"Handled By", "value": r"[A-Za-z\s.]+", "anchors": ["Handled By"]},
+]
+
+# Additional SAP fields, enabled by name through METADATA_EXTRA_FIELDS,
+# e.g. METADATA_EXTRA_FIELDS=order_number,notification_number,functional_location
+SAP_OPTIONAL_FIELDS = {
+    "order_number": {
+        "label": r"(?:Maintenance |Work |PM )?Order(?: No\.?| Number| #)?",
+        "value": r"\d{6,12}",
+        "anchors": ["Maintenance Order", "Work Order", "PM Order", "Order"],
+    },
+    "notification_number": {
+        "label": r"Notification(?: No\.?| Number| #)?",
+        "value": r"\d{6,12}",
+        "anchors": ["Notification"],
+    },
+    "functional_location": {
+        "label": r"Functional Location|Func\. ?Loc\.?|FLOC",
+        "value": r"[A-Z0-9][A-Z0-9\-/.]*",
+        "anchors": ["Functional Location", "Func.", "FLOC"],
+    },
+}
+
+
+class MetadataExtractor:
+    """
+    Extracts SAP fields (asset ID, failure type, date, ...) from chunk text.
+
+    Each field's pattern is compiled once. For every field, the first
+    occurrence of any of its anchors is located with str.find, and the
+    compiled pattern is searched from there, so text before the first
+    candidate is never run through the regex engine and fields whose label
+    is absent cost one substring scan. Results are identical to calling
+    re.search once per field on the whole text.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = list(fields if fields is not None else DEFAULT_FIELDS)
+        self._compiled = [
+            (
+                field["name"],
+                re.compile(rf"(?:{field['label']})[\s:]+({field['value']})"),
+                tuple(field.get("anchors") or ()),
+            )
+            for field in self.fields
+        ]
+
+    def extract(self, text):
+        """Return {field name: value} for the fields present in `text`."""
+        found = {}
+        for name, pattern, anchors in self._compiled:
+            start = 0
+            if anchors:
+                hits = [i for i in (text.find(anchor) for anchor in anchors) if i >= 0]
+                if not hits:
+                    continue
+                start = min(hits)
+            match = pattern.search(text, start)
+            if match:
+                found[name] = match.group(1).strip()
+        return found
+
+    def extract_many(self, texts):
+        """Batch form of extract(), e.g. over all pages or chunks of a PDF."""
+        extract = self.extract
+        return [extract(text) for text in texts]
+
+    def enrich(self, docs):
+        """Add extracted fields to each Document's metadata in place."""
+        for doc, fields in zip(docs, self.extract_many([doc.page_content for doc in docs])):
+            doc.metadata.update(fields)
+        return docs
+
+
+def fields_from_env():
+    """DEFAULT_FIELDS plus any SAP_OPTIONAL_FIELDS named in METADATA_EXTRA_FIELDS."""
+    fields = list(DEFAULT_FIELDS)
+    for name in filter(None, (n.strip() for n in os.getenv("METADATA_EXTRA_FIELDS", "").split(","))):
+        if name in SAP_OPTIONAL_FIELDS:
+            fields.append({"name": name, **SAP_OPTIONAL_FIELDS[name]})
+        else:
+            print(f"[WARN] Unknown metadata field in METADATA_EXTRA_FIELDS: {name}")
+    return fields
+
+
+# Shared by every indexing path (and by worker processes, which build their own on import).
+metadata_extractor = MetadataExtractor(fields_from_env())
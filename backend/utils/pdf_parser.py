@@ -1,7 +1,62 @@
+# /backend/utils/pdf_parser.py
+
+import os
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders.blob_loaders import Blob
+from langchain_community.document_loaders.parsers.pdf import PyPDFParser
+from langchain.schema import Document
+from services.pdf_text_cache import PdfTextCache
+
+# Every PDF is parsed through load_pdf_pages(), which reuses earlier parses of
+# the same file from a disk cache. The settings are read from the environment
+# rather than config.py because the re-index pipeline's parse workers (and
+# build_index.py) use this module without the app config.
+PDF_TEXT_CACHE_PATH = os.getenv("PDF_TEXT_CACHE_PATH", os.path.join("vectorstore", "pdf_text_cache.sqlite"))
+PDF_TEXT_CACHE_MAX_MB = int(os.getenv("PDF_TEXT_CACHE_MAX_MB", "1024"))
+
+_cache = None
+
+
+def pdf_text_cache():
+    """This process's handle on the shared parsed-PDF cache, opened on first use."""
+    global _cache
+    if _cache is None:
+        _cache = PdfTextCache(PDF_TEXT_CACHE_PATH, PDF_TEXT_CACHE_MAX_MB * 2**20)
+    return _cache
+
+def load_pdf_pages(pdf_path):
+    """
+    One Document per page, as PyPDFLoader(pdf_path).load() returns them, but
+    only parsed if this exact file content has not been parsed before.
+    """
+    cache = pdf_text_cache()
+    return _cached_pages(cache, cache.key(pdf_path), lambda: PyPDFLoader(pdf_path).load(), pdf_path)
+
+def load_pdf_bytes(data, source):
+    """
+    load_pdf_pages() for a PDF held in memory (e.g. an upload), parsed
+    straight from the buffer. `source` is recorded as each page's source.
+    """
+    cache = pdf_text_cache()
+
+    def parse():
+        return list(PyPDFParser().lazy_parse(Blob.from_data(data, path=source)))
+
+    return _cached_pages(cache, cache.key_for_bytes(data), parse, source)
+
+def _cached_pages(cache, key, parse, source):
+    pages = cache.get(key)
+    if pages is None:
+        pages = parse()
+        cache.put(key, pages)
+        return pages
+    return [Document(page_content=page.page_content, metadata={"source": source, **page.metadata}) for page in pages]
 
 def parse_pdf_to_text(pdf_path):
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
+    docs = load_pdf_pages(pdf_path)
     # Concatenate all pages
     return "\n".join([doc.page_content for doc in docs])
+
+def parse_pdf_bytes_to_text(data, source):
+    """parse_pdf_to_text() for a PDF held in memory."""
+    return "\n".join(doc.page_content for doc in load_pdf_bytes(data, source))